@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Lightweight reading of the certificate fields the charm needs.
+
+Only the SHA-256 fingerprint, the subject common name and the end of the
+validity are required to manage a certificate in the LXD trust store, all of
+which can be had from the DER encoding without loading a full X.509
+implementation.
+"""
+
+import base64
+import binascii
+import calendar
+import hashlib
+from typing import Optional, Tuple
+
+# OID 2.5.4.3, commonName
+_COMMON_NAME_OID = b"\x55\x04\x03"
+# ASN.1 string types found in distinguished names and their encodings
+_STRING_ENCODINGS = {
+    0x0C: "utf-8",  # UTF8String
+    0x13: "ascii",  # PrintableString
+    0x14: "latin-1",  # TeletexString
+    0x16: "ascii",  # IA5String
+    0x1C: "utf-32-be",  # UniversalString
+    0x1E: "utf-16-be",  # BMPString
+}
+
+
+class CertificateError(ValueError):
+    """Raised when a certificate cannot be decoded."""
+
+
+def pem_body(cert: str) -> str:
+    """Return the base64 body of the first certificate of a PEM string."""
+    lines = iter(cert.splitlines())
+    for line in lines:
+        if "-----BEGIN CERTIFICATE-----" in line:
+            break
+    content = []
+    for line in lines:
+        if "-----END CERTIFICATE-----" in line:
+            break
+        content.append(line.strip())
+    return "".join(content)
+
+
+def der(cert: str) -> bytes:
+    """Return the DER encoding of the first certificate of a PEM string."""
+    body = pem_body(cert)
+    if not body:
+        raise CertificateError("no PEM certificate found")
+    try:
+        return base64.b64decode(body, validate=True)
+    except binascii.Error as e:
+        raise CertificateError("invalid PEM body: {}".format(e)) from e
+
+
+def fingerprint(der_cert: bytes) -> str:
+    """Return the SHA-256 fingerprint of a DER certificate, as LXD reports it."""
+    return hashlib.sha256(der_cert).hexdigest()
+
+
+def _read(data: bytes, offset: int) -> Tuple[int, int, int]:
+    """Read the DER element at offset, returning its tag and content bounds."""
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        start = offset + 2
+        if length & 0x80:
+            size = length & 0x7F
+            if not 0 < size <= 4:
+                raise CertificateError("unsupported DER length at {}".format(offset))
+            length = int.from_bytes(data[start : start + size], "big")
+            start += size
+    except IndexError as e:
+        raise CertificateError("truncated DER at {}".format(offset)) from e
+    end = start + length
+    if end > len(data):
+        raise CertificateError("truncated DER at {}".format(offset))
+    return tag, start, end
+
+
+def _children(data: bytes, start: int, end: int):
+    """Iterate over the elements contained in a constructed DER element."""
+    while start < end:
+        tag, content_start, content_end = _read(data, start)
+        yield tag, content_start, content_end
+        start = content_end
+
+
+def _tbs_fields(der_cert: bytes):
+    """Return the fields of the TBSCertificate, skipping the optional version."""
+    tag, start, end = _read(der_cert, 0)
+    if tag != 0x30:
+        raise CertificateError("certificate is not a DER sequence")
+    tag, start, end = _read(der_cert, start)
+    if tag != 0x30:
+        raise CertificateError("TBSCertificate is not a DER sequence")
+    fields = list(_children(der_cert, start, end))
+    if fields and fields[0][0] == 0xA0:
+        fields = fields[1:]
+    # serialNumber, signature, issuer, validity, subject, ...
+    if len(fields) < 5:
+        raise CertificateError("TBSCertificate is missing fields")
+    return fields
+
+
+def common_name(der_cert: bytes) -> Optional[str]:
+    """Return the first subject common name of a DER certificate, if any."""
+    _, start, end = _tbs_fields(der_cert)[4]
+    for _, rdn_start, rdn_end in _children(der_cert, start, end):
+        for _, attr_start, attr_end in _children(der_cert, rdn_start, rdn_end):
+            attr = list(_children(der_cert, attr_start, attr_end))
+            if len(attr) != 2 or attr[0][0] != 0x06:
+                raise CertificateError("malformed subject attribute")
+            (_, oid_start, oid_end), (value_tag, value_start, value_end) = attr
+            if der_cert[oid_start:oid_end] != _COMMON_NAME_OID:
+                continue
+            encoding = _STRING_ENCODINGS.get(value_tag)
+            if encoding is None:
+                raise CertificateError("unsupported string type {:#x}".format(value_tag))
+            try:
+                return der_cert[value_start:value_end].decode(encoding)
+            except UnicodeDecodeError as e:
+                raise CertificateError("invalid common name: {}".format(e)) from e
+    return None
+
+
+def _parse_time(tag: int, value: bytes) -> int:
+    """Return the Unix timestamp of an ASN.1 UTCTime or GeneralizedTime."""
+    try:
+        text = value.decode("ascii")
+        if tag == 0x17:
+            # UTCTime years 50 to 99 are 1950 to 1999
+            year = int(text[:2])
+            text = "{}{}".format(1900 + year if year >= 50 else 2000 + year, text[2:])
+        elif tag != 0x18:
+            raise CertificateError("unsupported time type {:#x}".format(tag))
+        if not text.endswith("Z"):
+            raise CertificateError("time is not in UTC: {}".format(text))
+        fields = (text[0:4], text[4:6], text[6:8], text[8:10], text[10:12], text[12:14])
+        return calendar.timegm(tuple(int(f) for f in fields) + (0, 0, 0))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise CertificateError("invalid time: {}".format(e)) from e
+
+
+def not_after(der_cert: bytes) -> int:
+    """Return the end of the validity of a DER certificate, as a Unix timestamp."""
+    _, start, end = _tbs_fields(der_cert)[3]
+    times = list(_children(der_cert, start, end))
+    if len(times) != 2:
+        raise CertificateError("malformed validity")
+    tag, value_start, value_end = times[1]
+    return _parse_time(tag, der_cert[value_start:value_end])
+
+
+def generate_client_certificate(common_name: str, days: int = 3650) -> Tuple[str, str]:
+    """Return a new self-signed ECDSA P-256 client certificate and its key, in PEM.
+
+    P-256 keys make far cheaper TLS handshakes than the RSA keys client
+    certificates usually come with.
+    """
+    import datetime
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return (
+        cert.public_bytes(serialization.Encoding.PEM).decode("ascii"),
+        key_pem.decode("ascii"),
+    )
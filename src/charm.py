@@ -9,7 +9,9 @@ import json
 import logging
 import subprocess
 
-from interface import Lxd
+import profiling
+from interface import METRICS_PATH, METRICS_TEXTFILE_PATH, Lxd
+from metrics import MetricsEndpoint, Registry
 from ops.charm import CharmBase
 from ops.main import main
 from ops.model import ActiveStatus, BlockedStatus
@@ -25,8 +27,14 @@ class LxdIntegratorCharm(CharmBase):
 
         self.framework.observe(self.on.install, self._on_install)
         self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.profile_hooks_action, self._on_profile_hooks_action)
+        self.framework.observe(self.on.get_profiles_action, self._on_get_profiles_action)
 
-        self.client = Lxd(self, "api")
+        self.metrics = Registry(METRICS_PATH, METRICS_TEXTFILE_PATH)
+        self.client = Lxd(self, "api", peer_relation_name="peers", metrics=self.metrics)
+        self.metrics_endpoint = MetricsEndpoint(
+            self, "metrics-endpoint", self.metrics, collect=self.client.collect_metrics
+        )
 
     def _on_install(self, event):
         if not self._check_credentials():
@@ -36,10 +44,58 @@ class LxdIntegratorCharm(CharmBase):
         if not self._check_credentials():
             return
 
+    def _on_profile_hooks_action(self, event):
+        profiling.enable(event.params["count"])
+        event.set_results({"remaining": event.params["count"]})
+
+    def _on_get_profiles_action(self, event):
+        names = profiling.profiles()
+        results = {
+            "directory": profiling.PROFILE_DIR,
+            "profiles": json.dumps(names),
+            "remaining": profiling.remaining(),
+        }
+        name = event.params.get("name") or (names[-1] if names else None)
+        if name:
+            if name not in names:
+                event.fail("no profile named {}".format(name))
+                return
+            results["summary"] = profiling.summary(name, event.params["limit"])
+        event.set_results(results)
+
     def _check_credentials(self):
-        if self.client.is_ready:
-            return
+        self.client.set_api_socket(self.model.config["lxd_api_socket"])
+        self.client.set_fallback_endpoints(self.model.config["lxd_fallback_endpoints"].split())
+        credentials = self._get_credentials()
+        token = self.model.config["lxd_trust_token"]
+        endpoint = self.model.config["lxd_endpoint"]
+        server_cert = self.model.config["lxd_server_cert"]
+        # Unchanged credentials are neither stored nor checked against LXD again
+        if credentials is not None:
+            changed = self.client.set_credentials(*credentials)
+        elif token and endpoint and server_cert:
+            changed = self.client.enroll(endpoint, server_cert, token)
+            if not self.client.is_ready:
+                self.model.unit.status = BlockedStatus(
+                    "Unable to enroll with the trust token, see the logs"
+                )
+                return False
+        elif self.client.is_ready:
+            # Set earlier and not taken away since
+            return True
+        else:
+            self.model.unit.status = BlockedStatus(
+                "Missing credentials access; grant with: juju trust"
+            )
+            return False
 
+        self.client.set_own_identity(self.model.config["own_client_identity"])
+        if changed:
+            self.model.unit.status = ActiveStatus()
+        return True
+
+    def _get_credentials(self):
+        """Return the LXD endpoint and credentials, from juju trust or the config."""
         try:
             result = subprocess.run(
                 ["credential-get", "--format=json"],
@@ -53,9 +109,7 @@ class LxdIntegratorCharm(CharmBase):
             client_key = creds["credential"]["attrs"]["client-key"]
             server_cert = creds["credential"]["attrs"]["server-cert"]
             if endpoint and client_cert and client_key and server_cert:
-                self.client.set_credentials(endpoint, client_cert, client_key, server_cert)
-                self.model.unit.status = ActiveStatus()
-                return True
+                return endpoint, client_cert, client_key, server_cert
         except json.JSONDecodeError as e:
             logger.warning("Failed to parse JSON from credentials-get: {}".format(e.msg))
         except FileNotFoundError:
@@ -69,15 +123,9 @@ class LxdIntegratorCharm(CharmBase):
         client_key = self.model.config["lxd_client_key"]
         server_cert = self.model.config["lxd_server_cert"]
         if endpoint and client_cert and client_key and server_cert:
-            self.client.set_credentials(endpoint, client_cert, client_key, server_cert)
-            self.model.unit.status = ActiveStatus()
-            return True
-
-        self.model.unit.status = BlockedStatus(
-            "Missing credentials access; grant with: juju trust"
-        )
-        return False
+            return endpoint, client_cert, client_key, server_cert
+        return None
 
 
 if __name__ == "__main__":
-    main(LxdIntegratorCharm)
+    profiling.run(lambda: main(LxdIntegratorCharm))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Tiny HTTP server exposing the metrics file written by the charm to Prometheus."""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    textfile = ""
+
+    def do_GET(self):  # noqa: N802
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            with open(self.textfile, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # No hook finished yet
+            data = b""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    """Serve the metrics file until terminated."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--textfile", required=True)
+    args = parser.parse_args()
+
+    _Handler.textfile = args.textfile
+    ThreadingHTTPServer(("", args.port), _Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
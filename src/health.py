@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Health probing of the LXD nodes published to requirers."""
+
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from http.client import HTTPConnection
+
+# Probe results kept per node to compute availability and latency
+PROBE_WINDOW = 10
+# Consecutive failed probes after which a node is reported unhealthy
+UNHEALTHY_AFTER = 2
+
+
+def probe(connect: Callable[[], "HTTPConnection"]) -> Optional[float]:
+    """Probe a node, returning its latency in milliseconds or None if it is down."""
+    import transport
+
+    start = time.monotonic()
+    try:
+        conn = connect()
+        try:
+            conn.request("GET", "/1.0")
+            response = conn.getresponse()
+            response.read()
+        finally:
+            conn.close()
+    except transport.TRANSPORT_ERRORS:
+        return None
+    if response.status >= 500:
+        return None
+    return (time.monotonic() - start) * 1000
+
+
+def probe_all(
+    targets: Dict[str, Callable[[], "HTTPConnection"]], workers: int
+) -> Dict[str, Optional[float]]:
+    """Probe nodes concurrently, at most workers at a time."""
+    if not targets:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(targets))) as pool:
+        results = pool.map(probe, targets.values())
+        return dict(zip(targets, results))
+
+
+class NodeHealth:
+    """Rolling probe results of a node.
+
+    Samples are latencies in milliseconds, or None for a failed probe, so that
+    they can be kept in the charm state between hooks.
+    """
+
+    def __init__(self, samples: Optional[List[Optional[float]]] = None):
+        self.samples = list(samples or [])[-PROBE_WINDOW:]
+
+    def record(self, latency: Optional[float]) -> None:
+        """Add the result of a probe."""
+        self.samples = (self.samples + [latency])[-PROBE_WINDOW:]
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the node answered any of its last few probes."""
+        recent = self.samples[-UNHEALTHY_AFTER:]
+        return any(sample is not None for sample in recent)
+
+    @property
+    def availability(self) -> float:
+        """Share of the probes in the window the node answered."""
+        if not self.samples:
+            return 0.0
+        return sum(sample is not None for sample in self.samples) / len(self.samples)
+
+    @property
+    def p50(self) -> Optional[float]:
+        """Median latency of the probes the node answered."""
+        latencies = [sample for sample in self.samples if sample is not None]
+        if not latencies:
+            return None
+        return statistics.median(latencies)
+
+    def summary(self) -> dict:
+        """Return what is published about the node to requirers.
+
+        The latency is rounded up to a power of two so that jitter between
+        probes does not rewrite the relation data, only real changes do.
+        """
+        summary = {"healthy": self.healthy}
+        if self.p50 is not None:
+            bucket = 1
+            while bucket < self.p50:
+                bucket *= 2
+            summary["latency_ms"] = bucket
+        return summary
@@ -5,44 +5,219 @@
 
 """Interfaces exposed by the LXD-Integrator Charm."""
 
-import io
+import hashlib
+import heapq
 import json
 import logging
+import math
 import os
-import ssl
-from http import client as httpclient
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
-from OpenSSL.crypto import FILETYPE_PEM, load_certificate
+import certificate
+from journal import CONFIRMED, INTENT, SENT, Journal
+from metrics import Registry
 from ops.charm import CharmBase, RelationChangedEvent, RelationJoinedEvent
 from ops.framework import Object, StoredState
+from ops.model import (
+    ActiveStatus,
+    MaintenanceStatus,
+    ModelError,
+    Relation,
+    SecretNotFoundError,
+    Unit,
+    WaitingStatus,
+)
+from ratelimit import TokenBucket
+from sharding import HashRing
+
+if TYPE_CHECKING:
+    import ssl
+    from http.client import HTTPConnection
+
+    import transport
 
 BASE_PATH = os.getenv("JUJU_CHARM_DIR")
 CLIENT_CERT_PATH = "{}/client.crt".format(BASE_PATH)
 CLIENT_KEY_PATH = "{}/client.key".format(BASE_PATH)
 SERVER_CERT_PATH = "{}/server.crt".format(BASE_PATH)
+JOURNAL_PATH = "{}/.trust-store-journal".format(BASE_PATH)
+METRICS_PATH = "{}/.metrics.json".format(BASE_PATH)
+METRICS_TEXTFILE_PATH = "{}/metrics.prom".format(BASE_PATH)
+# Label of the unit secret holding the LXD client credentials
+CREDENTIALS_SECRET_LABEL = "lxd-credentials"
+
+# Number of consecutive failed LXD calls after which the circuit breaker opens
+BREAKER_THRESHOLD = 3
+# Seconds the breaker stays open before a single trial call is let through
+BREAKER_COOLDOWN = 300
+# Maximum number of requests written back to back on one connection
+PIPELINE_DEPTH = 64
+# Seconds of queued trust store work a hook does when not configured
+DEFAULT_TIME_BUDGET = 60
+# Writes that may be sent at once when rate limited and not configured
+DEFAULT_WRITE_BURST = 20
+# Order in which queued work is done: revoke access first, publish last
+PRIORITIES = {"unregister": 0, "register": 1, "publish": 2}
+# Seconds a node has to answer a health probe
+PROBE_TIMEOUT = 2
+# Nodes probed at the same time
+PROBE_WORKERS = 8
+# Days before expiry requirers are warned about a certificate when not configured
+DEFAULT_EXPIRY_WARNING_DAYS = 30
+# Protocol versions spoken, from 1.1 nodes share a single trusted_certs_fp table
+PROTOCOL_VERSIONS = ("1.0", "1.1")
+# Cost model choosing how certificates are looked up in the trust store, in
+# bytes exchanged: a round trip is worth ROUND_TRIP_BYTES, a point lookup
+# returns the whole certificate, a listing the URL of every certificate and a
+# filter its share of the query and the URL of a match
+ROUND_TRIP_BYTES = 16 * 1024
+LOOKUP_BYTES = 2 * 1024
+LIST_ENTRY_BYTES = 90
+FILTER_TERM_BYTES = 150
+# Fingerprints per filtered request, keeping its query string short
+FILTER_TERMS = 32
 
 logger = logging.getLogger(__name__)
 
 
+def _dumps(value) -> str:
+    """Serialize relation data, equal values always giving the same bytes."""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def lookup_strategy(count: int, store_size: int, filtering: bool) -> str:
+    """Return the cheapest way of looking count certificates up in the trust store.
+
+    One of ``point`` (a pipelined GET per certificate), ``filter`` (pipelined
+    lists filtered on the fingerprints, when LXD has the api_filtering
+    extension) or ``list`` (a single list of the whole trust store).
+    """
+    costs = {
+        "point": count * LOOKUP_BYTES + math.ceil(count / PIPELINE_DEPTH) * ROUND_TRIP_BYTES,
+        "list": store_size * LIST_ENTRY_BYTES + ROUND_TRIP_BYTES,
+    }
+    if filtering:
+        requests = math.ceil(count / FILTER_TERMS)
+        costs["filter"] = (
+            count * FILTER_TERM_BYTES + math.ceil(requests / PIPELINE_DEPTH) * ROUND_TRIP_BYTES
+        )
+    # Ties go to the strategy whose cost does not depend on the trust store
+    return min(costs, key=lambda strategy: (costs[strategy], strategy == "list"))
+
+
+class LxdUnavailableError(RuntimeError):
+    """Raised when the LXD API could not be reached or is overloaded."""
+
+
+class CircuitOpenError(LxdUnavailableError):
+    """Raised when the circuit breaker refuses to issue LXD API calls."""
+
+
+class LxdRequestError(RuntimeError):
+    """Raised when LXD answered a request with an error."""
+
+
 class Lxd(Object):
     """LXD interface for connection to LXD APIs."""
 
     state = StoredState()
 
-    def __init__(self, charm: CharmBase, relation_name: str):
+    def __init__(
+        self,
+        charm: CharmBase,
+        relation_name: str,
+        peer_relation_name: Optional[str] = None,
+        metrics: Optional[Registry] = None,
+    ):
         super().__init__(charm, relation_name)
 
         self.state.set_default(
             endpoint=None,
             server_name=None,
+            # [endpoint, name] of the online members when LXD is clustered
+            cluster_members=[],
+            # Whether LXD filters lists, with the api_filtering extension, and
+            # the size of the trust store when it was last listed
+            api_filtering=False,
+            trust_store_size=0,
+            # Secret holding the credentials, and the revision trust was checked for
+            credentials_secret=None,
+            credentials_revision=0,
+            # Credentials kept here instead when Juju has no secrets
             client_cert=None,
             client_key=None,
             server_cert=None,
+            identity_cert=None,
+            identity_key=None,
+            # Fingerprint of the integrator's own certificate in the trust store,
+            # and the hash of the trust token the credentials were enrolled with
+            identity_fp=None,
+            enrolled_token=None,
+            api_socket=None,
+            # Endpoints tried when the configured one doesn't answer, and the
+            # addresses of the endpoints as cached by transport.Dialer, in JSON
+            fallback_endpoints=[],
+            dns_cache="",
+            breaker_failures=0,
+            breaker_opened_at=0.0,
+            breaker_reason="",
+            # Pending work by "<kind>:<key>", see _enqueue
+            queue={},
+            queue_seq=0,
+            # Write token buckets by LXD remote, and the time spent waiting on them
+            buckets={},
+            throttled_seconds=0.0,
+            # Fingerprints this unit added to the trust store, and per requirer
+            # unit the fingerprints it asked for
+            registered=[],
+            unit_fps={},
+            # The registered fingerprints as [notAfter, fingerprint] pairs, in
+            # heap order so that expired ones are found without a full scan
+            expiry=[],
+            # Recent health probe results by node endpoint
+            node_health={},
         )
         self._relation_name = relation_name
+        self._peer_relation_name = peer_relation_name
+        self._fingerprints = {}
+        self._started = time.monotonic()
+        self._journal = None
+        self._credentials = None
+        self._ssl_context = None
+        # TLS sessions to resume by node, valid with the current context only
+        self._tls_sessions = {}
+        self._connector = None
+        self._registered = None
+        self._expiry = None
+        self._not_after = {}
+        self._deadline = self._started
+        self._metrics = metrics if metrics is not None else Registry()
 
         self.framework.observe(charm.on[relation_name].relation_changed, self._on_relation_changed)
         self.framework.observe(charm.on[relation_name].relation_joined, self._on_relation_joined)
+        self.framework.observe(charm.on.update_status, self._on_update_status)
+        self.framework.observe(charm.on.update_status, self._on_prune)
+        self.framework.observe(charm.on.update_status, self._on_continue)
+        self.framework.observe(charm.on.config_changed, self._on_continue)
+        self.framework.observe(self.framework.on.pre_commit, self._save_dns_cache)
+        if peer_relation_name:
+            peer_events = charm.on[peer_relation_name]
+            self.framework.observe(charm.on.leader_elected, self._on_membership_changed)
+            self.framework.observe(peer_events.relation_joined, self._on_membership_changed)
+            self.framework.observe(peer_events.relation_departed, self._on_membership_changed)
+            self.framework.observe(peer_events.relation_changed, self._on_peers_changed)
 
     @property
     def is_joined(self):
@@ -52,64 +227,513 @@ class Lxd(Object):
     @property
     def is_ready(self) -> bool:
         """Property to know if the relation is ready."""
-        return all(
-            [
-                self.state.endpoint,
-                self.state.client_cert,
-                self.state.client_key,
-                self.state.server_cert,
-            ]
+        credentials = self._load_credentials()
+        return bool(self.state.endpoint) and all(
+            credentials.get(key) for key in ("client-cert", "client-key", "server-cert")
+        )
+
+    def _load_credentials(self) -> Dict[str, str]:
+        """Return the client credentials, read from their secret once per hook."""
+        if self._credentials is not None:
+            return self._credentials
+        if self.state.credentials_secret:
+            try:
+                secret = self.model.get_secret(id=self.state.credentials_secret)
+                self._credentials = secret.get_content()
+            except SecretNotFoundError:
+                logger.warning("credentials secret not found")
+                self._credentials = {}
+        else:
+            self._credentials = {
+                "client-cert": self.state.client_cert,
+                "client-key": self.state.client_key,
+                "server-cert": self.state.server_cert,
+            }
+            if self.state.identity_cert:
+                self._credentials["identity-cert"] = self.state.identity_cert
+                self._credentials["identity-key"] = self.state.identity_key
+        return self._credentials
+
+    def _store_credentials(self, credentials: Dict[str, str]) -> None:
+        """Save the client credentials in a unit secret, adding a new revision."""
+        self.state.credentials_revision += 1
+        try:
+            if self.state.credentials_secret:
+                try:
+                    secret = self.model.get_secret(id=self.state.credentials_secret)
+                    secret.set_content(credentials)
+                except SecretNotFoundError:
+                    self.state.credentials_secret = None
+            if not self.state.credentials_secret:
+                secret = self.model.unit.add_secret(
+                    credentials,
+                    label=CREDENTIALS_SECRET_LABEL,
+                    description="Client credentials of the LXD API",
+                )
+                self.state.credentials_secret = secret.id
+            self.state.client_cert = self.state.client_key = self.state.server_cert = None
+            self.state.identity_cert = self.state.identity_key = None
+        except ModelError as e:
+            logger.warning("keeping credentials in the charm state, no Juju secrets: {}".format(e))
+            self.state.credentials_secret = None
+            self.state.client_cert = credentials["client-cert"]
+            self.state.client_key = credentials["client-key"]
+            self.state.server_cert = credentials["server-cert"]
+            self.state.identity_cert = credentials.get("identity-cert")
+            self.state.identity_key = credentials.get("identity-key")
+        self._credentials = dict(credentials)
+
+    @property
+    def breaker_state(self) -> str:
+        """State of the circuit breaker guarding LXD API calls.
+
+        One of ``closed`` (calls flow), ``open`` (calls are refused until the
+        cool-down expires) or ``half-open`` (a trial call is allowed through).
+        """
+        if self.state.breaker_failures < BREAKER_THRESHOLD:
+            return "closed"
+        if time.time() - self.state.breaker_opened_at < BREAKER_COOLDOWN:
+            return "open"
+        return "half-open"
+
+    def _record_failure(self, reason: str) -> None:
+        self.state.breaker_failures += 1
+        self.state.breaker_reason = reason
+        if self.state.breaker_failures >= BREAKER_THRESHOLD:
+            # Re-arm the cool-down on every failure, including a failed trial call
+            self.state.breaker_opened_at = time.time()
+            logger.warning(
+                "circuit breaker open after {} failures: {}".format(
+                    self.state.breaker_failures, reason
+                )
+            )
+
+    def _record_success(self) -> None:
+        if self.state.breaker_failures:
+            logger.info("circuit breaker closed")
+        self.state.breaker_failures = 0
+        self.state.breaker_reason = ""
+
+    def _request(
+        self, method: str, path: str, body: Optional[str] = None, headers: Optional[dict] = None
+    ) -> Tuple[int, str]:
+        """Issue a request to LXD through the circuit breaker.
+
+        Returns the status code and the decoded body of the response.
+        """
+        import transport
+
+        if self.breaker_state == "open":
+            raise CircuitOpenError(self.state.breaker_reason)
+
+        start = time.monotonic()
+        try:
+            conn = self._new_connection()
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read().decode("utf-8")
+            conn.close()
+        except transport.TRANSPORT_ERRORS as e:
+            self._metrics.inc("lxd_integrator_lxd_requests_total", method=method, code="error")
+            self._record_failure("{} {}: {}".format(method, path, e))
+            raise LxdUnavailableError(self.state.breaker_reason) from e
+        finally:
+            self._metrics.observe(
+                "lxd_integrator_lxd_request_duration_seconds",
+                time.monotonic() - start,
+                call="request",
+            )
+
+        self._record_response(method, path, response.status)
+        return response.status, data
+
+    def _list(self, path: str) -> Iterator[Any]:
+        """Issue a GET request listing objects to LXD through the circuit breaker.
+
+        The objects are yielded as the response is read and decoded, so that
+        large lists such as the trust store never sit in memory whole. Raises
+        LxdRequestError when LXD answers with an error.
+        """
+        import jsonstream
+        import transport
+
+        if self.breaker_state == "open":
+            raise CircuitOpenError(self.state.breaker_reason)
+
+        start = time.monotonic()
+        conn = None
+        try:
+            conn = self._new_connection()
+            conn.request("GET", path)
+            response = conn.getresponse()
+            self._record_response("GET", path, response.status)
+            if response.status != 200:
+                raise LxdRequestError(
+                    "GET {}: HTTP {}: {}".format(
+                        path, response.status, response.read().decode("utf-8", "replace")
+                    )
+                )
+            yield from jsonstream.iter_items(response)
+        # Invalid JSON means LXD answered garbage
+        except transport.TRANSPORT_ERRORS + (ValueError,) as e:
+            self._metrics.inc("lxd_integrator_lxd_requests_total", method="GET", code="error")
+            self._record_failure("GET {}: {}".format(path, e))
+            raise LxdUnavailableError(self.state.breaker_reason) from e
+        finally:
+            if conn is not None:
+                conn.close()
+            self._metrics.observe(
+                "lxd_integrator_lxd_request_duration_seconds",
+                time.monotonic() - start,
+                call="list",
+            )
+
+    def _record_response(self, method: str, path: str, status: int) -> None:
+        self._metrics.inc("lxd_integrator_lxd_requests_total", method=method, code=str(status))
+        # Only overload and server side errors count against the breaker, a
+        # rejected request still proves LXD is answering
+        if status >= 500 or status == 429:
+            self._record_failure("{} {}: HTTP {}".format(method, path, status))
+            if self.breaker_state != "closed":
+                raise CircuitOpenError(self.state.breaker_reason)
+        else:
+            self._record_success()
+
+    def _pipeline(
+        self,
+        requests: List[Tuple[str, str, Optional[str]]],
+        on_sent: Optional[Callable[[], None]] = None,
+    ) -> List[Tuple[int, str]]:
+        """Issue requests to LXD pipelined over a persistent connection.
+
+        Requests are written back to back and the responses read in order,
+        so a batch costs one connection and about one round trip rather than
+        one of each per request. Returns the status code and decoded body of
+        every response, in the order of the requests. on_sent is called each
+        time requests have been written to LXD.
+        """
+        import transport
+
+        results = []
+        while len(results) < len(requests):
+            if self.breaker_state == "open":
+                raise CircuitOpenError(self.state.breaker_reason)
+
+            # A connection closed early by LXD leaves the rest for the next round
+            batch = requests[len(results) : len(results) + PIPELINE_DEPTH]
+            start = time.monotonic()
+            try:
+                conn = self._new_connection()
+                for method, path, status, data in transport.pipeline(conn, batch, on_sent):
+                    self._record_response(method, path, status)
+                    results.append((status, data))
+            except transport.TRANSPORT_ERRORS as e:
+                self._metrics.inc(
+                    "lxd_integrator_lxd_requests_total", method=batch[0][0], code="error"
+                )
+                self._record_failure("pipelined requests: {}".format(e))
+                raise LxdUnavailableError(self.state.breaker_reason) from e
+            finally:
+                self._metrics.observe(
+                    "lxd_integrator_lxd_request_duration_seconds",
+                    time.monotonic() - start,
+                    call="pipeline",
+                )
+        return results
+
+    def _new_connection(self) -> "HTTPConnection":
+        """Return a http.client connection to the LXD API.
+
+        A local unix socket is used when one is configured, skipping the TLS
+        handshake entirely. Otherwise a HTTPSConnection configured with the
+        proper endpoint and certificates is returned.
+        """
+        import transport
+
+        if self.state.api_socket:
+            self._metrics.inc("lxd_integrator_lxd_connections_total", transport="unix")
+            return transport.UnixHTTPConnection(self.state.api_socket, timeout=5)
+
+        context = self._client_context()
+        self._metrics.inc("lxd_integrator_lxd_connections_total", transport="tls")
+        # Cluster members share the cluster certificate, any of them will do
+        fallbacks = list(self.state.fallback_endpoints) + [
+            endpoint
+            for endpoint, _ in self.state.cluster_members
+            if endpoint != self.state.endpoint
+        ]
+        return transport.https_connection(
+            self.state.endpoint,
+            context,
+            sessions=self._tls_sessions,
+            on_handshake=self._count_handshake,
+            dialer=self._dialer(),
+            fallbacks=fallbacks,
+        )
+
+    def _client_context(self) -> "ssl.SSLContext":
+        """Return the TLS context of the client credentials.
+
+        It is built once per credentials revision and shared by every
+        connection, the certificates only touch the disk while it is built.
+        """
+        import transport
+
+        revision = self.state.credentials_revision
+        if self._ssl_context is None or self._ssl_context[0] != revision:
+            # Files left by an older revision must not be loaded
+            self._clean_certs_from_filesystem()
+            self._write_certs_to_filesystem()
+            try:
+                context = transport.client_context(
+                    CLIENT_CERT_PATH, CLIENT_KEY_PATH, SERVER_CERT_PATH
+                )
+            finally:
+                self._clean_certs_from_filesystem()
+            self._ssl_context = (revision, context)
+            self._tls_sessions = {}
+        return self._ssl_context[1]
+
+    def _dialer(self) -> "transport.Dialer":
+        """Return the dialer racing connections to LXD, its cache kept in the state."""
+        import transport
+
+        if self._connector is None:
+            self._connector = transport.Dialer(json.loads(self.state.dns_cache or "{}"))
+        return self._connector
+
+    def _save_dns_cache(self, _=None) -> None:
+        """Keep the addresses the dialer resolved in the state, from the main thread only."""
+        if self._connector is not None and self._connector.changed:
+            self.state.dns_cache = self._connector.dump()
+
+    def _count_handshake(self, resumed: bool) -> None:
+        self._metrics.inc(
+            "lxd_integrator_tls_handshakes_total", resumed="true" if resumed else "false"
         )
 
-    def _new_connection(self) -> httpclient.HTTPSConnection:
-        """Return a http.client.HTTPSConnection configured with the proper endpoint and certificates."""
-        self._write_certs_to_filesystem()
-        sslcontext = ssl.create_default_context(
-            purpose=ssl.Purpose.CLIENT_AUTH, cafile=SERVER_CERT_PATH
+    def _node_uses_tls(self, endpoint: str) -> bool:
+        return not (self.state.api_socket and endpoint == self.state.endpoint)
+
+    def _node_connection(self, endpoint: str) -> "HTTPConnection":
+        """Return a http.client connection to a node, with a short timeout."""
+        import transport
+
+        if not self._node_uses_tls(endpoint):
+            self._metrics.inc("lxd_integrator_lxd_connections_total", transport="unix")
+            return transport.UnixHTTPConnection(self.state.api_socket, timeout=PROBE_TIMEOUT)
+        context = self._client_context()
+        self._metrics.inc("lxd_integrator_lxd_connections_total", transport="tls")
+        return transport.https_connection(
+            endpoint,
+            context,
+            timeout=PROBE_TIMEOUT,
+            sessions=self._tls_sessions,
+            on_handshake=self._count_handshake,
+            dialer=self._dialer(),
         )
-        sslcontext.load_cert_chain(certfile=CLIENT_CERT_PATH, keyfile=CLIENT_KEY_PATH)
-        # Depending on how it was initialized, the LXD server cert can be configured
-        # with 127.0.0.1 as its CN, failing the verification
-        sslcontext.check_hostname = False
-        endpoint = self.state.endpoint.replace("https://", "").replace("http://", "")
-        return httpclient.HTTPSConnection(endpoint, context=sslcontext, timeout=5)
+
+    def set_api_socket(self, api_socket: str) -> None:
+        """Talk to LXD over a local unix socket instead of the HTTPS endpoint.
+
+        The HTTPS endpoint is still the one published to related units. An
+        empty value switches back to the HTTPS endpoint.
+        """
+        path = api_socket.replace("unix://", "", 1) if api_socket else None
+        if path != self.state.api_socket:
+            logger.info("using LXD API transport: {}".format(path or self.state.endpoint))
+        self.state.api_socket = path
+
+    def set_fallback_endpoints(self, endpoints: List[str]) -> None:
+        """Set endpoints tried when the LXD endpoint doesn't answer.
+
+        They must serve the same server certificate as the LXD endpoint.
+        """
+        if endpoints != list(self.state.fallback_endpoints):
+            logger.info("LXD fallback endpoints: {}".format(", ".join(endpoints) or "none"))
+        self.state.fallback_endpoints = endpoints
 
     def set_credentials(
         self, endpoint: str, client_cert: str, client_key: str, server_cert: str
-    ) -> None:
-        """Set credentials for the given LXD cluster."""
+    ) -> bool:
+        """Set credentials for the given LXD cluster.
+
+        Credentials are kept in a Juju secret. Unchanged credentials add no
+        secret revision and are not checked again, returns whether they were.
+        """
+        credentials = {
+            "client-cert": client_cert,
+            "client-key": client_key,
+            "server-cert": server_cert,
+        }
+        stored = self._load_credentials()
+        if (
+            endpoint == self.state.endpoint
+            and self.state.server_name
+            and all(stored.get(key) == value for key, value in credentials.items())
+        ):
+            return False
+
         self.state.endpoint = endpoint
-        self.state.client_cert = client_cert
-        self.state.client_key = client_key
-        self.state.server_cert = server_cert
-
-        # Check that the credentials are trusted to LXD
-        conn = self._new_connection()
-        conn.request("GET", "/1.0")
-        raw_res = conn.getresponse().read().decode("utf-8")
+        self.state.enrolled_token = None
+        self._store_credentials(credentials)
+        self._check_trust()
+        # The integrator's own identity is enrolled again with the new credentials
+        self._remove_identity()
+        return True
+
+    def enroll(self, endpoint: str, server_cert: str, trust_token: str) -> bool:
+        """Set credentials of a new client identity, trusted by LXD through a trust token.
+
+        Trust tokens can only be used once, returns False without enrolling
+        again when the credentials were already enrolled with this one, and
+        when no certificate could be generated.
+        """
+        token_hash = hashlib.sha256(trust_token.encode("utf-8")).hexdigest()
+        if (
+            endpoint == self.state.endpoint
+            and self.state.server_name
+            and token_hash == self.state.enrolled_token
+            and self._load_credentials().get("server-cert") == server_cert
+        ):
+            return False
+
+        identity = self._new_identity()
+        if identity is None:
+            return False
+        cert, key = identity
+        self.state.endpoint = endpoint
+        self._store_credentials(
+            {"client-cert": cert, "client-key": key, "server-cert": server_cert}
+        )
+        fp, payload = self._register_payload(cert)
+        body = json.loads(payload)
+        # LXD before trust_token took trust tokens in the password field
+        body["trust_token"] = body["password"] = trust_token
+        logger.info("enrolling certificate {} with a trust token".format(fp))
+        status, data = self._request(
+            "POST",
+            "/1.0/certificates",
+            body=json.dumps(body),
+            headers={"Content-Type": "application/json"},
+        )
+        if not self._check_registered(status, data):
+            raise RuntimeError("unable to enroll with the trust token")
+        self.state.enrolled_token = token_hash
+        # The identity enrolled before, with a token or the supplied credentials
+        self._remove_identity()
+        self.state.identity_fp = fp
+        self._check_trust()
+        return True
+
+    def set_own_identity(self, enabled: bool) -> None:
+        """Use a client identity of the integrator's own instead of the supplied one.
+
+        An ECDSA P-256 certificate is generated and added to the trust store
+        with the supplied credentials, then used for every other call. The
+        credentials enrolled with a trust token are already the integrator's.
+        """
+        credentials = self._load_credentials()
+        if not self.is_ready or self.state.enrolled_token:
+            return
+        if bool(credentials.get("identity-cert")) == enabled:
+            return
+
+        if not enabled:
+            self._store_credentials(
+                {
+                    key: value
+                    for key, value in credentials.items()
+                    if key not in ("identity-cert", "identity-key")
+                }
+            )
+            self._remove_identity()
+            return
+
+        identity = self._new_identity()
+        if identity is None:
+            return
+        cert, key = identity
+        fp, payload = self._register_payload(cert)
+        logger.info("enrolling the integrator certificate {}".format(fp))
+        try:
+            status, data = self._request(
+                "POST",
+                "/1.0/certificates",
+                body=payload,
+                headers={"Content-Type": "application/json"},
+            )
+        except LxdUnavailableError as e:
+            # Enrolled by a later hook, the supplied credentials still work
+            logger.warning("unable to enroll the integrator certificate: {}".format(e))
+            return
+        if not self._check_registered(status, data):
+            logger.error("unable to enroll the integrator certificate, using the supplied one")
+            return
+        self._remove_identity()
+        self.state.identity_fp = fp
+        self._store_credentials(dict(credentials, **{"identity-cert": cert, "identity-key": key}))
+
+    def _new_identity(self) -> Optional[Tuple[str, str]]:
+        """Return a new client certificate and key named after this unit, None on failure."""
+        name = "lxd-integrator-{}".format(self.model.unit.name.replace("/", "-"))
+        try:
+            return certificate.generate_client_certificate(name)
+        except (ImportError, TypeError, ValueError) as e:
+            logger.error("unable to generate the integrator certificate: {}".format(e))
+            return None
+
+    def _remove_identity(self) -> None:
+        """Remove the integrator's own certificate, no longer used, from the trust store."""
+        if not self.state.identity_fp:
+            return
+        status, data = self._request(
+            "DELETE", "/1.0/certificates/{}".format(self.state.identity_fp)
+        )
+        if status >= 400 and status != 404:
+            logger.warning("unable to remove the integrator certificate: {}".format(data))
+        self.state.identity_fp = None
+
+    def _check_trust(self) -> None:
+        """Check that the credentials are trusted to LXD and read what it runs on."""
+        _, raw_res = self._request("GET", "/1.0")
         resp = json.loads(raw_res)["metadata"]
-        conn.close()
         if resp["auth"] != "trusted":
             raise RuntimeError("invalid credentials: not trusted")
         self.state.server_name = resp["environment"]["server_name"]
-        logger.info("credentials configured")
+        self.state.api_filtering = "api_filtering" in resp.get("api_extensions", [])
+        if resp["environment"].get("server_clustered"):
+            self._refresh_cluster_members()
+        else:
+            self.state.cluster_members = []
+        logger.info("credentials configured, revision {}".format(self.state.credentials_revision))
+
+    def _refresh_cluster_members(self) -> None:
+        """Fetch the online members of the LXD cluster, published as nodes.
+
+        The trust store is shared by the whole cluster, so certificates are
+        still registered once through the configured endpoint and only the
+        fingerprints are fanned out to every member.
+        """
+        try:
+            members = sorted(
+                [member["url"], member["server_name"]]
+                for member in self._list("/1.0/cluster/members?recursion=1")
+                if member.get("status") == "Online"
+            )
+        except LxdRequestError as e:
+            logger.warning("unable to list cluster members: {}".format(e))
+            return
+        if members != [list(member) for member in self.state.cluster_members]:
+            logger.info("cluster members: {}".format(", ".join(name for _, name in members)))
+            self.state.cluster_members = members
 
     def _on_relation_joined(self, event: RelationJoinedEvent):
         if not self.is_ready:
             event.defer()
             return
 
-        data = self.framework.model.get_relation(self._relation_name).data[self.model.unit]
-        data["nodes"] = json.dumps(
-            [
-                {
-                    "endpoint": self.state.endpoint,
-                    "name": self.state.server_name,
-                    "trusted_certs_fp": [],
-                }
-            ]
-        )
-        data["version"] = "1.0"
+        self._publish(event.relation)
 
     def _clean_certs_from_filesystem(self):
         """Remove previously saved certificates from filesystem."""
@@ -123,114 +747,779 @@ class Lxd(Object):
             os.remove(SERVER_CERT_PATH)
 
     def _write_certs_to_filesystem(self):
-        if not os.path.exists(CLIENT_CERT_PATH):
-            with open(os.open(CLIENT_CERT_PATH, os.O_CREAT | os.O_WRONLY, 0o600), "w") as f:
-                f.write(self.state.client_cert)
-
-        if not os.path.exists(CLIENT_KEY_PATH):
-            with open(os.open(CLIENT_KEY_PATH, os.O_CREAT | os.O_WRONLY, 0o600), "w") as f:
-                f.write(self.state.client_key)
+        credentials = self._load_credentials()
+        # The integrator's own identity, once enrolled, is used instead of the supplied one
+        client = "identity" if credentials.get("identity-cert") else "client"
+        for path, key in (
+            (CLIENT_CERT_PATH, "{}-cert".format(client)),
+            (CLIENT_KEY_PATH, "{}-key".format(client)),
+            (SERVER_CERT_PATH, "server-cert"),
+        ):
+            if not os.path.exists(path):
+                with open(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600), "w") as f:
+                    f.write(credentials[key])
 
-        if not os.path.exists(SERVER_CERT_PATH):
-            with open(os.open(SERVER_CERT_PATH, os.O_CREAT | os.O_WRONLY, 0o600), "w") as f:
-                f.write(self.state.server_cert)
+    def _unregister_certs(
+        self, fps: Iterable[str], on_sent: Optional[Callable[[], None]] = None
+    ) -> List[str]:
+        """Remove certificates from the trust store over a single pipelined connection.
 
-    def _unregister_cert(self, cert: str) -> None:
+        Returns the fingerprints that are no longer trusted.
+        """
         if not self.is_ready:
             raise RuntimeError("credentials not configured")
 
-        conn = self._new_connection()
+        fps = list(fps)
+        for fp in fps:
+            logger.info("removing certificate {} from trust store".format(fp))
+        responses = self._pipeline(
+            [("DELETE", "/1.0/certificates/{}".format(fp), None) for fp in fps], on_sent
+        )
+
+        removed = []
+        for fp, (status, data) in zip(fps, responses):
+            if 200 <= status < 300 or status == 404:
+                removed.append(fp)
+            else:
+                logger.error(data)
+        return removed
+
+    def _trusted(self, fps: Iterable[str]) -> Set[str]:
+        """Return which of the fingerprints are in the trust store.
+
+        They are looked up the cheapest way given how many there are and how
+        large the trust store is, see lookup_strategy.
+        """
+        fps = list(fps)
+        if not fps:
+            return set()
+        # Certificates added by others are only known from the last listing
+        store_size = max(len(self._index()), self.state.trust_store_size)
+        strategy = lookup_strategy(len(fps), store_size, self.state.api_filtering)
+        if strategy != "point":
+            try:
+                wanted = set(fps)
+                if strategy == "filter":
+                    urls = self._filtered_certificates(fps)
+                else:
+                    urls = self._list("/1.0/certificates")
+                trusted = set()
+                size = 0
+                for url in urls:
+                    # Whatever LXD sent back, only the fingerprints asked for count
+                    fp = url.rsplit("/", 1)[-1]
+                    if fp in wanted:
+                        trusted.add(fp)
+                    size += 1
+                if strategy == "list":
+                    self.state.trust_store_size = size
+                return trusted
+            except LxdRequestError as e:
+                logger.warning("unable to {} the trust store: {}".format(strategy, e))
+        responses = self._pipeline(
+            [("GET", "/1.0/certificates/{}".format(fp), None) for fp in fps]
+        )
+        return {fp for fp, (status, _) in zip(fps, responses) if status == 200}
 
-        fp = self._cert_fingerprint(cert)
-        logger.info("removing certificate {} from trust store".format(fp))
-        conn.request("DELETE", "/1.0/certificates/{}".format(fp))
-        response = conn.getresponse()
-        data = response.read().decode("utf-8")
-        conn.close()
+    def _filtered_certificates(self, fps: List[str]) -> List[str]:
+        """Return the URLs of the certificates among fps, using LXD filtering."""
+        from urllib.parse import quote
 
-        if response.getcode() != 202:
-            logger.error(data)
+        requests = []
+        for i in range(0, len(fps), FILTER_TERMS):
+            query = " or ".join("fingerprint eq {}".format(fp) for fp in fps[i : i + FILTER_TERMS])
+            requests.append(("GET", "/1.0/certificates?filter={}".format(quote(query)), None))
+        urls = []
+        for (_, path, _), (status, data) in zip(requests, self._pipeline(requests)):
+            if status != 200:
+                raise LxdRequestError("GET {}: HTTP {}: {}".format(path, status, data))
+            urls.extend(json.loads(data)["metadata"])
+        return urls
 
     def _cert_fingerprint(self, cert):
         if isinstance(cert, str):
-            cert = load_certificate(FILETYPE_PEM, cert)
+            if cert in self._fingerprints:
+                return self._fingerprints[cert]
+            try:
+                fp = certificate.fingerprint(certificate.der(cert))
+                self._fingerprints[cert] = fp
+                return fp
+            except certificate.CertificateError:
+                from OpenSSL.crypto import FILETYPE_PEM, load_certificate
+
+                cert = load_certificate(FILETYPE_PEM, cert)
         return cert.digest("sha256").decode("utf-8").replace(":", "").lower()
 
-    def _register_cert(self, cert: str) -> None:
-        if not self.is_ready:
-            raise RuntimeError("credentials not configured")
+    def _cert_not_after(self, cert: str) -> Optional[int]:
+        """Return when a certificate expires, None if that can't be told."""
+        if cert in self._not_after:
+            return self._not_after[cert]
+        try:
+            expiry = certificate.not_after(certificate.der(cert))
+        except certificate.CertificateError as e:
+            logger.debug("falling back to pyOpenSSL: {}".format(e))
+            import calendar
 
-        buff = io.StringIO(cert)
-        content = ""
-        line = buff.readline()
-        while line and "-----BEGIN CERTIFICATE-----" not in line:
-            line = buff.readline()
-        line = buff.readline()
-        while line and "-----END CERTIFICATE-----" not in line:
-            content += line.rstrip("\r\n")
-            line = buff.readline()
+            from OpenSSL.crypto import FILETYPE_PEM, Error, load_certificate
 
-        x509_cert = load_certificate(FILETYPE_PEM, cert)
-        name = x509_cert.get_subject().CN
-        fp = self._cert_fingerprint(x509_cert)
+            try:
+                value = load_certificate(FILETYPE_PEM, cert).get_notAfter().decode("ascii")
+                expiry = calendar.timegm(time.strptime(value, "%Y%m%d%H%M%SZ"))
+            except (Error, ValueError):
+                logger.warning("unable to read the expiry of a certificate")
+                expiry = None
+        self._not_after[cert] = expiry
+        return expiry
 
-        logger.info("adding certificate {} to trust store".format(fp))
+    def _register_payload(self, cert: str) -> Tuple[str, str]:
+        """Return the fingerprint of a certificate and the body registering it."""
+        content = certificate.pem_body(cert)
+        try:
+            der = certificate.der(cert)
+            fp = certificate.fingerprint(der)
+            name = certificate.common_name(der)
+        except certificate.CertificateError as e:
+            # Let pyOpenSSL have a go at anything the DER walker doesn't handle
+            logger.debug("falling back to pyOpenSSL: {}".format(e))
+            from OpenSSL.crypto import FILETYPE_PEM, load_certificate
 
-        payload = json.dumps({"type": "client", "certificate": content, "name": name})
-        headers = {"Content-Type": "application/json"}
+            x509_cert = load_certificate(FILETYPE_PEM, cert)
+            name = x509_cert.get_subject().CN
+            fp = self._cert_fingerprint(x509_cert)
+        return fp, json.dumps({"type": "client", "certificate": content, "name": name})
 
-        conn = self._new_connection()
-        conn.request("POST", "/1.0/certificates", headers=headers, body=payload)
-        response = conn.getresponse()
-        data = response.read().decode("utf-8")
-        conn.close()
-        self._clean_certs_from_filesystem()
-        if 200 <= response.getcode() < 300:
-            return
+    def _check_registered(self, status: int, data: str) -> bool:
+        """Return whether a registration response left the certificate trusted."""
+        if 200 <= status < 300:
+            return True
 
         if "Certificate already in trust store" in data:
             logger.warning("certificate already provisioned. Skipping provision")
-        else:
-            logger.error(data)
+            return True
+        logger.error(data)
+        return False
+
+    def _register_certs(
+        self, certs: Iterable[str], on_sent: Optional[Callable[[], None]] = None
+    ) -> List[str]:
+        """Add certificates to the trust store over a single pipelined connection.
+
+        Returns the fingerprints of the certificates that are now trusted.
+        """
+        if not self.is_ready:
+            raise RuntimeError("credentials not configured")
+
+        fps = []
+        requests = []
+        for cert in certs:
+            fp, payload = self._register_payload(cert)
+            logger.info("adding certificate {} to trust store".format(fp))
+            fps.append(fp)
+            requests.append(("POST", "/1.0/certificates", payload))
+
+        responses = self._pipeline(requests, on_sent)
+        return [
+            fp
+            for fp, (status, data) in zip(fps, responses)
+            if self._check_registered(status, data)
+        ]
 
     def _on_relation_changed(self, event: RelationChangedEvent):
         if not self.is_ready:
             event.defer()
             return
 
-        received = event.relation.data[event.unit]
-        local_data = event.relation.data[self.model.unit]
+        # Changes only add to the queue, which collapses repeated requests for
+        # the same certificate while LXD is unavailable or the budget is spent
+        self._reconcile_unit(event.relation, event.unit)
+        self._process_queue()
+
+    def _on_update_status(self, _):
+        """Probe the published nodes and republish them if their health changed."""
+        if not self.is_ready:
+            return
+
+        import health
+
+        if self.state.cluster_members and self.breaker_state != "open":
+            try:
+                self._refresh_cluster_members()
+            except LxdUnavailableError as e:
+                logger.warning("keeping the known cluster members: {}".format(e))
+        endpoints = [node["endpoint"] for node in self._nodes()]
+        results = {}
+        if self.breaker_state == "open":
+            # Known to be failing, and the breaker keeps calls away from it
+            results[self.state.endpoint] = None
+        targets = [endpoint for endpoint in endpoints if endpoint not in results]
+        if any(self._node_uses_tls(endpoint) for endpoint in targets):
+            # Built once up front rather than by each probing thread
+            self._dialer()
+            try:
+                self._client_context()
+            except OSError as e:
+                logger.warning("unable to load the client credentials: {}".format(e))
+                results.update(
+                    (endpoint, None) for endpoint in targets if self._node_uses_tls(endpoint)
+                )
+                targets = [endpoint for endpoint in targets if endpoint not in results]
+        results.update(
+            health.probe_all(
+                {
+                    endpoint: (lambda endpoint=endpoint: self._node_connection(endpoint))
+                    for endpoint in targets
+                },
+                PROBE_WORKERS,
+            )
+        )
+        self._save_dns_cache()
+
+        for endpoint, latency in results.items():
+            stats = health.NodeHealth(self.state.node_health.get(endpoint))
+            stats.record(latency)
+            self.state.node_health[endpoint] = stats.samples
+        # Forget nodes that are no longer published
+        for endpoint in set(self.state.node_health) - set(endpoints):
+            del self.state.node_health[endpoint]
+
+        for relation in self.model.relations[self._relation_name]:
+            self._publish(relation)
+
+    def _on_prune(self, _):
+        """Queue the removal of expired certificates, done by _on_continue."""
+        if self.is_ready:
+            self._resume()
+            self._prune_expired()
+
+    def _on_continue(self, _):
+        """Carry on with work left over by previous hooks."""
+        if self.is_ready and self.state.queue:
+            self._process_queue()
+
+    def _on_membership_changed(self, _):
+        """Let the leader publish the integrator units sharing the work."""
+        peers = self._peers
+        if peers is None or not self.model.unit.is_leader():
+            return
+
+        members = json.dumps(sorted([self.model.unit.name] + [u.name for u in peers.units]))
+        if peers.data[self.model.app].get("members") != members:
+            logger.info("integrator units sharing the trust store: {}".format(members))
+            peers.data[self.model.app]["members"] = members
+            # Juju doesn't tell the leader about its own write: pick up the
+            # requirer units it now owns here
+            if self.is_ready:
+                self._reconcile()
+
+    def _on_peers_changed(self, _):
+        # Membership or a peer's registrations changed: pick up the requirer
+        # units this unit now owns and republish fingerprints others added
+        if self.is_ready:
+            self._reconcile()
+
+    def _hold_reconcile(self, error: Exception) -> None:
+        """Postpone the queued work until LXD is reachable again."""
+        if self.breaker_state == "closed":
+            message = "LXD unavailable ({}), retrying later".format(error)
+        else:
+            remaining = BREAKER_COOLDOWN - (time.time() - self.state.breaker_opened_at)
+            message = "LXD unavailable ({}), retrying in {}s".format(error, max(int(remaining), 0))
+        self.model.unit.status = WaitingStatus(message)
+
+    def _reconcile(self) -> None:
+        """Reconcile the trust store against every related unit at once."""
+        for relation in self.model.relations[self._relation_name]:
+            for unit in relation.units:
+                self._reconcile_unit(relation, unit)
+        self._process_queue()
+
+    @property
+    def time_budget(self) -> float:
+        """Wall-clock seconds a hook may spend working through the queue."""
+        return self.model.config.get("hook_time_budget", DEFAULT_TIME_BUDGET)
+
+    def _enqueue(self, kind: str, key: str, **payload) -> None:
+        """Queue a unit of work, replacing any queued work it supersedes."""
+        # Registering and removing the same certificate cancel each other out
+        opposite = {"register": "unregister", "unregister": "register"}.get(kind)
+        if opposite:
+            self.state.queue.pop("{}:{}".format(opposite, key), None)
+        name = "{}:{}".format(kind, key)
+        if name not in self.state.queue:
+            self.state.queue_seq += 1
+            self.state.queue[name] = dict(payload, kind=kind, key=key, seq=self.state.queue_seq)
+
+    def _batches(self) -> Iterator[List[dict]]:
+        """Yield the queued items by urgency, in batches of items of the same kind.
+
+        The queue is only sorted once per hook rather than for every batch,
+        which matters once it holds thousands of items.
+        """
+        order = sorted(
+            (PRIORITIES[item["kind"]], item["seq"], name)
+            for name, item in self.state.queue.items()
+        )
+        names = [name for _, _, name in order]
+        while names:
+            kind = self.state.queue[names[0]]["kind"]
+            batch = []
+            for name in names[:PIPELINE_DEPTH]:
+                if self.state.queue[name]["kind"] != kind:
+                    break
+                batch.append(name)
+            yield [self.state.queue[name] for name in batch]
+            # Items left over by a partly done batch come first in the next one
+            left = [name for name in batch if name in self.state.queue]
+            names = left + names[len(batch) :]
+
+    def _process_queue(self) -> None:
+        """Work through the queue until it is empty or the hook's time budget is spent.
+
+        Unless writes are throttled, at least one batch is processed per hook
+        so that the queue always makes progress. Whatever is left is picked up
+        by the next hook.
+        """
+        if self.breaker_state == "open":
+            self._hold_reconcile(CircuitOpenError(self.state.breaker_reason))
+            return
+
+        self._resume()
+        self._deadline = self._started + self.time_budget
+        throttled = False
+        try:
+            for batch in self._batches():
+                if not self._process_batch(batch):
+                    throttled = True
+                    break
+                if time.monotonic() >= self._deadline:
+                    break
+        except LxdUnavailableError as e:
+            self._hold_reconcile(e)
+            return
+        finally:
+            self._save_registered()
+            self._publish_index()
+
+        if self.state.queue:
+            self.model.unit.status = MaintenanceStatus(
+                "updating trust store: {} items left{}".format(
+                    len(self.state.queue), " (throttled)" if throttled else ""
+                )
+            )
+        elif isinstance(self.model.unit.status, (MaintenanceStatus, WaitingStatus)):
+            self.model.unit.status = ActiveStatus()
+
+    def _resume(self) -> None:
+        """Pick up the changes a failed hook made before its state was rolled back."""
+        if self._journal is not None:
+            return
+
+        self._journal = Journal(JOURNAL_PATH)
+        self._journal.compact(self._registered_fps())
+        added = self._journal.with_step("register", CONFIRMED)
+        removed = self._journal.with_step("unregister", CONFIRMED)
+        if added or removed:
+            logger.info(
+                "resuming from journal: {} registered, {} removed".format(len(added), len(removed))
+            )
+        registered = self._registered_fps()
+        certs = self._resumed_certs(added - registered)
+        registered.update(added)
+        registered.difference_update(removed)
+        # Indexed by expiry as if registered by this hook, to be pruned in time
+        for fp, cert in certs.items():
+            expiry = self._cert_not_after(cert)
+            if expiry is not None:
+                heapq.heappush(self._expiry_heap(), (expiry, fp))
+        self._save_registered()
+        for fp in added:
+            self.state.queue.pop("register:{}".format(fp), None)
+        for fp in removed:
+            self.state.queue.pop("unregister:{}".format(fp), None)
+
+    def _resumed_certs(self, fps: Set[str]) -> Dict[str, str]:
+        """Return the certificates of fingerprints a failed hook registered.
+
+        They are still queued, unless the hook that queued them failed too, in
+        which case they are found in the requirer units' data.
+        """
+        certs = {}
+        for fp in fps:
+            item = self.state.queue.get("register:{}".format(fp))
+            if item is not None:
+                certs[fp] = item["cert"]
+        if len(certs) < len(fps):
+            for relation in self.model.relations[self._relation_name]:
+                for unit in relation.units:
+                    for cert in self._client_certificates(relation, unit):
+                        fp = self._cert_fingerprint(cert)
+                        if fp in fps:
+                            certs.setdefault(fp, cert)
+        return certs
+
+    def _acquire_writes(self, count: int) -> int:
+        """Take up to count write tokens for the current LXD remote.
+
+        Waits for a token when none is left and the wait fits in the hook's
+        time budget. Returns how many writes may be sent now.
+        """
+        rate = float(self.model.config.get("write_rate_limit", 0))
+        if rate <= 0:
+            return count
+
+        burst = max(int(self.model.config.get("write_burst", DEFAULT_WRITE_BURST)), 1)
+        remote = self.state.api_socket or self.state.endpoint
+        saved = self.state.buckets.get(remote, {})
+        bucket = TokenBucket(rate, burst, saved.get("tokens"), saved.get("updated", 0.0))
+        granted = bucket.take(count, time.time())
+        if not granted:
+            wait = bucket.wait_time(time.time())
+            if time.monotonic() + wait < self._deadline:
+                time.sleep(wait)
+                self.state.throttled_seconds += wait
+                granted = bucket.take(count, time.time())
+        self.state.buckets[remote] = bucket.to_dict()
+        return granted
+
+    def _process_batch(self, batch: List[dict]) -> bool:
+        """Process a batch of queued items of the same kind.
+
+        Returns False when nothing could be done because writes are throttled.
+        """
+        kind = batch[0]["kind"]
+        if kind == "unregister":
+            done = self._unregister_batch([i["key"] for i in batch])
+        elif kind == "register":
+            done = self._register_batch({i["key"]: i["cert"] for i in batch})
+        else:
+            done = [i["key"] for i in batch]
+            for key in done:
+                relation = self.model.get_relation(self._relation_name, int(key))
+                if relation is not None:
+                    self._publish(relation)
+
+        for key in done:
+            del self.state.queue["{}:{}".format(kind, key)]
+        return bool(done)
+
+    def _unregister_batch(self, fps: List[str]) -> List[str]:
+        """Remove certificates from the trust store, returning the fingerprints handled."""
+        fps = fps[: self._acquire_writes(len(fps))]
+        if not fps:
+            return []
+        self._journal.record("unregister", fps, INTENT)
+        gone = self._unregister_certs(
+            fps, on_sent=lambda: self._journal.record("unregister", fps, SENT)
+        )
+        self._journal.record("unregister", gone, CONFIRMED)
+        self._metrics.inc("lxd_integrator_certificates_removed_total", len(gone))
+        self._registered_fps().difference_update(gone)
+        return fps
+
+    def _register_batch(self, certs: Dict[str, str]) -> List[str]:
+        """Add certificates by fingerprint to the trust store, returning the fingerprints handled."""
+        # A peer may have registered some of them since they were queued
+        index = self._index()
+        pending = {fp: cert for fp, cert in certs.items() if fp not in index}
+
+        # Registrations sent by a failed hook that never saw the answer are
+        # looked up, which is cheaper on LXD's database than a second POST
+        unknown = set(pending) & self._journal.with_step("register", SENT)
+        trusted = self._trusted(unknown) if unknown else set()
+        self._journal.record("register", trusted, CONFIRMED)
+
+        fps = [fp for fp in pending if fp not in trusted]
+        allowed = fps[: self._acquire_writes(len(fps))] if fps else []
+        throttled = set(fps) - set(allowed)
+        if allowed:
+            self._journal.record("register", allowed, INTENT)
+            trusted.update(
+                self._register_certs(
+                    [pending[fp] for fp in allowed],
+                    on_sent=lambda: self._journal.record("register", allowed, SENT),
+                )
+            )
+            self._journal.record("register", [fp for fp in allowed if fp in trusted], CONFIRMED)
+            # Rejected certificates are not worth resuming
+            self._journal.record("register", [fp for fp in allowed if fp not in trusted], INTENT)
+        registered = self._registered_fps()
+        added = trusted - registered
+        self._metrics.inc("lxd_integrator_certificates_registered_total", len(added))
+        registered.update(added)
+        for fp in added:
+            expiry = self._cert_not_after(pending[fp])
+            if expiry is not None:
+                heapq.heappush(self._expiry_heap(), (expiry, fp))
+        return [fp for fp in certs if fp not in throttled]
+
+    def collect_metrics(self, metrics: Registry) -> None:
+        """Set the gauges describing the current state of the interface."""
+        metrics.set("lxd_integrator_trust_store_certificates", len(self._index()))
+        metrics.set(
+            "lxd_integrator_relation_units",
+            sum(len(r.units) for r in self.model.relations[self._relation_name]),
+        )
+        metrics.set("lxd_integrator_queue_items", len(self.state.queue))
+        metrics.set("lxd_integrator_write_throttled_seconds_total", self.state.throttled_seconds)
+        metrics.set("lxd_integrator_breaker_open", int(self.breaker_state == "open"))
+        metrics.clear("lxd_integrator_node_up")
+        for node in self._nodes():
+            health = self._node_health(node["endpoint"])
+            if health:
+                metrics.set("lxd_integrator_node_up", int(health["healthy"]), node=node["name"])
+
+    @property
+    def _peers(self) -> Optional[Relation]:
+        if not self._peer_relation_name:
+            return None
+        return self.model.get_relation(self._peer_relation_name)
+
+    def _members(self) -> List[str]:
+        """Return the integrator units sharing the trust store work."""
+        peers = self._peers
+        if peers is None:
+            return [self.model.unit.name]
+        # The leader's view is authoritative so that every unit agrees on the
+        # ring, until it is published fall back on this unit's view
+        members = peers.data[self.model.app].get("members")
+        if members:
+            return json.loads(members)
+        return [self.model.unit.name] + [u.name for u in peers.units]
+
+    def _owns(self, unit: Unit) -> bool:
+        """Return whether this integrator unit handles a requirer unit."""
+        members = self._members()
+        if self.model.unit.name not in members:
+            return False
+        return HashRing(members).owner(unit.name) == self.model.unit.name
+
+    def _registered_fps(self) -> Set[str]:
+        """Return the fingerprints this unit registered.
+
+        Kept as a plain set while the hook runs, as going through the stored
+        list for every batch is quadratic with large trust stores. Changes are
+        written back by _save_registered.
+        """
+        if self._registered is None:
+            self._registered = set(self.state.registered)
+        return self._registered
+
+    def _expiry_heap(self) -> List[Tuple[int, str]]:
+        """Return the expiry index, kept as a plain heap while the hook runs."""
+        if self._expiry is None:
+            self._expiry = [tuple(entry) for entry in self.state.expiry]
+            heapq.heapify(self._expiry)
+        return self._expiry
+
+    def _save_registered(self) -> None:
+        """Write the registered fingerprints and their expiry index back to the state."""
+        if self._registered is not None:
+            self.state.registered = sorted(self._registered)
+        if self._expiry is not None:
+            # A sorted list is a valid heap
+            self.state.expiry = [list(entry) for entry in sorted(self._expiry)]
+
+    def _prune_expired(self) -> None:
+        """Queue the removal of the certificates that expired.
+
+        Only the head of the expiry heap is looked at, so the trust store is
+        kept lean without going through every registered certificate.
+        """
+        heap = self._expiry_heap()
+        registered = self._registered_fps()
+        now = time.time()
+        expired = []
+        while heap and heap[0][0] <= now:
+            _, fp = heapq.heappop(heap)
+            if fp in registered:
+                expired.append(fp)
+        # Certificates removed for other reasons are only dropped from the heap
+        # lazily, rebuild it once they make up most of it
+        if len(heap) > 2 * len(registered) + PIPELINE_DEPTH:
+            heap[:] = [entry for entry in heap if entry[1] in registered]
+            heapq.heapify(heap)
+        self._save_registered()
+        if not expired:
+            return
+
+        logger.info("removing {} expired certificates from trust store".format(len(expired)))
+        for fp in expired:
+            self._enqueue("unregister", fp)
+        for relation in self.model.relations[self._relation_name]:
+            self._enqueue("publish", str(relation.id))
+
+    def _index(self) -> Set[str]:
+        """Return the fingerprints registered by any integrator unit."""
+        fps = set(self._registered_fps())
+        peers = self._peers
+        if peers is not None:
+            for unit in peers.units:
+                fps.update(fp for fp in peers.data[unit].get("registered", "").split(",") if fp)
+        return fps
 
-        trusted_certs_fp = received.get("trusted_certs_fp", [])
-        if isinstance(trusted_certs_fp, str):
-            trusted_certs_fp = json.loads(trusted_certs_fp)
-        registered_certs = set(trusted_certs_fp)
+    def _publish_index(self) -> None:
+        """Share the fingerprints this unit registered with its peers."""
+        peers = self._peers
+        if peers is None:
+            return
+        registered = ",".join(sorted(self._registered_fps()))
+        if peers.data[self.model.unit].get("registered", "") != registered:
+            peers.data[self.model.unit]["registered"] = registered
 
-        client_certs = received.get("client_certificates", [])
+    def _client_certificates(self, relation: Relation, unit: Unit) -> List[str]:
+        client_certs = relation.data[unit].get("client_certificates", [])
         if isinstance(client_certs, str):
             client_certs = json.loads(client_certs)
-        client_certificates = set(client_certs)
-
-        # Un-register removed certificates
-        removed_certs = registered_certs - client_certificates
-        for cert in removed_certs:
-            self._unregister_cert(cert)
-
-        # Register new certs
-        nodes = json.loads(local_data.get("nodes", "[]"))
-        current_node = next(node for node in nodes if node["endpoint"] == self.state.endpoint)
-
-        trusted_fps = set(
-            json.loads(current_node["trusted_certs_fp"])
-            if isinstance(current_node["trusted_certs_fp"], str)
-            else current_node["trusted_certs_fp"]
-        )
-        new_certs = client_certificates - registered_certs
-        for cert in new_certs:
-            self._register_cert(cert)
-            fp = self._cert_fingerprint(cert)
-            trusted_fps.add(fp)
-
-        current_node["trusted_certs_fp"] = list(trusted_fps)
-        local_data["nodes"] = json.dumps([current_node])
-        self._clean_certs_from_filesystem()
+        return client_certs
+
+    def _reconcile_unit(self, relation: Relation, unit: Unit) -> None:
+        """Queue the work needed to serve the certificates of a requirer unit."""
+        self._resume()
+        self._enqueue("publish", str(relation.id))
+        if not self._owns(unit):
+            # Another integrator unit handles it, its registrations reach us
+            # through the peer relation
+            self._hand_over(unit)
+            return
+
+        wanted = {
+            self._cert_fingerprint(cert): cert
+            for cert in self._client_certificates(relation, unit)
+        }
+
+        # Un-register removed certificates, unless another requirer unit still uses them
+        still_used = set(wanted)
+        for name, fps in self.state.unit_fps.items():
+            if name != unit.name:
+                still_used.update(fps)
+        for fp in set(self.state.unit_fps.get(unit.name, [])) - still_used:
+            self._enqueue("unregister", fp)
+
+        # Register new certs nobody registered yet
+        index = self._index()
+        now = time.time()
+        for fp, cert in wanted.items():
+            if fp in index:
+                continue
+            expiry = self._cert_not_after(cert)
+            if expiry is not None and expiry <= now:
+                logger.warning("not registering expired certificate {}".format(fp))
+                continue
+            self._enqueue("register", fp, cert=cert)
+        self.state.unit_fps[unit.name] = sorted(wanted)
+
+    def _hand_over(self, unit: Unit) -> None:
+        """Stop sharing the registrations of a requirer unit another integrator unit now owns.
+
+        Its new owner registers them again if need be, and removes them when
+        the requirer unit no longer wants them, which this unit would then
+        never learn about.
+        """
+        fps = self.state.unit_fps.pop(unit.name, None)
+        if fps is None:
+            return
+        still_used = set()
+        for other in self.state.unit_fps.values():
+            still_used.update(other)
+        dropped = set(fps) - still_used
+        if dropped:
+            logger.info("handing over {} certificates of {}".format(len(dropped), unit.name))
+            self._registered_fps().difference_update(dropped)
+            for fp in dropped:
+                self.state.queue.pop("register:{}".format(fp), None)
+                self.state.queue.pop("unregister:{}".format(fp), None)
+
+    def _nodes(self) -> List[dict]:
+        """Return the LXD nodes published to requirers."""
+        if self.state.cluster_members:
+            return [
+                {"endpoint": endpoint, "name": name}
+                for endpoint, name in self.state.cluster_members
+            ]
+        return [{"endpoint": self.state.endpoint, "name": self.state.server_name}]
+
+    def _node_health(self, endpoint: str) -> dict:
+        """Return the health published for a node, nothing until it was probed."""
+        samples = self.state.node_health.get(endpoint)
+        if not samples:
+            return {}
+
+        import health
+
+        return health.NodeHealth(samples).summary()
+
+    def _protocol_version(self, relation: Relation) -> str:
+        """Return the highest protocol version every requirer unit speaks.
+
+        Requirers list the versions they speak in supported_versions, those
+        that don't only speak 1.0. Units that haven't written anything yet
+        are left out, and the published version is kept until they do, so
+        that a unit joining doesn't make every unit's data change twice.
+        """
+
+        def key(version):
+            return tuple(int(n) for n in version.split("."))
+
+        versions = set(PROTOCOL_VERSIONS)
+        waiting = False
+        for unit in relation.units:
+            data = relation.data[unit]
+            if not data:
+                waiting = True
+                continue
+            supported = data.get("supported_versions") or '["1.0"]'
+            try:
+                versions &= set(json.loads(supported))
+            except (json.JSONDecodeError, TypeError):
+                logger.warning("invalid supported versions from {}".format(unit.name))
+                versions &= {"1.0"}
+        if not versions:
+            return "1.0"
+        version = max(versions, key=key)
+        current = relation.data[self.model.unit].get("version")
+        if waiting and current in PROTOCOL_VERSIONS:
+            version = min(version, current, key=key)
+        return version
+
+    def _publish(self, relation: Relation) -> None:
+        """Publish the nodes and the fingerprints trusted for a relation."""
+        index = self._index()
+        trusted = set()
+        expiring = {}
+        warn_before = time.time() + 86400 * self.model.config.get(
+            "expiry_warning_days", DEFAULT_EXPIRY_WARNING_DAYS
+        )
+        for unit in relation.units:
+            for cert in self._client_certificates(relation, unit):
+                fp = self._cert_fingerprint(cert)
+                if fp not in index:
+                    continue
+                trusted.add(fp)
+                expiry = self._cert_not_after(cert)
+                if expiry is not None and expiry <= warn_before:
+                    expiring[fp] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(expiry))
+
+        # Every node shares the trust store, clustered or not. From 1.1 the
+        # fingerprints are published once rather than repeated in each node.
+        version = self._protocol_version(relation)
+        trusted = sorted(trusted)
+        shared = version != "1.0"
+        nodes = []
+        for node in self._nodes():
+            if not shared:
+                node["trusted_certs_fp"] = trusted
+            node.update(self._node_health(node["endpoint"]))
+            nodes.append(node)
+        nodes.sort(key=lambda node: node["endpoint"])
+
+        # Only changed keys are written, unchanged data must not wake requirers up
+        local_data = relation.data[self.model.unit]
+        for key, value in (
+            ("version", version),
+            ("nodes", _dumps(nodes)),
+            ("trusted_certs_fp", _dumps(trusted) if shared else ""),
+            # Requirers are told ahead of time which of their certificates expire
+            ("expiring_certs_fp", _dumps(expiring) if expiring else ""),
+        ):
+            if local_data.get(key, "") != value:
+                local_data[key] = value
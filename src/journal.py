@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Write-ahead journal of trust store changes.
+
+Charm state is only committed when a hook succeeds, so after a failed hook
+Juju retries it with the state it had before. The journal is written to disk
+as the changes happen, letting the retried hook tell which calls already
+went through instead of sending them again.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, Set, Tuple
+
+INTENT = "intent"
+SENT = "sent"
+CONFIRMED = "confirmed"
+
+
+class Journal:
+    """Append-only log of the steps taken to register or remove certificates.
+
+    Each fingerprint goes through ``intent`` (about to be sent), ``sent``
+    (written to LXD, outcome unknown) and ``confirmed`` (LXD answered).
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._steps: Dict[Tuple[str, str], str] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write from a crash, nothing after it made it either
+                        break
+                    for fp in entry["fps"]:
+                        self._steps[(entry["op"], fp)] = entry["step"]
+
+    def record(self, op: str, fps: Iterable[str], step: str) -> None:
+        """Durably record that a step was reached for some fingerprints."""
+        fps = list(fps)
+        if not fps:
+            return
+        with open(os.open(self._path, os.O_CREAT | os.O_WRONLY | os.O_APPEND, 0o600), "w") as f:
+            f.write(json.dumps({"op": op, "step": step, "fps": fps}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for fp in fps:
+            self._steps[(op, fp)] = step
+
+    def with_step(self, op: str, step: str) -> Set[str]:
+        """Return the fingerprints whose last step for op is step."""
+        return {fp for (o, fp), s in self._steps.items() if o == op and s == step}
+
+    def compact(self, registered: Set[str]) -> None:
+        """Drop entries the committed charm state already reflects.
+
+        Changes the state reflects, registered certificates found in it and
+        removed ones absent from it, carry no information a retried hook
+        needs, whether or not their answer was seen. Neither do intents that
+        were never sent.
+        """
+        keep = {}
+        for (op, fp), step in self._steps.items():
+            if step == INTENT:
+                continue
+            if (fp in registered) == (op == "register"):
+                continue
+            keep.setdefault((op, step), []).append(fp)
+
+        if sum(len(fps) for fps in keep.values()) == len(self._steps):
+            return
+        tmp = "{}.tmp".format(self._path)
+        with open(os.open(tmp, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "w") as f:
+            for (op, step), fps in sorted(keep.items()):
+                f.write(json.dumps({"op": op, "step": step, "fps": sorted(fps)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path)
+        self._steps = {(op, fp): step for (op, step), fps in keep.items() for fp in fps}
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Incremental decoding of large LXD list responses.
+
+LXD answers list requests with one JSON document holding the whole list in
+its metadata. Reading the body and then decoding it keeps both in memory at
+once, which with a large trust store is a lot for a small machine. Items are
+instead decoded as the body is read and handed out one at a time.
+"""
+
+import codecs
+import json
+from typing import IO, Any, Iterator
+
+# Bytes read from the response at a time
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Text buffer over a binary stream, filled as values are decoded."""
+
+    def __init__(self, stream: IO[bytes], chunk_size: int):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Read more of the stream, returning False once it is exhausted."""
+        if self.eof:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        self.eof = not chunk
+        # What was decoded already is dropped, the buffer stays about a chunk long
+        self.buf = self.buf[self.pos :] + self._utf8.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next character that isn't whitespace, without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("truncated JSON document")
+
+    def expect(self, char: str) -> None:
+        """Consume the next character, which must be char."""
+        found = self.peek()
+        if found != char:
+            raise ValueError("expected {!r} in JSON document, found {!r}".format(char, found))
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number ending the buffer may go on in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_items(
+    stream: IO[bytes], key: str = "metadata", chunk_size: int = CHUNK_SIZE
+) -> Iterator[Any]:
+    """Yield the items of the list under a top-level key of a JSON object.
+
+    Other top-level values are decoded and dropped. Nothing is yielded when the
+    key is missing or does not hold a list. Raises ValueError on invalid JSON.
+    """
+    reader = _Reader(stream, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name == key and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() != ",":
+                        break
+                    reader.pos += 1
+                reader.expect("]")
+        else:
+            reader.value()
+        if reader.peek() != ",":
+            break
+        reader.pos += 1
+    reader.expect("}")
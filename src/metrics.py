@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Prometheus metrics of the charm.
+
+Each hook runs in a new process, so metrics are kept in a JSON file between
+hooks. At the end of every hook they are also written out in the Prometheus
+text format, which a small exporter process serves to the scrape relation.
+"""
+
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from ops.charm import CharmBase
+from ops.framework import Object, StoredState
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Type and help of every metric
+METRICS = {
+    "lxd_integrator_lxd_requests_total": (
+        "counter",
+        "LXD API requests by method and response code, error for transport failures",
+    ),
+    "lxd_integrator_lxd_request_duration_seconds": (
+        "histogram",
+        "Time taken by single and pipelined LXD API calls",
+    ),
+    "lxd_integrator_lxd_connections_total": (
+        "counter",
+        "Connections opened to LXD by transport, each tls one costing a handshake",
+    ),
+    "lxd_integrator_tls_handshakes_total": (
+        "counter",
+        "TLS handshakes with LXD, by whether they resumed an earlier session",
+    ),
+    "lxd_integrator_certificates_registered_total": (
+        "counter",
+        "Certificates added to the LXD trust store",
+    ),
+    "lxd_integrator_certificates_removed_total": (
+        "counter",
+        "Certificates removed from the LXD trust store",
+    ),
+    "lxd_integrator_trust_store_certificates": (
+        "gauge",
+        "Certificates registered by all integrator units",
+    ),
+    "lxd_integrator_relation_units": ("gauge", "Requirer units related to this unit"),
+    "lxd_integrator_queue_items": ("gauge", "Trust store work waiting to be done"),
+    "lxd_integrator_write_throttled_seconds_total": (
+        "counter",
+        "Time spent waiting on the trust store write rate limit",
+    ),
+    "lxd_integrator_breaker_open": ("gauge", "Whether the LXD circuit breaker is open"),
+    "lxd_integrator_node_up": ("gauge", "Whether a published LXD node is healthy"),
+    "lxd_integrator_hook_duration_seconds": ("histogram", "Time taken by hooks"),
+}
+
+
+def _labels_key(labels: Dict[str, str]) -> str:
+    return json.dumps(labels, sort_keys=True)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in sorted(labels.items())
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Registry:
+    """Metric samples saved between hooks.
+
+    Without a path, samples only live in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None, textfile_path: Optional[str] = None):
+        self._path = path
+        self.textfile_path = textfile_path
+        self._samples: Optional[Dict[str, Dict[str, object]]] = None
+        # Health probes update metrics from several threads
+        self._lock = threading.Lock()
+
+    def _metric(self, name: str) -> Dict[str, object]:
+        if self._samples is None:
+            self._samples = {}
+            if self._path and os.path.exists(self._path):
+                with open(self._path) as f:
+                    try:
+                        self._samples = json.load(f)
+                    except json.JSONDecodeError:
+                        logger.warning("discarding unreadable metrics")
+        return self._samples.setdefault(name, {})
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increment a counter."""
+        with self._lock:
+            samples = self._metric(name)
+            key = _labels_key(labels)
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge."""
+        with self._lock:
+            self._metric(name)[_labels_key(labels)] = value
+
+    def clear(self, name: str) -> None:
+        """Drop every sample of a metric."""
+        with self._lock:
+            self._metric(name).clear()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Add an observation to a histogram."""
+        with self._lock:
+            samples = self._metric(name)
+            key = _labels_key(labels)
+            histogram = samples.setdefault(
+                key, {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0, "count": 0}
+            )
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def get(self, name: str, **labels: str):
+        """Return the value of a sample, None if it was never set."""
+        with self._lock:
+            return self._metric(name).get(_labels_key(labels))
+
+    def render(self) -> str:
+        """Return the samples in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS.items():
+                samples = self._metric(name)
+                if not samples:
+                    continue
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for key, value in sorted(samples.items()):
+                    labels = json.loads(key)
+                    if kind != "histogram":
+                        lines.append("{}{} {}".format(name, _format_labels(labels), value))
+                        continue
+                    for bound, count in zip(DURATION_BUCKETS, value["buckets"]):
+                        bucket_labels = dict(labels, le=str(bound))
+                        lines.append(
+                            "{}_bucket{} {}".format(name, _format_labels(bucket_labels), count)
+                        )
+                    inf_labels = _format_labels(dict(labels, le="+Inf"))
+                    lines.append("{}_bucket{} {}".format(name, inf_labels, value["count"]))
+                    lines.append("{}_sum{} {}".format(name, _format_labels(labels), value["sum"]))
+                    lines.append(
+                        "{}_count{} {}".format(name, _format_labels(labels), value["count"])
+                    )
+        return "\n".join(lines) + "\n"
+
+    def save(self) -> None:
+        """Write the samples, and their text format for the exporter, atomically."""
+        if not self._path:
+            return
+        text = self.render()
+        with self._lock:
+            files = [(self._path, json.dumps(self._samples or {}))]
+        if self.textfile_path:
+            files.append((self.textfile_path, text))
+        for path, content in files:
+            tmp = "{}.tmp".format(path)
+            with open(os.open(tmp, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644), "w") as f:
+                f.write(content)
+            os.replace(tmp, path)
+
+
+class MetricsEndpoint(Object):
+    """Provider side of the prometheus_scrape relation.
+
+    Runs the exporter serving the metrics while the relation exists, and
+    saves the metrics at the end of every hook.
+    """
+
+    state = StoredState()
+
+    def __init__(
+        self,
+        charm: CharmBase,
+        relation_name: str,
+        registry: Registry,
+        collect: Optional[Callable[[Registry], None]] = None,
+    ):
+        super().__init__(charm, relation_name)
+        self.state.set_default(exporter_pid=0, exporter_port=0)
+        self._relation_name = relation_name
+        self._registry = registry
+        self._collect = collect
+        self._started = time.monotonic()
+
+        events = charm.on[relation_name]
+        self.framework.observe(events.relation_joined, self._on_relation_changed)
+        self.framework.observe(events.relation_changed, self._on_relation_changed)
+        self.framework.observe(events.relation_broken, self._on_relation_broken)
+        self.framework.observe(charm.on.config_changed, self._on_relation_changed)
+        self.framework.observe(charm.on.update_status, self._on_update_status)
+        self.framework.observe(charm.on.leader_elected, self._on_relation_changed)
+        self.framework.observe(self.framework.on.commit, self._on_commit)
+
+    @property
+    def port(self) -> int:
+        """Port the exporter listens on."""
+        return int(self.model.config["metrics_port"])
+
+    def _on_relation_changed(self, _):
+        if not self.model.relations[self._relation_name]:
+            return
+        self._ensure_exporter()
+        for relation in self.model.relations[self._relation_name]:
+            self._publish_jobs(relation)
+
+    def _on_update_status(self, _):
+        # Bring the exporter back if it died
+        if self.model.relations[self._relation_name]:
+            self._ensure_exporter()
+
+    def _on_relation_broken(self, _):
+        if len(self.model.relations[self._relation_name]) <= 1:
+            self._stop_exporter()
+
+    def _on_commit(self, _):
+        if self._collect is not None:
+            self._collect(self._registry)
+        hook = os.environ.get("JUJU_HOOK_NAME") or os.path.basename(
+            os.environ.get("JUJU_DISPATCH_PATH", "unknown")
+        )
+        self._registry.observe(
+            "lxd_integrator_hook_duration_seconds", time.monotonic() - self._started, hook=hook
+        )
+        try:
+            self._registry.save()
+        except OSError as e:
+            logger.warning("failed to save metrics: {}".format(e))
+
+    def _publish_jobs(self, relation) -> None:
+        """Publish the scrape job and address of the exporter."""
+        if self.model.unit.is_leader():
+            app_data = relation.data[self.model.app]
+            app_data["scrape_metadata"] = json.dumps(
+                {
+                    "model": self.model.name,
+                    "model_uuid": self.model.uuid,
+                    "application": self.model.app.name,
+                    "charm_name": self.framework.meta.name,
+                }
+            )
+            app_data["scrape_jobs"] = json.dumps(
+                [
+                    {
+                        "metrics_path": "/metrics",
+                        "static_configs": [{"targets": ["*:{}".format(self.port)]}],
+                    }
+                ]
+            )
+
+        binding = self.model.get_binding(relation)
+        address = binding.network.ingress_address if binding else None
+        unit_data = relation.data[self.model.unit]
+        if address is not None:
+            unit_data["prometheus_scrape_unit_address"] = str(address)
+        unit_data["prometheus_scrape_unit_name"] = self.model.unit.name
+
+    def _exporter_running(self) -> bool:
+        pid = self.state.exporter_pid
+        if not pid:
+            return False
+        try:
+            with open("/proc/{}/cmdline".format(pid), "rb") as f:
+                # The pid may have been reused by another process
+                return b"exporter.py" in f.read()
+        except OSError:
+            return False
+
+    def _ensure_exporter(self) -> None:
+        """Start the exporter, or restart it if it died or its port changed."""
+        if self._exporter_running() and self.state.exporter_port == self.port:
+            return
+        self._stop_exporter()
+
+        exporter = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exporter.py")
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                exporter,
+                "--port",
+                str(self.port),
+                "--textfile",
+                self._registry.textfile_path,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            # Outlive the hook
+            start_new_session=True,
+        )
+        self.state.exporter_pid = process.pid
+        self.state.exporter_port = self.port
+        logger.info("metrics exporter listening on port {}".format(self.port))
+
+    def _stop_exporter(self) -> None:
+        if self._exporter_running():
+            try:
+                os.kill(self.state.exporter_pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self.state.exporter_pid = 0
+        self.state.exporter_port = 0
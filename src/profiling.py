@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""On-demand profiling of hooks.
+
+Once enabled with the profile-hooks action, the next hooks run under cProfile
+and a sampling profiler. Each one leaves a ``.pstats`` file and a ``.folded``
+file of collapsed stacks, which flamegraph.pl or speedscope turn into a flame
+graph. Only the most recent profiles are kept.
+"""
+
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+PROFILE_DIR = "{}/profiles".format(os.getenv("JUJU_CHARM_DIR"))
+# Profiles kept on disk, the oldest ones are removed first
+MAX_PROFILES = 10
+# Seconds between two samples of the stack
+SAMPLE_INTERVAL = 0.005
+
+
+def _remaining_path() -> str:
+    return os.path.join(PROFILE_DIR, ".remaining")
+
+
+def enable(count: int) -> None:
+    """Profile the next count hooks, 0 disables profiling."""
+    os.makedirs(PROFILE_DIR, mode=0o700, exist_ok=True)
+    with open(_remaining_path(), "w") as f:
+        f.write(str(count))
+
+
+def remaining() -> int:
+    """Return how many hooks are still to be profiled."""
+    try:
+        with open(_remaining_path()) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _hook_name() -> str:
+    name = os.environ.get("JUJU_ACTION_NAME") or os.environ.get("JUJU_HOOK_NAME")
+    if not name:
+        name = os.path.basename(os.environ.get("JUJU_DISPATCH_PATH", "unknown"))
+    return name
+
+
+class _Sampler(threading.Thread):
+    """Sample the stack of a thread at a fixed interval, counting collapsed stacks."""
+
+    def __init__(self, thread_id: int):
+        super().__init__(daemon=True)
+        self._thread_id = thread_id
+        self._stop_event = threading.Event()
+        self.stacks: Dict[str, int] = {}
+
+    def run(self):
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    "{} ({}:{})".format(
+                        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+                    )
+                )
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self) -> Dict[str, int]:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+def run(main: Callable[[], None]) -> None:
+    """Run main, profiling it if hooks are to be profiled."""
+    count = remaining()
+    if count <= 0:
+        main()
+        return
+
+    import cProfile
+
+    # Counted up front, so that a crashing hook is not profiled forever
+    enable(count - 1)
+    profiler = cProfile.Profile()
+    sampler = _Sampler(threading.get_ident())
+    sampler.start()
+    try:
+        profiler.runcall(main)
+    finally:
+        stacks = sampler.stop()
+        _save(profiler, stacks)
+
+
+def _save(profiler, stacks: Dict[str, int]) -> None:
+    base = os.path.join(
+        PROFILE_DIR, "{}-{}".format(time.strftime("%Y%m%dT%H%M%S", time.gmtime()), _hook_name())
+    )
+    # Hooks finishing within the same second get a suffix
+    name, i = base, 1
+    while os.path.exists(name + ".pstats"):
+        name, i = "{}-{}".format(base, i), i + 1
+    profiler.dump_stats(name + ".pstats")
+    with open(name + ".folded", "w") as f:
+        for stack, samples in sorted(stacks.items()):
+            f.write("{} {}\n".format(stack, samples))
+    _prune()
+
+
+def profiles() -> List[str]:
+    """Return the names of the profiles kept, oldest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = [f[: -len(".pstats")] for f in os.listdir(PROFILE_DIR) if f.endswith(".pstats")]
+    return sorted(
+        names, key=lambda n: (os.stat(os.path.join(PROFILE_DIR, n + ".pstats")).st_mtime, n)
+    )
+
+
+def _prune() -> None:
+    for name in profiles()[:-MAX_PROFILES]:
+        for ext in (".pstats", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name + ext))
+            except FileNotFoundError:
+                pass
+
+
+def summary(name: str, limit: int = 20) -> str:
+    """Return the functions of a profile taking the most cumulative time."""
+    import io
+    import pstats
+
+    out = io.StringIO()
+    stats = pstats.Stats(os.path.join(PROFILE_DIR, name + ".pstats"), stream=out)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Token bucket limiting the rate of writes sent to LXD."""
+
+from typing import Optional
+
+
+class TokenBucket:
+    """Token bucket refilled at a steady rate up to a burst size.
+
+    The bucket only holds numbers and wall-clock timestamps, so that it can be
+    saved between hooks and keep limiting across them.
+    """
+
+    def __init__(
+        self, rate: float, burst: int, tokens: Optional[float] = None, updated: float = 0.0
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst if tokens is None else min(tokens, burst)
+        self.updated = updated
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, count: int, now: float) -> int:
+        """Take up to count tokens, returning how many were granted."""
+        self._refill(now)
+        granted = min(count, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+    def wait_time(self, now: float) -> float:
+        """Return the seconds until a token is available."""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def to_dict(self) -> dict:
+        """Return the state of the bucket to be saved."""
+        return {"tokens": self.tokens, "updated": self.updated}
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""Consistent hashing of requirer units across integrator units."""
+
+import bisect
+import hashlib
+from typing import Iterable
+
+# Points each member owns on the ring, evening out the share of each member
+VIRTUAL_NODES = 64
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring assigning keys to members.
+
+    Adding or removing a member only moves the keys that member gains or
+    loses, every other key keeps its owner.
+    """
+
+    def __init__(self, members: Iterable[str]):
+        points = []
+        for member in set(members):
+            for i in range(VIRTUAL_NODES):
+                points.append((_hash("{}#{}".format(member, i)), member))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._members = [m for _, m in points]
+
+    def owner(self, key: str) -> str:
+        """Return the member owning key."""
+        if not self._members:
+            raise ValueError("empty hash ring")
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._members[i]
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+#
+# (c) 2020 Canonical Ltd. All rights reserved
+#
+
+"""HTTP transports used to reach the LXD API.
+
+Kept apart from the interface so hooks that never talk to LXD don't pay
+for loading them.
+"""
+
+import errno
+import itertools
+import json
+import logging
+import os
+import selectors
+import socket
+import ssl
+import threading
+import time
+from http import client as httpclient
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning LXD could not be reached or answered garbage
+TRANSPORT_ERRORS = (OSError, httpclient.HTTPException)
+DEFAULT_PORT = 8443
+# Seconds resolved addresses are used for, the system resolver doesn't tell
+# their actual time to live
+DNS_TTL = 300
+# Seconds between connection attempts to successive addresses
+CONNECT_DELAY = 0.25
+
+
+class UnixHTTPConnection(httpclient.HTTPConnection):
+    """HTTP connection to a local LXD daemon over its unix socket."""
+
+    def __init__(self, path: str, timeout: float = 5):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = path
+
+    def connect(self):
+        """Connect to the unix socket instead of a TCP address."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class PipelinedReader:
+    """Socket stand-in sharing one buffered reader between pipelined responses.
+
+    http.client.HTTPResponse creates its own buffered file from the socket and
+    closes it once the body is read, which would drop the bytes of the next
+    responses already sitting in the buffer.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self._fp = sock.makefile("rb")
+
+    def makefile(self, *args, **kwargs):
+        """Return the shared reader."""
+        return self
+
+    def close(self):
+        """Keep the shared reader open for the next response."""
+
+    def release(self):
+        """Close the shared reader once every response has been read."""
+        self._fp.close()
+
+    def __getattr__(self, name):
+        """Delegate reads to the shared reader."""
+        return getattr(self._fp, name)
+
+
+def client_context(cert_path: str, key_path: str, server_cert_path: str) -> ssl.SSLContext:
+    """Return a TLS context authenticating to LXD with a client certificate.
+
+    Loading the certificates is the costly part of a connection, contexts are
+    meant to be shared by every connection using the same credentials.
+    """
+    sslcontext = ssl.create_default_context(cafile=server_cert_path)
+    sslcontext.load_cert_chain(certfile=cert_path, keyfile=key_path)
+    # Depending on how it was initialized, the LXD server cert can be configured
+    # with 127.0.0.1 as its CN, failing the verification
+    sslcontext.check_hostname = False
+    return sslcontext
+
+
+def split_endpoint(endpoint: str, default_port: int = DEFAULT_PORT) -> Tuple[str, int]:
+    """Return the host and port of an LXD endpoint, with or without its scheme."""
+    if "://" not in endpoint:
+        endpoint = "https://" + endpoint
+    url = urlsplit(endpoint)
+    return url.hostname or "", url.port or default_port
+
+
+def join_endpoint(host: str, port: int) -> str:
+    """Return host and port as an endpoint, the reverse of split_endpoint."""
+    return "[{}]:{}".format(host, port) if ":" in host else "{}:{}".format(host, port)
+
+
+class Dialer:
+    """Opens TCP connections to LXD, racing the addresses of its endpoints.
+
+    Connection attempts start CONNECT_DELAY apart, or as soon as the one
+    before fails, and the first to connect is used. A dead address then costs
+    no more than the delay instead of the whole timeout. Addresses of the
+    first endpoint are tried before those of its fallbacks, alternating IPv6
+    and IPv4, after the address that connected last time.
+
+    Resolved addresses are kept for ttl seconds, and used past it when the
+    name no longer resolves. The cache is a plain dictionary, so that it can be
+    kept between hooks: changed is set whenever it changes and dump() returns
+    it as JSON. Connections may be opened from several threads at once.
+    """
+
+    def __init__(
+        self,
+        cache: Dict[str, Any],
+        ttl: float = DNS_TTL,
+        delay: float = CONNECT_DELAY,
+        resolve: Callable[..., list] = socket.getaddrinfo,
+    ):
+        self.cache = cache
+        self.cache.setdefault("addresses", {})
+        # Address that connected last, by first endpoint
+        self.cache.setdefault("preferred", {})
+        self.changed = False
+        self._lock = threading.Lock()
+        self._ttl = ttl
+        self._delay = delay
+        self._resolve = resolve
+
+    def dump(self) -> str:
+        """Return the cache as JSON and clear changed."""
+        with self._lock:
+            self.changed = False
+            return json.dumps(self.cache, separators=(",", ":"), sort_keys=True)
+
+    def _addresses(self, host: str, port: int) -> List[List[Any]]:
+        """Return [family, address, port] of every address of host, from the cache if fresh."""
+        key = join_endpoint(host, port)
+        with self._lock:
+            cached = self.cache["addresses"].get(key)
+        if cached and cached[0] > time.time():
+            return cached[1]
+        try:
+            infos = self._resolve(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            if cached:
+                logger.warning("unable to resolve {}, using its stale addresses".format(host))
+                return cached[1]
+            raise
+        addresses = []
+        for family, _, _, _, sockaddr in infos:
+            address = [int(family), sockaddr[0], sockaddr[1]]
+            if address not in addresses:
+                addresses.append(address)
+        with self._lock:
+            self.cache["addresses"][key] = [time.time() + self._ttl, addresses]
+            self.changed = True
+        return addresses
+
+    def addresses(self, endpoints: Sequence[str]) -> List[List[Any]]:
+        """Return the addresses of endpoints in the order they are tried."""
+        ordered = []
+        error = None
+        for endpoint in endpoints:
+            try:
+                found = self._addresses(*split_endpoint(endpoint))
+            except socket.gaierror as e:
+                error = e
+                continue
+            # Alternate families, IPv6 first, so one broken family can't stall the others
+            by_family = [
+                [a for a in found if a[0] == socket.AF_INET6],
+                [a for a in found if a[0] != socket.AF_INET6],
+            ]
+            for pair in itertools.zip_longest(*by_family):
+                ordered.extend(a for a in pair if a and a not in ordered)
+        with self._lock:
+            preferred = self.cache["preferred"].get(endpoints[0]) if endpoints else None
+        if preferred in ordered:
+            ordered.remove(preferred)
+            ordered.insert(0, preferred)
+        if not ordered and error:
+            raise error
+        return ordered
+
+    def _prefer(self, endpoint: str, address: List[Any]) -> None:
+        """Remember the address that connected first, to try it first next time."""
+        with self._lock:
+            if address != self.cache["preferred"].get(endpoint):
+                self.cache["preferred"][endpoint] = address
+                self.changed = True
+
+    def _start(self, address: List[Any]) -> Any:
+        """Start connecting a non-blocking socket to address, or return why it can't."""
+        family, host, port = address
+        try:
+            # Fails where the address family isn't supported, as IPv6 may not be
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError as e:
+            return e
+        try:
+            sock.setblocking(False)
+            err = sock.connect_ex((host, port))
+        except OSError as e:
+            sock.close()
+            return e
+        if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            return sock
+        sock.close()
+        return OSError(err, os.strerror(err))
+
+    def connect(self, endpoints: Sequence[str], timeout: float) -> Tuple[socket.socket, str]:
+        """Return a socket connected to the first address of endpoints to answer.
+
+        Also returns the address and port connected to. Raises the last
+        connection error when none answers, or socket.timeout.
+        """
+        addresses = self.addresses(endpoints)
+        selector = selectors.DefaultSelector()
+        pending = {}
+        error = None
+        index = 0
+        start = next_start = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if index < len(addresses) and (now >= next_start or not pending):
+                    sock = self._start(addresses[index])
+                    if isinstance(sock, OSError):
+                        error = sock
+                    else:
+                        selector.register(sock, selectors.EVENT_WRITE, index)
+                        pending[sock] = index
+                    index += 1
+                    next_start = now + self._delay
+                    continue
+                if not pending:
+                    raise error or OSError("no address to connect to")
+                wait = start + timeout - now
+                if wait <= 0:
+                    raise socket.timeout("timed out")
+                if index < len(addresses):
+                    wait = min(wait, next_start - now)
+                for key, _ in selector.select(wait):
+                    sock = key.fileobj
+                    selector.unregister(sock)
+                    del pending[sock]
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err:
+                        error = OSError(err, os.strerror(err))
+                        sock.close()
+                        continue
+                    sock.settimeout(timeout)
+                    winner = addresses[key.data]
+                    self._prefer(endpoints[0], winner)
+                    return sock, join_endpoint(winner[1], winner[2])
+        finally:
+            for sock in pending:
+                sock.close()
+            selector.close()
+
+
+class ResumingHTTPSConnection(httpclient.HTTPSConnection):
+    """HTTPS connection resuming the TLS session of the previous one to its host.
+
+    An abbreviated handshake skips the certificate exchange and the key
+    signatures of a full one. Sessions are kept in a dictionary by address and
+    port, which must only be shared by connections using the same context.
+    With a dialer, the connection goes to the first of its host and fallbacks
+    to answer.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        context: ssl.SSLContext,
+        sessions: Dict[str, ssl.SSLSession],
+        timeout: float = 5,
+        on_handshake: Optional[Callable[[bool], None]] = None,
+        dialer: Optional[Dialer] = None,
+        fallbacks: Sequence[str] = (),
+    ):
+        super().__init__(host, context=context, timeout=timeout)
+        self._context = context
+        self._sessions = sessions
+        self._on_handshake = on_handshake
+        self._dialer = dialer
+        self._fallbacks = fallbacks
+        self._peer = join_endpoint(self.host, self.port)
+        if dialer:
+            self._create_connection = self._dial
+
+    def _dial(self, address, timeout, source_address=None) -> socket.socket:
+        endpoints = [join_endpoint(*address)] + list(self._fallbacks)
+        sock, self._peer = self._dialer.connect(endpoints, timeout)
+        return sock
+
+    def connect(self):
+        """Connect and handshake, offering the last session of the address."""
+        httpclient.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=self._tunnel_host or self.host,
+            session=self._sessions.get(self._peer),
+        )
+        if self._on_handshake:
+            self._on_handshake(self.sock.session_reused)
+
+    def close(self):
+        """Keep the session of the connection before closing it.
+
+        With TLS 1.3 the session tickets come after the handshake, they have
+        been received by the time the connection is done with.
+        """
+        if isinstance(self.sock, ssl.SSLSocket):
+            session = self.sock.session
+            if session is not None:
+                self._sessions[self._peer] = session
+        super().close()
+
+
+def https_connection(
+    endpoint: str,
+    sslcontext: ssl.SSLContext,
+    timeout: float = 5,
+    sessions: Optional[Dict[str, ssl.SSLSession]] = None,
+    on_handshake: Optional[Callable[[bool], None]] = None,
+    dialer: Optional[Dialer] = None,
+    fallbacks: Sequence[str] = (),
+) -> httpclient.HTTPSConnection:
+    """Return a HTTPSConnection to LXD using a context from client_context.
+
+    When given sessions, a dictionary of the TLS sessions of earlier
+    connections using the same context, the connection resumes them. When
+    given a dialer, it connects to the first of endpoint and fallbacks to
+    answer, which must all serve the same server certificate.
+    """
+    endpoint = endpoint.replace("https://", "").replace("http://", "")
+    if sessions is None and dialer is None:
+        return httpclient.HTTPSConnection(endpoint, context=sslcontext, timeout=timeout)
+    return ResumingHTTPSConnection(
+        endpoint,
+        sslcontext,
+        sessions if sessions is not None else {},
+        timeout=timeout,
+        on_handshake=on_handshake,
+        dialer=dialer,
+        fallbacks=fallbacks,
+    )
+
+
+def encode_request(
+    conn: httpclient.HTTPConnection, method: str, path: str, body: Optional[str]
+) -> bytes:
+    """Serialize a request so it can be written to an already open connection."""
+    payload = body.encode("utf-8") if body else b""
+    head = "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\n".format(
+        method, path, conn.host, len(payload)
+    )
+    if payload:
+        head += "Content-Type: application/json\r\n"
+    return head.encode("ascii") + b"\r\n" + payload
+
+
+def pipeline(
+    conn: httpclient.HTTPConnection,
+    requests: List[Tuple[str, str, Optional[str]]],
+    on_sent: Optional[Callable[[], None]] = None,
+) -> Iterator[Tuple[str, str, int, str]]:
+    """Write requests back to back on a connection and read the responses in order.
+
+    Yields the method, path, status code and decoded body of each response.
+    Stops early when the server announces it closes the connection, leaving
+    the remaining requests unanswered. on_sent is called once the requests
+    are written, before any response is read.
+    """
+    conn.connect()
+    reader = None
+    try:
+        conn.sock.sendall(b"".join(encode_request(conn, *r) for r in requests))
+        if on_sent:
+            on_sent()
+        reader = PipelinedReader(conn.sock)
+        for method, path, _ in requests:
+            response = httpclient.HTTPResponse(reader, method=method)
+            response.begin()
+            data = response.read().decode("utf-8")
+            yield method, path, response.status, data
+            if response.will_close:
+                return
+    finally:
+        if reader:
+            reader.release()
+        conn.close()
@@ -0,0 +1,28 @@
+from unittest.mock import patch
+
+import pytest
+from charm import LxdIntegratorCharm
+from ops.testing import Harness
+
+
+@pytest.fixture
+def harness(request):
+    harness = Harness(LxdIntegratorCharm)
+    request.addfinalizer(harness.cleanup)
+    harness.begin()
+    yield harness
+
+
+@pytest.fixture
+def lxd_client(harness: Harness, fake_lxd):
+    """Lxd interface configured to talk to the fake LXD over its unix socket."""
+    client = harness.charm.client
+    client.set_api_socket(fake_lxd.endpoint)
+    client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+    return client
+
+
+@pytest.fixture(autouse=True)
+def journal_path(tmp_path):
+    with patch("interface.JOURNAL_PATH", str(tmp_path / "journal")):
+        yield tmp_path / "journal"
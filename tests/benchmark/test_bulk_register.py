@@ -0,0 +1,40 @@
+import time
+
+CERT_COUNT = 500
+
+
+def test_pipelined_registration_throughput(lxd_client, fake_lxd, certificates):
+    bulk_certificates = certificates(CERT_COUNT)
+    # Baseline: a POST per certificate, each over a connection of its own
+    start = time.perf_counter()
+    for cert in bulk_certificates:
+        _, payload = lxd_client._register_payload(cert)
+        status, data = lxd_client._request(
+            "POST",
+            "/1.0/certificates",
+            body=payload,
+            headers={"Content-Type": "application/json"},
+        )
+        assert lxd_client._check_registered(status, data)
+    serial = time.perf_counter() - start
+    serial_connections = fake_lxd.connections
+
+    fake_lxd.certificates.clear()
+    start = time.perf_counter()
+    trusted = lxd_client._register_certs(bulk_certificates)
+    pipelined = time.perf_counter() - start
+    pipelined_connections = fake_lxd.connections - serial_connections
+
+    print(
+        "\n{} certificates: one connection per request {:.0f} req/s over {} connections, "
+        "pipelined {:.0f} req/s over {} connections".format(
+            CERT_COUNT,
+            CERT_COUNT / serial,
+            serial_connections,
+            CERT_COUNT / pipelined,
+            pipelined_connections,
+        )
+    )
+    assert len(trusted) == CERT_COUNT
+    assert pipelined_connections <= CERT_COUNT // 64 + 1
+    assert pipelined < serial
@@ -0,0 +1,33 @@
+import time
+
+from OpenSSL.crypto import FILETYPE_PEM, load_certificate
+
+CERT_COUNT = 2000
+
+
+def _openssl_payload(cert):
+    x509_cert = load_certificate(FILETYPE_PEM, cert)
+    name = x509_cert.get_subject().CN
+    fp = x509_cert.digest("sha256").decode("utf-8").replace(":", "").lower()
+    return fp, name
+
+
+def test_fingerprint_cost_per_certificate(harness, certificates):
+    certs = certificates(CERT_COUNT)
+    client = harness.charm.client
+
+    start = time.perf_counter()
+    expected = [_openssl_payload(cert) for cert in certs]
+    openssl = (time.perf_counter() - start) / CERT_COUNT
+
+    start = time.perf_counter()
+    payloads = [client._register_payload(cert) for cert in certs]
+    builtin = (time.perf_counter() - start) / CERT_COUNT
+
+    print(
+        "\n{} certificates: pyOpenSSL {:.1f}us/cert, built-in {:.1f}us/cert".format(
+            CERT_COUNT, openssl * 1e6, builtin * 1e6
+        )
+    )
+    assert [fp for fp, _ in payloads] == [fp for fp, _ in expected]
+    assert builtin < openssl
@@ -0,0 +1,47 @@
+import pytest
+from simulator import INTEGRATOR, REQUIRER, Simulator, unsupported_harness
+
+# Budgets of a scale-out, by number of integrator units and requirer units
+# joining: integrator hooks, requirer hooks, relation-set calls and simulated
+# seconds until every requirer unit is trusted. Counts are deterministic, the
+# budgets leave a quarter over the measured ones so that protocol changes
+# making the fan-out worse fail the gate.
+BUDGETS = {
+    (1, 10): (25, 150, 55, 15),
+    (3, 30): (235, 2400, 245, 40),
+}
+
+# The simulator relies on Harness internals, which later ops releases may change
+UNSUPPORTED = unsupported_harness()
+
+
+@pytest.mark.skipif(
+    UNSUPPORTED is not None, reason="simulator needs updating: {}".format(UNSUPPORTED)
+)
+@pytest.mark.parametrize("integrators,requirers", sorted(BUDGETS))
+def test_hook_fanout(fake_lxd, certificates, tmp_path, integrators, requirers):
+    certs = certificates(requirers + 1)
+    credentials = {
+        "lxd_endpoint": "https://1.2.3.4:8443",
+        "lxd_client_cert": certs[-1],
+        "lxd_client_key": "key",
+        "lxd_server_cert": "server",
+    }
+    simulator = Simulator(fake_lxd, str(tmp_path), credentials, integrators=integrators)
+    try:
+        report = simulator.add_requirers(certs[:requirers])
+    finally:
+        simulator.close()
+
+    print(
+        "\n{} integrator units, {} requirer units joining: {}".format(
+            integrators, requirers, report.summary()
+        )
+    )
+    integrator_hooks, requirer_hooks, relation_sets, trusted_at = BUDGETS[(integrators, requirers)]
+    assert not report.untrusted
+    assert report.lxd_requests == requirers
+    assert report.total_hooks(INTEGRATOR) <= integrator_hooks
+    assert report.total_hooks(REQUIRER) <= requirer_hooks
+    assert sum(report.relation_sets.values()) <= relation_sets
+    assert report.trusted_at <= trusted_at
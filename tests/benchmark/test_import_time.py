@@ -0,0 +1,33 @@
+import os
+import re
+import subprocess
+import sys
+
+# Import time charm.py may add on top of ops itself, in microseconds
+IMPORT_BUDGET_US = 10000
+
+
+def _import_time(module, preload, env):
+    """Return the cumulative import time of module once preload is imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}; import {}".format(preload, module)],
+        check=True,
+        stderr=subprocess.PIPE,
+        env=env,
+    )
+    for line in result.stderr.decode("utf-8").splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| {}$".format(module), line)
+        if match:
+            return int(match.group(1))
+    raise AssertionError("{} was not imported".format(module))
+
+
+def test_charm_import_time(tmp_path):
+    # Units keep the compiled charm, so compiling it must not be measured even
+    # where bytecode isn't written: the first run writes it out of the tree
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=str(tmp_path))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    # Best of a few runs to smooth out a cold page cache
+    overhead = min(_import_time("charm", preload="ops", env=env) for _ in range(5))
+    print("\ncharm.py import time on top of ops: {}us".format(overhead))
+    assert overhead < IMPORT_BUDGET_US
@@ -0,0 +1,81 @@
+import base64
+import json
+import os
+import textwrap
+import time
+import tracemalloc
+
+from jsonstream import iter_items
+
+ENTRY_COUNT = 10000
+# Share of the peak of decoding the whole body streaming may reach, about twice
+# what is measured: mostly the fingerprints collected, not the listing
+MAX_PEAK_RATIO = 0.12
+
+
+def _listing(path, count):
+    """Write a trust store listing as LXD returns it with recursion=1."""
+    metadata = []
+    for i in range(count):
+        der = os.urandom(800)
+        pem = "-----BEGIN CERTIFICATE-----\n{}\n-----END CERTIFICATE-----\n".format(
+            "\n".join(textwrap.wrap(base64.b64encode(der).decode("ascii"), 64))
+        )
+        metadata.append(
+            {
+                "certificate": pem,
+                "fingerprint": "{:064x}".format(i),
+                "name": "client-{}".format(i),
+                "projects": [],
+                "restricted": False,
+                "type": "client",
+            }
+        )
+    with open(path, "w") as f:
+        json.dump(
+            {"type": "sync", "status": "Success", "status_code": 200, "metadata": metadata}, f
+        )
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def test_streaming_listing_peak_memory(tmp_path):
+    path = str(tmp_path / "certificates.json")
+    _listing(path, ENTRY_COUNT)
+
+    def buffered():
+        with open(path, "rb") as f:
+            return {
+                entry["fingerprint"] for entry in json.loads(f.read().decode("utf-8"))["metadata"]
+            }
+
+    def streamed():
+        with open(path, "rb") as f:
+            return {entry["fingerprint"] for entry in iter_items(f)}
+
+    expected, buffered_time, buffered_peak = _measure(buffered)
+    fps, streamed_time, streamed_peak = _measure(streamed)
+
+    print(
+        "\n{} certificates ({:.1f}MiB listing): buffered {:.1f}MiB peak in {:.2f}s, "
+        "streamed {:.1f}MiB peak in {:.2f}s".format(
+            ENTRY_COUNT,
+            os.path.getsize(path) / 2**20,
+            buffered_peak / 2**20,
+            buffered_time,
+            streamed_peak / 2**20,
+            streamed_time,
+        )
+    )
+    assert fps == expected
+    assert streamed_peak < buffered_peak * MAX_PEAK_RATIO
@@ -0,0 +1,101 @@
+import json
+import time
+import tracemalloc
+
+import pytest
+
+STORE_SIZES = [1000, 10000]
+REQUIRER_COUNTS = [1, 50]
+# Budgets per certificate in the trust store, enforced as regression thresholds.
+# They leave about twice the measured cost, which includes tracemalloc's overhead.
+SYNC_CPU_PER_CERT = 1e-3
+SYNC_MEMORY_PER_CERT = 10 * 1024
+CHANGE_CPU_PER_CERT = 40e-6
+CHANGE_MEMORY_PER_CERT = 3 * 1024
+# A trusted fingerprint costs its 64 hex digits, quotes and separator
+PAYLOAD_BYTES_PER_CERT = 68
+PAYLOAD_OVERHEAD = 1024
+
+
+def _measure(fn):
+    """Run fn, returning its CPU time and peak of memory allocated meanwhile.
+
+    The CPU time is the calling thread's, leaving out the stand-in LXD serving
+    requests from other threads. Its allocations are still part of the peak.
+    """
+    tracemalloc.start()
+    start = time.thread_time()
+    try:
+        fn()
+    finally:
+        cpu = time.thread_time() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return cpu, peak
+
+
+def _payload_bytes(harness, relation_id):
+    return len(harness.get_relation_data(relation_id, harness.model.unit)["nodes"])
+
+
+@pytest.mark.parametrize("requirers", REQUIRER_COUNTS)
+@pytest.mark.parametrize("store_size", STORE_SIZES)
+def test_trust_store_scale(harness, lxd_client, fake_lxd, certificates, store_size, requirers):
+    certs = certificates(store_size + 1)
+    per_unit = store_size // requirers
+    with harness.hooks_disabled():
+        harness.update_config({"hook_time_budget": 3600})
+        id = harness.add_relation("api", "app")
+        for i in range(requirers):
+            unit = "app/{}".format(i)
+            harness.add_relation_unit(id, unit)
+            harness.update_relation_data(
+                id,
+                unit,
+                {"client_certificates": json.dumps(certs[i * per_unit : (i + 1) * per_unit])},
+            )
+
+    # Every requirer unit reconciled at once, as after the integrator restarts
+    calls, connections = len(fake_lxd.requests), fake_lxd.connections
+    sync_cpu, sync_peak = _measure(lxd_client._reconcile)
+    sync_calls = len(fake_lxd.requests) - calls
+    sync_connections = fake_lxd.connections - connections
+    assert len(fake_lxd.certificates) == store_size
+    assert not lxd_client.state.queue
+
+    # One requirer unit adding a certificate to an already large trust store
+    def change():
+        harness.update_relation_data(
+            id,
+            "app/0",
+            {"client_certificates": json.dumps(certs[:per_unit] + certs[store_size:])},
+        )
+
+    change_cpu, change_peak = _measure(change)
+    change_calls = len(fake_lxd.requests) - calls - sync_calls
+    payload = _payload_bytes(harness, id)
+
+    print(
+        "\n{} certificates, {} requirer units: sync {:.2f}s CPU, {:.1f}MiB peak, "
+        "{} calls over {} connections; change {:.3f}s CPU, {:.1f}MiB peak, {} calls; "
+        "relation payload {} bytes".format(
+            store_size,
+            requirers,
+            sync_cpu,
+            sync_peak / 2**20,
+            sync_calls,
+            sync_connections,
+            change_cpu,
+            change_peak / 2**20,
+            change_calls,
+            payload,
+        )
+    )
+    assert sync_calls == store_size
+    assert sync_connections <= store_size // 64 + 1
+    assert change_calls == 1
+    assert sync_cpu < store_size * SYNC_CPU_PER_CERT
+    assert sync_peak < store_size * SYNC_MEMORY_PER_CERT
+    assert change_cpu < store_size * CHANGE_CPU_PER_CERT
+    assert change_peak < store_size * CHANGE_MEMORY_PER_CERT
+    assert payload < (store_size + 1) * PAYLOAD_BYTES_PER_CERT + PAYLOAD_OVERHEAD
@@ -0,0 +1,101 @@
+"""Pool of client certificates for tests, generated once and cached on disk.
+
+Signing thousands of certificates, or generating a large key per requirer
+unit, dominates the run time of scale tests. The pool keeps the certificates
+generated so far in a JSON file and only signs the ones it is short of.
+"""
+
+import json
+import os
+import time
+
+# Seconds pooled certificates are valid for, and the validity they must have
+# left to be reused rather than generated again
+POOL_VALIDITY = 10 * 365 * 24 * 60 * 60
+MIN_VALIDITY = 365 * 24 * 60 * 60
+KEY_TYPES = ("rsa", "ec")
+
+
+def generate_key(key_type="rsa", key_size=1024):
+    """Return a pyOpenSSL key, RSA of key_size bits or ECDSA on P-256."""
+    from OpenSSL import crypto
+
+    if key_type == "ec":
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        return crypto.PKey.from_cryptography_key(ec.generate_private_key(ec.SECP256R1()))
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, key_size)
+    return key
+
+
+def sign_certificates(key, start, count, not_after):
+    """Return count self-signed client certificates of key, numbered from start.
+
+    They expire not_after seconds from now.
+    """
+    from OpenSSL import crypto
+
+    certs = []
+    for i in range(start, start + count):
+        cert = crypto.X509()
+        cert.get_subject().CN = "client-{}".format(i)
+        cert.set_serial_number(i + 1)
+        cert.gmtime_adj_notBefore(0)
+        cert.gmtime_adj_notAfter(not_after)
+        cert.set_issuer(cert.get_subject())
+        cert.set_pubkey(key)
+        cert.sign(key, "sha256")
+        certs.append(crypto.dump_certificate(crypto.FILETYPE_PEM, cert).decode("utf-8"))
+    return certs
+
+
+class CertificatePool:
+    """Client certificates sharing one key per key type, cached in a directory."""
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._pools = {}
+
+    def _path(self, key_type):
+        return os.path.join(self._directory, "{}.json".format(key_type))
+
+    def _load(self, key_type):
+        if key_type in self._pools:
+            return self._pools[key_type]
+        pool = None
+        try:
+            with open(self._path(key_type)) as f:
+                pool = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if pool is None or pool["not_after"] - time.time() < MIN_VALIDITY:
+            pool = {"not_after": None, "key": None, "certificates": []}
+        self._pools[key_type] = pool
+        return pool
+
+    def get(self, count, key_type="rsa"):
+        """Return count certificates and the PEM key they were all issued for."""
+        from OpenSSL import crypto
+
+        if key_type not in KEY_TYPES:
+            raise ValueError("unknown key type {}".format(key_type))
+        pool = self._load(key_type)
+        missing = count - len(pool["certificates"])
+        if missing > 0:
+            if pool["key"] is None:
+                key = generate_key(key_type)
+                pool["key"] = crypto.dump_privatekey(crypto.FILETYPE_PEM, key).decode("utf-8")
+                pool["not_after"] = time.time() + POOL_VALIDITY
+            else:
+                key = crypto.load_privatekey(crypto.FILETYPE_PEM, pool["key"])
+            validity = int(pool["not_after"] - time.time())
+            pool["certificates"].extend(
+                sign_certificates(key, len(pool["certificates"]), missing, validity)
+            )
+            os.makedirs(self._directory, exist_ok=True)
+            tmp = self._path(key_type) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(pool, f)
+            os.replace(tmp, self._path(key_type))
+        return pool["certificates"][:count], pool["key"]
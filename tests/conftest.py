@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import socketserver
+import ssl
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import certpool
+import pytest
+
+
+def make_certificates(count, key_size=1024, not_after=365 * 24 * 60 * 60, key_type="rsa"):
+    """Generate self-signed client certificates sharing a single key.
+
+    They expire not_after seconds from now.
+    """
+    return certpool.sign_certificates(
+        certpool.generate_key(key_type, key_size), 0, count, not_after
+    )
+
+
+class FakeLxd:
+    """Minimal stand-in for the LXD API served over a unix socket."""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.certificates = {}
+        # Cluster members as returned by LXD, empty when not clustered
+        self.members = []
+        self.api_extensions = []
+        # Trust tokens not used yet
+        self.trust_tokens = set()
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return "unix://{}".format(self.socket_path)
+
+    def add_certificate(self, pem, name="test"):
+        content = "".join(line for line in pem.splitlines() if "-----" not in line)
+        fp = hashlib.sha256(base64.b64decode(content)).hexdigest()
+        self.certificates[fp] = {
+            "fingerprint": fp,
+            "certificate": pem,
+            "name": name,
+            "type": "client",
+        }
+        return fp
+
+    def count(self, method, prefix=""):
+        return len([r for r in self.requests if r[0] == method and r[1].startswith(prefix)])
+
+    def handle(self, method, path, body):
+        with self._lock:
+            self.requests.append((method, path))
+        path, _, query = path.partition("?")
+        if method == "GET" and path == "/1.0":
+            return 200, {
+                "auth": "trusted",
+                "api_extensions": self.api_extensions,
+                "environment": {
+                    "server_name": "lxd_test",
+                    "server_clustered": bool(self.members),
+                },
+            }
+        if method == "GET" and path == "/1.0/cluster/members" and self.members:
+            return 200, self.members
+        if method == "GET" and path == "/1.0/certificates":
+            certificates = list(self.certificates.values())
+            filters = parse_qs(query).get("filter")
+            if filters:
+                if "api_filtering" not in self.api_extensions:
+                    return 400, "Invalid filter"
+                # Only the fingerprint eq ... or ... filters the charm sends
+                wanted = set(re.findall(r"fingerprint eq ([0-9a-f]+)", filters[0]))
+                certificates = [c for c in certificates if c["fingerprint"] in wanted]
+            if "recursion=1" in query:
+                return 200, certificates
+            return 200, ["/1.0/certificates/{}".format(c["fingerprint"]) for c in certificates]
+        if method == "POST" and path == "/1.0/certificates":
+            payload = json.loads(body)
+            pem = "-----BEGIN CERTIFICATE-----\n{}\n-----END CERTIFICATE-----\n".format(
+                payload["certificate"]
+            )
+            with self._lock:
+                if "trust_token" in payload:
+                    if payload["trust_token"] not in self.trust_tokens:
+                        return 403, "not authorized"
+                    self.trust_tokens.discard(payload["trust_token"])
+                content = base64.b64decode(payload["certificate"])
+                if hashlib.sha256(content).hexdigest() in self.certificates:
+                    return 400, "Certificate already in trust store"
+                self.add_certificate(pem, payload.get("name", ""))
+            return 200, {}
+        match = re.match(r"^/1\.0/certificates/([0-9a-f]+)$", path)
+        if match and method == "GET":
+            if match.group(1) not in self.certificates:
+                return 404, "Certificate not found"
+            return 200, self.certificates[match.group(1)]
+        if match and method == "DELETE":
+            with self._lock:
+                if self.certificates.pop(match.group(1), None) is None:
+                    return 404, "Certificate not found"
+            return 200, {}
+        return 404, "not found"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.lxd.connections += 1
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        status, metadata = self.server.lxd.handle(self.command, self.path, body)
+        if status < 400:
+            response = {"type": "sync", "status_code": status, "metadata": metadata}
+        else:
+            response = {"type": "error", "error_code": status, "error": metadata}
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="session")
+def certificate_pool(request, tmp_path_factory):
+    """Client certificates kept in the pytest cache between runs, if it is enabled."""
+    cache = getattr(request.config, "cache", None)
+    directory = cache.mkdir("certificates") if cache else tmp_path_factory.mktemp("certificates")
+    return certpool.CertificatePool(str(directory))
+
+
+@pytest.fixture
+def certificates(certificate_pool):
+    """Return a factory for client certificates.
+
+    Certificates valid for a year or more come from the pool, those with a
+    given expiry or key size are generated on the spot.
+    """
+
+    def factory(count, key_size=None, not_after=None, key_type="rsa"):
+        if key_size is None and not_after is None:
+            return certificate_pool.get(count, key_type)[0]
+        return make_certificates(
+            count, key_size or 1024, not_after or 365 * 24 * 60 * 60, key_type
+        )
+
+    return factory
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _TlsServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, context, handler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.context = context
+
+    def get_request(self):
+        sock, address = super().get_request()
+        return self.context.wrap_socket(sock, server_side=True), address
+
+
+@pytest.fixture
+def fake_lxd_tls(certificate_pool, tmp_path):
+    """Stand-in LXD served over TLS on localhost, trusting a single client certificate.
+
+    The server and client certificates and key are its server_cert,
+    client_cert and client_key attributes, its https endpoint tls_endpoint.
+    """
+    certs, key = certificate_pool.get(2, "ec")
+    lxd = FakeLxd(None)
+    lxd.server_cert, lxd.client_cert, lxd.client_key = certs[0], certs[1], key
+    (tmp_path / "lxd.crt").write_text(certs[0] + key)
+    (tmp_path / "trusted.crt").write_text(certs[1])
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(tmp_path / "lxd.crt"))
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.load_verify_locations(str(tmp_path / "trusted.crt"))
+    server = _TlsServer(context, _Handler)
+    server.lxd = lxd
+    lxd.tls_endpoint = "https://127.0.0.1:{}".format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield lxd
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_lxd():
+    tmpdir = tempfile.mkdtemp()
+    lxd = FakeLxd(os.path.join(tmpdir, "unix.socket"))
+    server = _Server(lxd.socket_path, _Handler)
+    server.lxd = lxd
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield lxd
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(tmpdir)
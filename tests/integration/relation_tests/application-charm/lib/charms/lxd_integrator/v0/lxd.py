@@ -0,0 +1,349 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Library for the requirer side of the lxd relation.
+
+This library implements the `lxd` interface documented in the README of the
+lxd-integrator charm for charms that consume LXD: it publishes the client
+certificates of the unit, keeps a cached list of the LXD nodes the provider
+published, emits an event once the certificates are trusted, picks the best
+node to talk to and keeps the `pylxd` clients it hands out for reuse.
+
+## Getting Started
+From a charm directory, fetch the library using `charmcraft`:
+
+```shell
+charmcraft fetch-lib charms.lxd_integrator.v0.lxd
+```
+
+`pylxd` is only imported when a client is requested, add it to the charm's
+`requirements.txt` file when using `LxdRequirer.get_client`.
+
+Example:
+```python
+from charms.lxd_integrator.v0.lxd import LxdRequirer
+from ops.charm import CharmBase
+from ops.main import main
+from ops.model import ActiveStatus
+
+
+class ExampleRequirerCharm(CharmBase):
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lxd = LxdRequirer(self, "lxd")
+        self.framework.observe(self.on.install, self._on_install)
+        self.framework.observe(self.lxd.on.trusted, self._on_lxd_trusted)
+
+    def _on_install(self, _):
+        self.lxd.set_client_certificates([CLIENT_CERT])
+
+    def _on_lxd_trusted(self, _):
+        client = self.lxd.get_client(CLIENT_CERT_PATH, CLIENT_KEY_PATH, verify=False)
+        client.instances.all()
+        self.unit.status = ActiveStatus()
+
+
+if __name__ == "__main__":
+    main(ExampleRequirerCharm)
+```
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import math
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple, Union
+
+from ops.charm import CharmBase, RelationEvent
+from ops.framework import EventBase, EventSource, Object, ObjectEvents, StoredState
+
+if TYPE_CHECKING:
+    from pylxd import Client
+
+# The unique Charmhub library identifier, never change it. Left empty until
+# the library is registered with `charmcraft create-lib`, see CONTRIBUTING.md
+LIBID = ""
+
+# Increment this major API version when introducing breaking changes
+LIBAPI = 0
+
+# Increment this PATCH version before using `charmcraft publish-lib` or reset
+# to 0 if you are raising the major API version
+LIBPATCH = 3
+
+logger = logging.getLogger(__name__)
+
+# Major version of the protocol this library speaks
+PROTOCOL_VERSION = "1"
+
+# Versions offered to the provider, which publishes with the highest it speaks
+SUPPORTED_VERSIONS = ["1.0", "1.1"]
+
+# Clients handed out by get_client, shared by every requirer in the process
+_CLIENTS: Dict[Tuple[str, str, str, str], "Client"] = {}
+
+
+def certificate_fingerprint(cert: str) -> str:
+    """Return the SHA-256 fingerprint of a PEM certificate, as LXD reports it."""
+    lines = cert.strip().splitlines()
+    try:
+        start = next(i for i, line in enumerate(lines) if "-----BEGIN CERTIFICATE-----" in line)
+        end = next(i for i, line in enumerate(lines) if "-----END CERTIFICATE-----" in line)
+    except StopIteration as e:
+        raise ValueError("no PEM certificate found") from e
+    body = "".join(line.strip() for line in lines[start + 1 : end])
+    return hashlib.sha256(base64.b64decode(body, validate=True)).hexdigest()
+
+
+class LxdNode:
+    """LXD node published by the provider."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        name: str = "",
+        trusted_certs_fp: Iterable[str] = (),
+        healthy: Optional[bool] = None,
+        latency_ms: Optional[float] = None,
+        load: Optional[float] = None,
+    ):
+        self.endpoint = endpoint
+        self.name = name
+        self.trusted_certs_fp = set(trusted_certs_fp)
+        self.healthy = healthy
+        self.latency_ms = latency_ms
+        self.load = load
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LxdNode":
+        """Build a node from its relation data."""
+        return cls(
+            endpoint=data["endpoint"],
+            name=data.get("name", ""),
+            trusted_certs_fp=data.get("trusted_certs_fp", []),
+            healthy=data.get("healthy"),
+            latency_ms=data.get("latency_ms"),
+            load=data.get("load"),
+        )
+
+    def to_dict(self) -> dict:
+        """Return the node as saved in the cache."""
+        data = {
+            "endpoint": self.endpoint,
+            "name": self.name,
+            "trusted_certs_fp": sorted(self.trusted_certs_fp),
+        }
+        for key in ("healthy", "latency_ms", "load"):
+            if getattr(self, key) is not None:
+                data[key] = getattr(self, key)
+        return data
+
+    def trusts(self, fingerprints: Iterable[str]) -> bool:
+        """Return whether all the given fingerprints are trusted by the node."""
+        return self.trusted_certs_fp.issuperset(fingerprints)
+
+    def _rank(self) -> tuple:
+        # Nodes known to be unhealthy go last, then the fastest and least loaded
+        # first. Nodes publishing no figures rank after those that do.
+        return (
+            self.healthy is False,
+            math.inf if self.latency_ms is None else self.latency_ms,
+            math.inf if self.load is None else self.load,
+            self.name,
+            self.endpoint,
+        )
+
+
+class LxdNodesChangedEvent(EventBase):
+    """Emitted when the nodes published by the provider change."""
+
+
+class LxdTrustedEvent(EventBase):
+    """Emitted when more nodes trust the client certificates of the unit."""
+
+    def __init__(self, handle, endpoints: Optional[List[str]] = None):
+        super().__init__(handle)
+        self.endpoints = endpoints or []
+
+    def snapshot(self) -> dict:
+        """Return a snapshot of the event."""
+        return {"endpoints": self.endpoints}
+
+    def restore(self, snapshot: dict) -> None:
+        """Restore the event from a snapshot."""
+        self.endpoints = snapshot["endpoints"]
+
+
+class LxdRequirerEvents(ObjectEvents):
+    """Events emitted by LxdRequirer."""
+
+    nodes_changed = EventSource(LxdNodesChangedEvent)
+    trusted = EventSource(LxdTrustedEvent)
+
+
+class LxdRequirer(Object):
+    """Requirer side of the lxd relation."""
+
+    on = LxdRequirerEvents()
+    _stored = StoredState()
+
+    def __init__(self, charm: CharmBase, relation_name: str = "lxd"):
+        super().__init__(charm, relation_name)
+        self._relation_name = relation_name
+        self._stored.set_default(certificates=[], nodes=[], trusted=[], expiring={})
+
+        events = charm.on[relation_name]
+        self.framework.observe(events.relation_joined, self._on_relation_joined)
+        self.framework.observe(events.relation_changed, self._on_relation_changed)
+        self.framework.observe(events.relation_departed, self._on_relation_changed)
+        self.framework.observe(events.relation_broken, self._on_relation_changed)
+
+    @property
+    def fingerprints(self) -> List[str]:
+        """Fingerprints of the client certificates of the unit."""
+        return [certificate_fingerprint(cert) for cert in self._stored.certificates]
+
+    @property
+    def nodes(self) -> List[LxdNode]:
+        """Nodes published by the provider, as of the last relation event."""
+        return [LxdNode.from_dict(node) for node in self._stored.nodes]
+
+    @property
+    def trusted_nodes(self) -> List[LxdNode]:
+        """Nodes trusting all the client certificates of the unit."""
+        fps = self.fingerprints
+        if not fps:
+            return []
+        return [node for node in self.nodes if node.trusts(fps)]
+
+    @property
+    def expiring(self) -> Dict[str, str]:
+        """Client certificates of the unit about to expire.
+
+        Maps fingerprints to their expiry, as ISO 8601 timestamps. Expired
+        certificates are removed from the trust store by the provider.
+        """
+        fps = set(self.fingerprints)
+        return {fp: expiry for fp, expiry in self._stored.expiring.items() if fp in fps}
+
+    def set_client_certificates(self, certificates: List[str]) -> None:
+        """Set the client certificates to have trusted by LXD."""
+        self._stored.certificates = list(certificates)
+        for relation in self.model.relations[self._relation_name]:
+            self._publish(relation)
+        self._refresh()
+
+    def select_node(self, trusted: bool = True) -> Optional[LxdNode]:
+        """Return the best node to connect to.
+
+        Nodes reported unhealthy are only picked when no other node is left,
+        otherwise the lowest published latency, then load, wins.
+        """
+        nodes = self.trusted_nodes if trusted else self.nodes
+        if not nodes:
+            return None
+        return min(nodes, key=LxdNode._rank)
+
+    def get_client(
+        self,
+        cert_path: str,
+        key_path: str,
+        node: Optional[LxdNode] = None,
+        verify: Union[bool, str] = True,
+    ) -> "Client":
+        """Return a pylxd client connected to a node.
+
+        The best trusted node is used unless one is given. Clients are kept for
+        the life of the process, so repeated calls reuse the same connection
+        pool instead of going through a new TLS handshake.
+        """
+        if node is None:
+            node = self.select_node()
+            if node is None:
+                raise RuntimeError("no trusted LXD node available")
+        key = (node.endpoint, cert_path, key_path, str(verify))
+        client = _CLIENTS.get(key)
+        if client is None:
+            from pylxd import Client
+
+            client = Client(endpoint=node.endpoint, cert=(cert_path, key_path), verify=verify)
+            _CLIENTS[key] = client
+        return client
+
+    def _publish(self, relation) -> None:
+        data = relation.data[self.model.unit]
+        for key, value in (
+            ("supported_versions", json.dumps(SUPPORTED_VERSIONS)),
+            ("client_certificates", json.dumps(list(self._stored.certificates))),
+        ):
+            if data.get(key) != value:
+                data[key] = value
+
+    def _on_relation_joined(self, event: RelationEvent) -> None:
+        self._publish(event.relation)
+
+    def _on_relation_changed(self, _: RelationEvent) -> None:
+        self._refresh()
+
+    def _collect_expiring(self) -> Dict[str, str]:
+        expiring = {}
+        for relation in self.model.relations[self._relation_name]:
+            if relation.app is None:
+                continue
+            for unit in relation.units:
+                try:
+                    expiring.update(json.loads(relation.data[unit].get("expiring_certs_fp", "{}")))
+                except json.JSONDecodeError:
+                    logger.warning("invalid expiring certificates from %s", unit.name)
+        return expiring
+
+    def _collect_nodes(self) -> List[LxdNode]:
+        nodes: Dict[str, LxdNode] = {}
+        for relation in self.model.relations[self._relation_name]:
+            if relation.app is None:
+                continue
+            for unit in sorted(relation.units, key=lambda u: u.name):
+                data = relation.data[unit]
+                version = data.get("version")
+                if version and version.split(".")[0] != PROTOCOL_VERSION:
+                    logger.warning("%s speaks unsupported version %s", unit.name, version)
+                    continue
+                try:
+                    published = json.loads(data.get("nodes", "[]"))
+                    # From 1.1 the trusted fingerprints are shared by all nodes
+                    shared = json.loads(data.get("trusted_certs_fp") or "null")
+                except json.JSONDecodeError:
+                    logger.warning("invalid nodes from %s", unit.name)
+                    continue
+                for entry in published:
+                    if shared is not None:
+                        entry.setdefault("trusted_certs_fp", shared)
+                    node = LxdNode.from_dict(entry)
+                    # Each provider unit publishes the same nodes, possibly
+                    # with different views of what is trusted yet
+                    if node.endpoint in nodes:
+                        nodes[node.endpoint].trusted_certs_fp |= node.trusted_certs_fp
+                    else:
+                        nodes[node.endpoint] = node
+        return sorted(nodes.values(), key=lambda n: (n.name, n.endpoint))
+
+    def _refresh(self) -> None:
+        expiring = self._collect_expiring()
+        fps = set(self.fingerprints)
+        for fp, expiry in sorted(expiring.items()):
+            if fp in fps and self._stored.expiring.get(fp) != expiry:
+                logger.warning("client certificate %s expires at %s", fp, expiry)
+        self._stored.expiring = expiring
+
+        nodes = [node.to_dict() for node in self._collect_nodes()]
+        if nodes != list(self._stored.nodes):
+            self._stored.nodes = nodes
+            self.on.nodes_changed.emit()
+
+        trusted = [node.endpoint for node in self.trusted_nodes]
+        new = [endpoint for endpoint in trusted if endpoint not in self._stored.trusted]
+        self._stored.trusted = trusted
+        if new:
+            self.on.trusted.emit(new)
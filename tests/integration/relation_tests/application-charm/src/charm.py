@@ -1,19 +1,19 @@
 #!/usr/bin/env python3
 
+import datetime
+import ipaddress
 import json
 import logging
 import tempfile
 
 import ops
-from charms.tls_certificates_interface.v3.tls_certificates import (
-    generate_ca,
-    generate_certificate,
-    generate_csr,
-    generate_private_key,
-)
+from charms.lxd_integrator.v0.lxd import LxdRequirer
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
 from ops.framework import StoredState
 from ops.model import WaitingStatus
-from pylxd import Client
 
 logger = logging.getLogger(__name__)
 
@@ -26,10 +26,12 @@ class ApplicationCharm(ops.CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
-        self._state.set_default(cert=None, key=None, lxd_nodes=[])
+        self._state.set_default(cert=None, key=None)
+        self.lxd = LxdRequirer(self, "client")
         self.framework.observe(self.on.start, self._on_start)
         self.framework.observe(self.on.client_relation_joined, self._on_client_relation_joined)
-        self.framework.observe(self.on.client_relation_changed, self._on_client_relation_changed)
+        self.framework.observe(self.lxd.on.nodes_changed, self._on_nodes_changed)
+        self.framework.observe(self.lxd.on.trusted, self._on_lxd_trusted)
 
     @property
     def public_ip(self) -> str:
@@ -44,42 +46,45 @@ class ApplicationCharm(ops.CharmBase):
     def _on_start(self, _):
         self.unit.status = ops.ActiveStatus()
 
-    def _on_client_relation_joined(self, event):
-        self._state.cert, self._state.key = self._generate_selfsigned_cert(
-            self.public_ip, self.public_ip, self.private_ip
-        )
-        relation_data = event.relation.data[self.unit]
-        relation_data["client_certificates"] = json.dumps([self._state.cert.decode("utf-8")])
-
-    def _on_client_relation_changed(self, event):
-        data = event.relation.data[event.unit]
-        self._state.lxd_nodes = json.loads(data.get("nodes", "[]"))
-        if not self._state.lxd_nodes:
-            event.defer()
+    def _on_client_relation_joined(self, _):
+        if self._state.cert is None:
+            pool = self.config.get("certificate-pool")
+            if pool:
+                pairs = json.loads(pool)
+                cert, key = pairs[int(self.unit.name.split("/")[-1]) % len(pairs)]
+            else:
+                cert, key = self._generate_selfsigned_cert(
+                    self.public_ip, self.public_ip, self.private_ip
+                )
+            self._state.cert, self._state.key = cert, key
+        self.lxd.set_client_certificates([self._state.cert])
+
+    def _on_nodes_changed(self, _):
+        if not self.lxd.nodes:
             self.unit.status = WaitingStatus("Waiting for node info")
-            return
+        elif not self.lxd.trusted_nodes:
+            logging.info("client not authenticated yet")
+            self.unit.status = WaitingStatus("Waiting for certificate to be trusted")
+
+    def _on_lxd_trusted(self, event):
         with tempfile.NamedTemporaryFile(delete=False) as cert, tempfile.NamedTemporaryFile(
             delete=False
         ) as key:
-            cert.write(self._state.cert)
+            cert.write(self._state.cert.encode("utf-8"))
             cert.close()
-            key.write(self._state.key)
+            key.write(self._state.key.encode("utf-8"))
             key.close()
             self.framework.breakpoint("tester")
-            for node in self._state.lxd_nodes:
-                trusted_clients_fp = node.get("trusted_certs_fp", [])
-                if not trusted_clients_fp:
-                    event.defer()
-                    logging.info("client not authenticated yet")
-                    return
-                client = Client(
-                    endpoint=node["endpoint"], verify=False, cert=(cert.name, key.name)
-                )
+            for node in self.lxd.trusted_nodes:
+                if node.endpoint not in event.endpoints:
+                    continue
+                client = self.lxd.get_client(cert.name, key.name, node=node, verify=False)
                 assert client.trusted, f"Client not trusted {client}"
-                logger.info(f"Successfully connected to {node['endpoint']}")
-        self.unit.status = ops.ActiveStatus()
+                logger.info(f"Successfully connected to {node.endpoint}")
+        if len(self.lxd.trusted_nodes) == len(self.lxd.nodes):
+            self.unit.status = ops.ActiveStatus()
 
-    def _generate_selfsigned_cert(self, hostname, public_ip, private_ip) -> tuple[bytes, bytes]:
+    def _generate_selfsigned_cert(self, hostname, public_ip, private_ip) -> tuple[str, str]:
         if not hostname:
             raise Exception("A hostname is required")
 
@@ -89,18 +94,33 @@ class ApplicationCharm(ops.CharmBase):
         if not private_ip:
             raise Exception("A private IP is required")
 
-        ca_key = generate_private_key(key_size=4096)
-        ca_cert = generate_ca(ca_key, hostname)
-
-        key = generate_private_key(key_size=4096)
-        csr = generate_csr(
-            private_key=key,
-            subject=hostname,
-            sans_dns=[public_ip, private_ip, hostname],
-            sans_ip=[public_ip, private_ip],
+        # An ECDSA key takes milliseconds to generate where RSA 4096 takes seconds
+        key = ec.generate_private_key(ec.SECP256R1())
+        subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+        now = datetime.datetime.utcnow()
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(subject)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=365))
+            .add_extension(
+                x509.SubjectAlternativeName(
+                    [x509.DNSName(name) for name in {hostname, public_ip, private_ip}]
+                    + [x509.IPAddress(ipaddress.ip_address(ip)) for ip in {public_ip, private_ip}]
+                ),
+                critical=False,
+            )
+            .sign(key, hashes.SHA256())
+        )
+        key_pem = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
         )
-        cert = generate_certificate(csr=csr, ca=ca_cert, ca_key=ca_key)
-        return cert, key
+        return cert.public_bytes(serialization.Encoding.PEM).decode(), key_pem.decode()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 import yaml
@@ -6,3 +7,5 @@ APPLICATION_APP_NAME = "lxd-tester"
 TEST_APP_CHARM_PATH = "tests/integration/relation_tests/application-charm"
 CHARM_NAME = yaml.safe_load(Path("metadata.yaml").read_text())["name"]
 APP_NAMES = [APPLICATION_APP_NAME, CHARM_NAME]
+# Units of the test charm to deploy, raise it for scale tests
+APPLICATION_UNITS = int(os.environ.get("LXD_TESTER_UNITS", "1"))
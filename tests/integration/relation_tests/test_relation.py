@@ -1,20 +1,30 @@
 import asyncio
+import json
 
 import pytest
-from conftest import APP_NAMES, APPLICATION_APP_NAME, CHARM_NAME, TEST_APP_CHARM_PATH
+from conftest import (
+    APP_NAMES,
+    APPLICATION_APP_NAME,
+    APPLICATION_UNITS,
+    CHARM_NAME,
+    TEST_APP_CHARM_PATH,
+)
 from pytest_operator.plugin import OpsTest
 
 
 @pytest.mark.skip_if_deployed
 @pytest.mark.abort_on_fail
-async def test_relation_lxd(ops_test: OpsTest):
+async def test_relation_lxd(ops_test: OpsTest, certificate_pool):
     charms = await ops_test.build_charms(".", TEST_APP_CHARM_PATH)
+    # Units take their client certificate from the pool rather than generating one
+    certificates, key = certificate_pool.get(APPLICATION_UNITS, key_type="ec")
     async with ops_test.fast_forward():
         await asyncio.gather(
             ops_test.model.deploy(
                 charms[APPLICATION_APP_NAME],
                 application_name=APPLICATION_APP_NAME,
-                num_units=1,
+                num_units=APPLICATION_UNITS,
+                config={"certificate-pool": json.dumps([[cert, key] for cert in certificates])},
             ),
             ops_test.model.deploy(
                 charms[CHARM_NAME],
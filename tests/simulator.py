@@ -0,0 +1,380 @@
+"""Discrete-event simulation of Juju dispatching the hooks of related units.
+
+Every write a unit makes to its relation data fires relation-changed on all
+the remote units, whose hooks may write again. How many hooks, relation-set
+calls and LXD requests a deployment change ends up costing, and how long
+until every requirer unit is trusted, can't be read from the code. The
+simulator runs the actual charms until no hook is left to run, counting them.
+
+Each unit runs in its own Harness, on a fresh charm instance for every hook
+as a hook is a new process under Juju, with deferred events emitted again
+first. Units run their hooks one at a time, in order, and in parallel with
+other units. A relation-changed hook already waiting for a remote unit is not
+queued again, it will read the latest data anyway. Time is simulated: a hook
+costs HOOK_COST, plus the relation-set calls and LXD requests it makes. A
+relation-set call is counted for every relation data key a hook changes.
+
+Harness has no public way to run any unit but the first of an application,
+nor to begin a new charm instance on the same state. UnitHarness relies on
+its internals for that, unsupported_harness tells whether they are still
+there.
+"""
+
+import contextlib
+import heapq
+import itertools
+import os
+from collections import Counter
+from unittest.mock import patch
+
+from charms.lxd_integrator.v0.lxd import LxdRequirer
+from ops import CharmBase, framework
+from ops.testing import Harness
+
+# Seconds Juju and the charm take to run a hook doing nothing
+HOOK_COST = 0.5
+# Seconds taken by a relation-set call and by a LXD API request
+RELATION_SET_COST = 0.05
+LXD_REQUEST_COST = 0.01
+# Seconds before a relation data change reaches the remote units
+DELIVERY_DELAY = 0.1
+
+INTEGRATOR = "lxd-integrator"
+REQUIRER = "requirer"
+
+REQUIRER_METADATA = """
+name: requirer
+requires:
+  lxd:
+    interface: lxd
+"""
+REQUIRER_CONFIG = """
+options:
+  certificate:
+    type: string
+    default: ""
+"""
+
+
+class RequirerCharm(CharmBase):
+    """Requirer having the certificate in its config trusted, through the library."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lxd = LxdRequirer(self, "lxd")
+        self.framework.observe(self.on.install, self._on_install)
+
+    def _on_install(self, _):
+        self.lxd.set_client_certificates([self.config["certificate"]])
+
+
+class UnitHarness(Harness):
+    """Harness of any unit of an application, not only the first one."""
+
+    def __init__(self, charm_cls, unit_name, **kwargs):
+        self._simulated_unit_name = unit_name
+        super().__init__(charm_cls, **kwargs)
+
+    @property
+    def _unit_name(self):
+        return self._simulated_unit_name
+
+    @_unit_name.setter
+    def _unit_name(self, _):
+        # Harness names its unit after the application, as its first unit
+        pass
+
+    # Harness attributes restart() uses
+    INTERNALS = ("_storage", "_charm_dir", "_meta", "_model", "_framework", "_charm")
+
+    def restart(self):
+        """Commit the state and begin a new charm instance, as a new hook process."""
+        self.framework.commit()
+        self._framework = framework.Framework(
+            self._storage, self._charm_dir, self._meta, self._model
+        )
+        self._charm = None
+        self.begin()
+        self.framework.reemit()
+
+
+def unsupported_harness():
+    """Return why UnitHarness doesn't work with the installed ops, None when it does."""
+    harness = UnitHarness(
+        RequirerCharm, "{}/1".format(REQUIRER), meta=REQUIRER_METADATA, config=REQUIRER_CONFIG
+    )
+    try:
+        missing = [name for name in UnitHarness.INTERNALS if not hasattr(harness, name)]
+        if missing:
+            return "Harness has no {}".format(", ".join(missing))
+        if harness.model.unit.name != "{}/1".format(REQUIRER):
+            return "Harness no longer names its unit after _unit_name"
+        harness.begin()
+        harness.restart()
+        if harness.charm.framework is not harness.framework:
+            return "Harness doesn't begin a charm instance on a new framework"
+    except (AttributeError, TypeError) as e:
+        return "Harness can't be restarted: {}".format(e)
+    finally:
+        harness.cleanup()
+    return None
+
+
+class Unit:
+    """A simulated unit: its harness, relation ids by name and pending hooks."""
+
+    def __init__(self, harness, directory=None):
+        self.harness = harness
+        self.name = harness.model.unit.name
+        self.app = harness.model.app.name
+        self.directory = directory
+        self.relations = {}
+        # Relation data last delivered to the remote units, by relation name and owner
+        self.published = {}
+        self.free_at = 0.0
+        # Simulated time the requirer unit was first trusted at
+        self.trusted_at = None
+        self.pending = set()
+
+    def relation_data(self):
+        """Return the relation data the unit can write, by relation id and owner."""
+        owners = [self.name]
+        if self.harness.model.unit.is_leader():
+            owners.append(self.app)
+        return {
+            (relation_id, owner): dict(self.harness.get_relation_data(relation_id, owner))
+            for relation_id in self.relations.values()
+            for owner in owners
+        }
+
+    @contextlib.contextmanager
+    def files(self):
+        """Keep the files of the integrator charm in the directory of the unit."""
+        with contextlib.ExitStack() as stack:
+            if self.directory is not None:
+                for name, path in (
+                    ("interface.JOURNAL_PATH", "journal"),
+                    ("charm.METRICS_PATH", "metrics.json"),
+                    ("charm.METRICS_TEXTFILE_PATH", "metrics.prom"),
+                ):
+                    stack.enter_context(patch(name, os.path.join(self.directory, path)))
+            yield
+
+
+class Report:
+    """What a simulated change cost, and when it settled."""
+
+    def __init__(self):
+        self.hooks = Counter()
+        self.relation_sets = Counter()
+        self.lxd_requests = 0
+        # Simulated seconds until every requirer unit was trusted, None when
+        # some never were, and until the last hook ended
+        self.trusted_at = None
+        self.quiescent_at = 0.0
+        self.untrusted = []
+
+    def total_hooks(self, app=None):
+        return sum(n for (a, _), n in self.hooks.items() if app is None or a == app)
+
+    def summary(self):
+        return (
+            "{} integrator hooks, {} requirer hooks, {} relation-set calls, "
+            "{} LXD requests, trusted after {:.1f}s, quiescent after {:.1f}s".format(
+                self.total_hooks(INTEGRATOR),
+                self.total_hooks(REQUIRER),
+                sum(self.relation_sets.values()),
+                self.lxd_requests,
+                self.trusted_at or float("inf"),
+                self.quiescent_at,
+            )
+        )
+
+
+class Simulator:
+    """Integrator units sharing one LXD, related to a growing requirer application.
+
+    lxd is the stand-in LXD of the tests, directory where the integrator
+    units keep their files and credentials the integrator config setting them.
+    """
+
+    def __init__(self, lxd, directory, credentials, integrators=1):
+        from charm import LxdIntegratorCharm
+
+        self._lxd = lxd
+        self._queue = []
+        self._seq = itertools.count()
+        self._now = 0.0
+        self._report = Report()
+        self.integrators = []
+        self.requirers = []
+        self._units = {}
+
+        names = ["{}/{}".format(INTEGRATOR, i) for i in range(integrators)]
+        for name in names:
+            harness = UnitHarness(LxdIntegratorCharm, name)
+            unit_dir = os.path.join(directory, name.replace("/", "-"))
+            os.makedirs(unit_dir)
+            unit = Unit(harness, unit_dir)
+            with harness.hooks_disabled():
+                harness.update_config(dict(credentials, lxd_api_socket=lxd.endpoint))
+                harness.set_leader(name == names[0])
+                unit.relations["peers"] = harness.add_relation("peers", INTEGRATOR)
+                for other in names:
+                    if other != name:
+                        harness.add_relation_unit(unit.relations["peers"], other)
+                unit.relations["api"] = harness.add_relation("api", REQUIRER)
+            with unit.files():
+                harness.begin()
+            self._add(unit)
+            self._schedule(unit, 0.0, ("config_changed",))
+            if harness.model.unit.is_leader():
+                self._schedule(unit, 0.0, ("leader_elected",))
+        # Deployed and settled before any requirer joins
+        self.run()
+
+    def _schedule(self, unit, at, hook):
+        if hook[0] == "relation_changed":
+            if hook in unit.pending:
+                return
+            unit.pending.add(hook)
+        heapq.heappush(self._queue, (at, next(self._seq), unit.name, hook))
+
+    def _add(self, unit):
+        self._units[unit.name] = unit
+        (self.integrators if unit.app == INTEGRATOR else self.requirers).append(unit)
+
+    def add_requirers(self, certificates):
+        """Add a requirer unit for each certificate and run until no hook is left.
+
+        Returns the Report of what it cost.
+        """
+        self._report = Report()
+        start = self._now
+        joined = []
+        for certificate in certificates:
+            name = "{}/{}".format(REQUIRER, len(self.requirers))
+            harness = UnitHarness(
+                RequirerCharm, name, meta=REQUIRER_METADATA, config=REQUIRER_CONFIG
+            )
+            unit = Unit(harness)
+            with harness.hooks_disabled():
+                harness.update_config({"certificate": certificate})
+                unit.relations["lxd"] = harness.add_relation("lxd", INTEGRATOR)
+                for integrator in self.integrators:
+                    harness.add_relation_unit(unit.relations["lxd"], integrator.name)
+                    published = integrator.published.get(("api", integrator.name))
+                    if published:
+                        harness.update_relation_data(
+                            unit.relations["lxd"], integrator.name, published
+                        )
+            harness.begin()
+            self._add(unit)
+            joined.append(unit)
+            self._schedule(unit, start, ("install",))
+            for integrator in self.integrators:
+                self._schedule(unit, start, ("relation_joined", "lxd", integrator.name))
+                self._schedule(unit, start, ("relation_changed", "lxd", integrator.name))
+                with integrator.harness.hooks_disabled():
+                    integrator.harness.add_relation_unit(integrator.relations["api"], name)
+                self._schedule(integrator, start, ("relation_joined", "api", name))
+                self._schedule(integrator, start, ("relation_changed", "api", name))
+
+        self.run()
+        report = self._report
+        report.quiescent_at -= start
+        report.untrusted = [u.name for u in joined if u.trusted_at is None]
+        if joined and not report.untrusted:
+            report.trusted_at = max(u.trusted_at for u in joined) - start
+        return report
+
+    def run(self):
+        """Run hooks until none is left."""
+        while self._queue:
+            at, seq, name, hook = heapq.heappop(self._queue)
+            unit = self._units[name]
+            if unit.free_at > at:
+                # Busy with an earlier hook, keeps its place among the unit's hooks
+                heapq.heappush(self._queue, (unit.free_at, seq, name, hook))
+                continue
+            unit.pending.discard(hook)
+            self._run_hook(unit, at, hook)
+
+    def _run_hook(self, unit, at, hook):
+        harness = unit.harness
+        requests = len(self._lxd.requests)
+        before = unit.relation_data()
+        with unit.files():
+            harness.restart()
+            self._emit(harness, hook)
+            harness.framework.commit()
+
+        sets = 0
+        for key, data in unit.relation_data().items():
+            previous = before.get(key, {})
+            sets += sum(1 for k in set(data) | set(previous) if data.get(k) != previous.get(k))
+        requests = len(self._lxd.requests) - requests
+        if unit.app != INTEGRATOR:
+            requests = 0
+        end = at + HOOK_COST + sets * RELATION_SET_COST + requests * LXD_REQUEST_COST
+        unit.free_at = end
+        self._now = max(self._now, end)
+        report = self._report
+        report.hooks[(unit.app, hook[0])] += 1
+        report.relation_sets[unit.app] += sets
+        report.lxd_requests += requests
+        report.quiescent_at = max(report.quiescent_at, end)
+        if unit.app == REQUIRER and unit.trusted_at is None and harness.charm.lxd.trusted_nodes:
+            unit.trusted_at = end
+        self._deliver(unit, end + DELIVERY_DELAY)
+
+    def _emit(self, harness, hook):
+        kind = hook[0]
+        if kind in ("install", "config_changed", "leader_elected"):
+            getattr(harness.charm.on, kind).emit()
+            return
+        _, relation_name, remote = hook
+        unit = self._units[harness.model.unit.name]
+        relation = harness.model.get_relation(relation_name, unit.relations[relation_name])
+        if "/" in remote:
+            remote_unit = harness.model.get_unit(remote)
+            remote_app = remote_unit.app
+        else:
+            remote_unit, remote_app = None, harness.model.get_app(remote)
+        event = getattr(harness.charm.on[relation_name], kind)
+        event.emit(relation, remote_app, remote_unit)
+
+    def _remotes(self, unit, relation_name):
+        """Return the units seeing the data of unit on a relation, and their relation name."""
+        if relation_name == "peers":
+            return [(u, "peers") for u in self.integrators if u is not unit]
+        if relation_name == "api":
+            return [(u, "lxd") for u in self.requirers]
+        return [(u, "api") for u in self.integrators]
+
+    def _deliver(self, unit, at):
+        """Hand the relation data unit changed to the remote units."""
+        harness = unit.harness
+        for relation_name, relation_id in unit.relations.items():
+            owners = [unit.name]
+            if harness.model.unit.is_leader():
+                owners.append(unit.app)
+            for owner in owners:
+                data = dict(harness.get_relation_data(relation_id, owner))
+                key = (relation_name, owner)
+                published = unit.published.get(key, {})
+                if data == published:
+                    continue
+                changes = {k: v for k, v in data.items() if published.get(k) != v}
+                changes.update({k: "" for k in published if k not in data})
+                unit.published[key] = data
+                for remote, remote_relation in self._remotes(unit, relation_name):
+                    with remote.harness.hooks_disabled():
+                        remote.harness.update_relation_data(
+                            remote.relations[remote_relation], owner, changes
+                        )
+                    self._schedule(remote, at, ("relation_changed", remote_relation, owner))
+
+    def close(self):
+        for unit in self.integrators + self.requirers:
+            unit.harness.cleanup()
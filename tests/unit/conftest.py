@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 import pytest
 from OpenSSL import crypto
 
@@ -46,3 +48,31 @@ def lxd_secret(tls_config):
         "skiptlsverify": False,
         "iscontrollercloud": True,
     }
+
+
+@pytest.fixture(autouse=True)
+def journal_path(tmp_path):
+    with patch("interface.JOURNAL_PATH", str(tmp_path / "journal")):
+        yield tmp_path / "journal"
+
+
+@pytest.fixture(autouse=True)
+def cert_paths(tmp_path):
+    with patch("interface.CLIENT_CERT_PATH", str(tmp_path / "client.crt")), patch(
+        "interface.CLIENT_KEY_PATH", str(tmp_path / "client.key")
+    ), patch("interface.SERVER_CERT_PATH", str(tmp_path / "server.crt")):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def metrics_paths(tmp_path):
+    with patch("charm.METRICS_PATH", str(tmp_path / "metrics.json")), patch(
+        "charm.METRICS_TEXTFILE_PATH", str(tmp_path / "metrics.prom")
+    ):
+        yield tmp_path / "metrics.prom"
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path):
+    with patch("profiling.PROFILE_DIR", str(tmp_path / "profiles")):
+        yield tmp_path / "profiles"
@@ -1,11 +1,40 @@
+import calendar
+import errno
 import json
+import os
+import socket
+import subprocess
+import sys
+import time
 from io import BytesIO
 from unittest.mock import MagicMock, patch
 
+import certificate
+import profiling
 import pytest
 from charm import LxdIntegratorCharm
-from ops import ActiveStatus, BlockedStatus
+from interface import (
+    BREAKER_COOLDOWN,
+    BREAKER_THRESHOLD,
+    CREDENTIALS_SECRET_LABEL,
+    PIPELINE_DEPTH,
+    LxdUnavailableError,
+    lookup_strategy,
+)
+from journal import CONFIRMED, INTENT, SENT, Journal
+from jsonstream import iter_items
+from OpenSSL import crypto
+from ops import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
+from ops.model import ModelError
 from ops.testing import Harness
+from sharding import HashRing
+from transport import DNS_TTL, Dialer, UnixHTTPConnection, split_endpoint
+
+
+def _response(payload, status=200):
+    f = BytesIO(json.dumps(payload).encode("utf-8"))
+    f.status = status
+    return f
 
 
 @pytest.fixture
@@ -44,7 +73,7 @@ def test_get_credentials_from_config(harness: Harness, tls_config, lxd_secret, l
             }
         )
     with patch("charm.Lxd._new_connection") as mocked_con:
-        f = BytesIO(json.dumps(lxd_response).encode("utf-8"))
+        f = _response(lxd_response)
         mocked_response = MagicMock()
         mocked_response.getresponse.return_value = f
         mocked_con.return_value = mocked_response
@@ -56,7 +85,7 @@ def test_success_on_trust(harness: Harness, lxd_secret, lxd_response):
     with patch("charm.subprocess.run") as mock_cmd, patch(
         "charm.Lxd._new_connection"
     ) as mocked_con:
-        f = BytesIO(json.dumps(lxd_response).encode("utf-8"))
+        f = _response(lxd_response)
         mocked_response = MagicMock()
         mocked_response.getresponse.return_value = f
         mocked_con.return_value = mocked_response
@@ -71,7 +100,7 @@ def test_publish_unit_data_on_relation_join(harness: Harness, lxd_secret, lxd_re
         with patch("charm.subprocess.run") as mock_cmd, patch(
             "charm.Lxd._new_connection"
         ) as mocked_con:
-            f = BytesIO(json.dumps(lxd_response).encode("utf-8"))
+            f = _response(lxd_response)
             mocked_response = MagicMock()
             mocked_response.getresponse.return_value = f
             mocked_con.return_value = mocked_response
@@ -96,17 +125,920 @@ def test_registers_cert_on_relation_change(harness: Harness, lxd_secret, lxd_res
         with patch("charm.subprocess.run") as mock_cmd, patch(
             "charm.Lxd._new_connection"
         ) as mocked_con:
-            f = BytesIO(json.dumps(lxd_response).encode("utf-8"))
+            f = _response(lxd_response)
             mocked_response = MagicMock()
             mocked_response.getresponse.return_value = f
             mocked_con.return_value = mocked_response
             mock_cmd.return_value = MagicMock(stdout=json.dumps(lxd_secret).encode("utf-8"))
             harness.charm.on.install.emit()
             harness.add_relation_unit(id, "app/0")
-    with patch("charm.Lxd._register_cert") as new_cert:
+    with patch("charm.Lxd._register_certs") as new_cert:
         app_relation_data = {
             "trusted_certs_fp": "[]",
             "client_certificates": f"[{json.dumps(tls_config[1].decode('utf-8'))}]",
         }
         harness.update_relation_data(id, "app/0", app_relation_data)
         assert new_cert.call_count == 1
+
+
+@pytest.fixture
+def related_harness(harness: Harness, lxd_secret, lxd_response):
+    relation_data = {
+        "nodes": json.dumps(
+            [{"endpoint": "https://1.2.3.4:8443", "name": "lxd_test", "trusted_certs_fp": "[]"}]
+        ),
+        "version": "1.0",
+    }
+    with harness.hooks_disabled():
+        id = harness.add_relation("api", "app")
+        harness.update_relation_data(id, harness.model.unit.name, relation_data)
+        with patch("charm.subprocess.run") as mock_cmd, patch(
+            "charm.Lxd._new_connection"
+        ) as mocked_con:
+            mocked_response = MagicMock()
+            mocked_response.getresponse.return_value = _response(lxd_response)
+            mocked_con.return_value = mocked_response
+            mock_cmd.return_value = MagicMock(stdout=json.dumps(lxd_secret).encode("utf-8"))
+            harness.charm.on.install.emit()
+            harness.add_relation_unit(id, "app/0")
+    harness.relation_id = id
+    return harness
+
+
+def test_breaker_opens_after_consecutive_failures(related_harness: Harness, tls_config):
+    harness = related_harness
+    certs = json.dumps([tls_config[1].decode("utf-8")])
+    with patch("charm.Lxd._new_connection", side_effect=ConnectionRefusedError) as mocked_con:
+        for i in range(BREAKER_THRESHOLD):
+            harness.update_relation_data(
+                harness.relation_id, "app/0", {"client_certificates": certs, "n": str(i)}
+            )
+        assert harness.charm.client.breaker_state == "open"
+        assert isinstance(harness.model.unit.status, WaitingStatus)
+        calls = mocked_con.call_count
+
+        # Further changes are folded into the pending reconciliation
+        harness.update_relation_data(harness.relation_id, "app/0", {"n": "more"})
+        assert mocked_con.call_count == calls
+    assert harness.charm.client.state.queue
+
+
+def test_breaker_half_open_reconciles_once(related_harness: Harness, tls_config):
+    harness = related_harness
+    certs = json.dumps([tls_config[1].decode("utf-8")])
+    with patch("charm.Lxd._new_connection", side_effect=ConnectionRefusedError):
+        for i in range(BREAKER_THRESHOLD):
+            harness.update_relation_data(
+                harness.relation_id, "app/0", {"client_certificates": certs, "n": str(i)}
+            )
+
+    # Still cooling down: update-status does not touch LXD
+    with patch("charm.Lxd._register_certs") as new_cert:
+        harness.charm.on.update_status.emit()
+        assert new_cert.call_count == 0
+
+    with patch("charm.Lxd._register_certs") as new_cert, patch(
+        "charm.Lxd._node_connection", side_effect=ConnectionRefusedError
+    ), patch("interface.time.time", return_value=time.time() + BREAKER_COOLDOWN):
+        harness.charm.on.update_status.emit()
+        assert new_cert.call_count == 1
+    assert not harness.charm.client.state.queue
+    assert harness.model.unit.status == ActiveStatus("")
+
+
+def test_tls_sessions_resumed(harness: Harness, fake_lxd_tls, certificates):
+    harness.update_config(
+        {
+            "lxd_endpoint": fake_lxd_tls.tls_endpoint,
+            "lxd_client_cert": fake_lxd_tls.client_cert,
+            "lxd_client_key": fake_lxd_tls.client_key,
+            "lxd_server_cert": fake_lxd_tls.server_cert,
+        }
+    )
+    assert harness.model.unit.status == ActiveStatus("")
+    client = harness.charm.client
+    metrics = client._metrics
+    assert metrics.get("lxd_integrator_tls_handshakes_total", resumed="false") == 1
+
+    id = harness.add_relation("api", "app")
+    harness.add_relation_unit(id, "app/0")
+    harness.update_relation_data(id, "app/0", {"client_certificates": json.dumps(certificates(3))})
+    assert len(fake_lxd_tls.certificates) == 3
+    assert metrics.get("lxd_integrator_tls_handshakes_total", resumed="false") == 1
+    assert metrics.get("lxd_integrator_tls_handshakes_total", resumed="true") > 0
+
+    # Sessions don't outlive the credentials they were made with
+    client._ssl_context = None
+    client._request("GET", "/1.0")
+    assert metrics.get("lxd_integrator_tls_handshakes_total", resumed="false") == 2
+
+
+def test_dialer_races_addresses_and_caches_them():
+    server = socket.create_server(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+    endpoint = "https://lxd.example:{}".format(port)
+    live = [socket.AF_INET, "127.0.0.1", port]
+    resolved = []
+
+    def resolve(host, port, type):
+        resolved.append(host)
+        # Nothing answers on the first address
+        return [
+            (socket.AF_INET, type, 6, "", ("192.0.2.1", port)),
+            (socket.AF_INET, type, 6, "", ("127.0.0.1", port)),
+        ]
+
+    dialer = Dialer({}, delay=0.05, resolve=resolve)
+    start = time.monotonic()
+    sock, peer = dialer.connect([endpoint], timeout=5)
+    sock.close()
+    server.close()
+    assert peer == "127.0.0.1:{}".format(port)
+    assert time.monotonic() - start < 1
+    assert dialer.changed
+    saved = dialer.dump()
+    assert not dialer.changed
+
+    # Kept between hooks: not resolved again, the live address tried first
+    dialer = Dialer(json.loads(saved), resolve=resolve)
+    assert dialer.addresses([endpoint])[0] == live
+    assert resolved == ["lxd.example"]
+
+    # Stale addresses are used when the name no longer resolves
+    with patch("transport.time.time", return_value=time.time() + DNS_TTL + 1):
+        dialer = Dialer(json.loads(saved), resolve=MagicMock(side_effect=socket.gaierror))
+        assert dialer.addresses([endpoint])[0] == live
+
+
+def test_dialer_skips_unsupported_address_family():
+    server = socket.create_server(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+    new_socket = socket.socket
+
+    def create(family, *args, **kwargs):
+        if family == socket.AF_INET6:
+            raise OSError(errno.EAFNOSUPPORT, os.strerror(errno.EAFNOSUPPORT))
+        return new_socket(family, *args, **kwargs)
+
+    def resolve(host, port, type):
+        return [
+            (socket.AF_INET6, type, 6, "", ("::1", port, 0, 0)),
+            (socket.AF_INET, type, 6, "", ("127.0.0.1", port)),
+        ]
+
+    dialer = Dialer({}, resolve=resolve)
+    with patch("transport.socket.socket", side_effect=create):
+        sock, peer = dialer.connect(["https://lxd.example:{}".format(port)], timeout=5)
+    sock.close()
+    server.close()
+    assert peer == "127.0.0.1:{}".format(port)
+
+
+def test_fallback_endpoint_used_when_endpoint_is_down(harness: Harness, fake_lxd_tls):
+    closed = socket.create_server(("127.0.0.1", 0))
+    down = "https://127.0.0.1:{}".format(closed.getsockname()[1])
+    closed.close()
+    harness.update_config(
+        {
+            "lxd_endpoint": down,
+            "lxd_fallback_endpoints": fake_lxd_tls.tls_endpoint,
+            "lxd_client_cert": fake_lxd_tls.client_cert,
+            "lxd_client_key": fake_lxd_tls.client_key,
+            "lxd_server_cert": fake_lxd_tls.server_cert,
+        }
+    )
+    assert harness.model.unit.status == ActiveStatus("")
+    client = harness.charm.client
+    # Still the configured endpoint that is published
+    assert client._nodes()[0]["endpoint"] == down
+    # Saved when the framework commits, not by the thread resolving
+    assert client.state.dns_cache == ""
+    harness.framework.commit()
+    preferred = json.loads(client.state.dns_cache)["preferred"]
+    assert (
+        preferred[down.replace("https://", "")][2] == split_endpoint(fake_lxd_tls.tls_endpoint)[1]
+    )
+
+    # Health probes run in threads, their addresses saved once they are done
+    client.state.dns_cache = ""
+    client._connector = None
+    harness.charm.on.update_status.emit()
+    assert down.replace("https://", "") in json.loads(client.state.dns_cache)["addresses"]
+
+
+def test_unix_socket_transport(harness: Harness, tls_config, lxd_secret, fake_lxd):
+    with harness.hooks_disabled():
+        harness.update_config(
+            {
+                "lxd_endpoint": lxd_secret["endpoint"],
+                "lxd_client_cert": tls_config[1].decode("utf-8"),
+                "lxd_client_key": tls_config[0].decode("utf-8"),
+                "lxd_server_cert": lxd_secret["credential"]["attrs"]["server-cert"],
+                "lxd_api_socket": fake_lxd.endpoint,
+            }
+        )
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+    harness.charm.on.install.emit()
+    assert harness.model.unit.status == ActiveStatus("")
+    assert isinstance(harness.charm.client._new_connection(), UnixHTTPConnection)
+
+    harness.charm.on.api_relation_joined.emit(harness.model.get_relation("api", id))
+    harness.update_relation_data(
+        id, "app/0", {"client_certificates": json.dumps([tls_config[1].decode("utf-8")])}
+    )
+    assert len(fake_lxd.certificates) == 1
+    # The HTTPS endpoint is still the one published to requirers
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert nodes[0]["endpoint"] == lxd_secret["endpoint"]
+    assert nodes[0]["trusted_certs_fp"] == list(fake_lxd.certificates)
+
+
+def test_register_certs_pipelined(harness: Harness, fake_lxd, certificates):
+    certs = certificates(3)
+    fake_lxd.add_certificate(certs[0])
+    client = harness.charm.client
+    client.set_api_socket(fake_lxd.endpoint)
+    client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+    connections = fake_lxd.connections
+
+    trusted = client._register_certs(certs)
+    assert sorted(trusted) == sorted(fake_lxd.certificates)
+    assert len(trusted) == 3
+    assert fake_lxd.count("POST") == 3
+    assert fake_lxd.connections == connections + 1
+
+
+def test_import_defers_heavy_modules():
+    code = "import json, sys; import charm; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, env=os.environ
+    )
+    modules = json.loads(result.stdout)
+    assert "OpenSSL" not in modules
+    assert "transport" not in modules
+
+
+@pytest.mark.parametrize("cert_source", ["client", "server"])
+def test_cert_fingerprint_matches_pyopenssl(harness: Harness, tls_config, lxd_secret, cert_source):
+    cert = (
+        tls_config[1].decode("utf-8")
+        if cert_source == "client"
+        else lxd_secret["credential"]["attrs"]["server-cert"]
+    )
+    x509 = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
+    fp, payload = harness.charm.client._register_payload(cert)
+    assert fp == harness.charm.client._cert_fingerprint(x509)
+    assert fp == harness.charm.client._cert_fingerprint(cert)
+    assert json.loads(payload)["name"] == x509.get_subject().CN
+    not_after = calendar.timegm(time.strptime(x509.get_notAfter().decode(), "%Y%m%d%H%M%SZ"))
+    assert harness.charm.client._cert_not_after(cert) == not_after
+
+
+def test_hash_ring_moves_only_keys_of_new_member():
+    keys = ["app/{}".format(i) for i in range(1000)]
+    before = HashRing(["lxd-integrator/0", "lxd-integrator/1", "lxd-integrator/2"])
+    after = HashRing(
+        ["lxd-integrator/0", "lxd-integrator/1", "lxd-integrator/2", "lxd-integrator/3"]
+    )
+    moved = [k for k in keys if before.owner(k) != after.owner(k)]
+    assert all(after.owner(k) == "lxd-integrator/3" for k in moved)
+    assert 150 < len(moved) < 350
+
+
+def test_peers_shard_requirer_units(harness: Harness, fake_lxd, certificates):
+    certs = certificates(6)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        harness.set_leader(True)
+        peer_id = harness.add_relation("peers", harness.model.app.name)
+        harness.add_relation_unit(peer_id, "lxd-integrator/1")
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        for i in range(6):
+            harness.add_relation_unit(id, "app/{}".format(i))
+    harness.charm.on.leader_elected.emit()
+    members = json.loads(harness.get_relation_data(peer_id, harness.model.app)["members"])
+    assert members == ["lxd-integrator/0", "lxd-integrator/1"]
+
+    ring = HashRing(members)
+    for i, cert in enumerate(certs):
+        harness.update_relation_data(
+            id, "app/{}".format(i), {"client_certificates": json.dumps([cert])}
+        )
+    owned = [i for i in range(6) if ring.owner("app/{}".format(i)) == "lxd-integrator/0"]
+    assert fake_lxd.count("POST") == len(owned)
+
+    # The peer shares what it registered, and it gets published to requirers
+    peer_fps = [client._cert_fingerprint(certs[i]) for i in range(6) if i not in owned]
+    harness.update_relation_data(peer_id, "lxd-integrator/1", {"registered": ",".join(peer_fps)})
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert nodes[0]["trusted_certs_fp"] == sorted(client._cert_fingerprint(c) for c in certs)
+    assert fake_lxd.count("POST") == len(owned)
+
+
+def test_leader_takes_over_departed_peer(harness: Harness, fake_lxd, certificates):
+    certs = certificates(6)
+    fps = sorted(certificate.fingerprint(certificate.der(c)) for c in certs)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        harness.set_leader(True)
+        peer_id = harness.add_relation("peers", harness.model.app.name)
+        harness.add_relation_unit(peer_id, "lxd-integrator/1")
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        for i in range(6):
+            harness.add_relation_unit(id, "app/{}".format(i))
+    harness.charm.on.leader_elected.emit()
+    for i, cert in enumerate(certs):
+        harness.update_relation_data(
+            id, "app/{}".format(i), {"client_certificates": json.dumps([cert])}
+        )
+    owned = fake_lxd.count("POST")
+    assert 0 < owned < 6
+
+    # The departed peer takes its registrations with it, the leader owns
+    # every requirer unit and registers their certificates again
+    harness.remove_relation_unit(peer_id, "lxd-integrator/1")
+    members = json.loads(harness.get_relation_data(peer_id, harness.model.app)["members"])
+    assert members == ["lxd-integrator/0"]
+    assert fake_lxd.count("POST") == 6
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert nodes[0]["trusted_certs_fp"] == fps
+
+
+def test_registrations_handed_over_with_requirer_units(harness: Harness, fake_lxd, certificates):
+    certs = certificates(6)
+    fps = [certificate.fingerprint(certificate.der(c)) for c in certs]
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        harness.set_leader(True)
+        peer_id = harness.add_relation("peers", harness.model.app.name)
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        for i in range(6):
+            harness.add_relation_unit(id, "app/{}".format(i))
+    harness.charm.on.leader_elected.emit()
+    for i, cert in enumerate(certs):
+        harness.update_relation_data(
+            id, "app/{}".format(i), {"client_certificates": json.dumps([cert])}
+        )
+    assert fake_lxd.count("POST") == 6
+
+    # The new peer owns some requirer units, their certificates are no
+    # longer shared as this unit's registrations
+    harness.add_relation_unit(peer_id, "lxd-integrator/1")
+    ring = HashRing(["lxd-integrator/0", "lxd-integrator/1"])
+    moved = [i for i in range(6) if ring.owner("app/{}".format(i)) == "lxd-integrator/1"]
+    assert moved
+    registered = harness.get_relation_data(peer_id, harness.model.unit)["registered"]
+    assert registered == ",".join(sorted(fps[i] for i in range(6) if i not in moved))
+
+    # Once the new owner removed a certificate its requirer unit dropped, it
+    # is not published as trusted anymore, nor when it is wanted again
+    moved_fps = [fps[i] for i in moved]
+    harness.update_relation_data(peer_id, "lxd-integrator/1", {"registered": ",".join(moved_fps)})
+    unit = "app/{}".format(moved[0])
+    harness.update_relation_data(id, unit, {"client_certificates": "[]"})
+    del fake_lxd.certificates[moved_fps[0]]
+    harness.update_relation_data(
+        peer_id, "lxd-integrator/1", {"registered": ",".join(moved_fps[1:])}
+    )
+    harness.update_relation_data(id, unit, {"client_certificates": json.dumps([certs[moved[0]]])})
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert moved_fps[0] not in nodes[0]["trusted_certs_fp"]
+    assert fake_lxd.count("POST") == 6
+
+
+def test_queue_carries_over_when_budget_is_spent(harness: Harness, fake_lxd, certificates):
+    certs = certificates(5)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        harness.update_config({"hook_time_budget": 0})
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    with patch("interface.PIPELINE_DEPTH", 2):
+        harness.update_relation_data(id, "app/0", {"client_certificates": json.dumps(certs)})
+        assert len(fake_lxd.certificates) == 2
+        assert harness.model.unit.status == MaintenanceStatus("updating trust store: 4 items left")
+
+        harness.charm.on.update_status.emit()
+        harness.charm.on.update_status.emit()
+        assert len(fake_lxd.certificates) == 5
+        # Only the publication of the fingerprints is left
+        assert list(client.state.queue) == ["publish:{}".format(id)]
+
+        harness.charm.on.update_status.emit()
+    assert not client.state.queue
+    assert harness.model.unit.status == ActiveStatus()
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert nodes[0]["trusted_certs_fp"] == sorted(fake_lxd.certificates)
+
+
+def test_retried_hook_resumes_from_journal(harness: Harness, fake_lxd, certificates, journal_path):
+    confirmed, sent, new = certificates(3)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    # A previous attempt of the hook registered two certificates, but only saw
+    # LXD's answer for one of them before failing
+    fps = [fake_lxd.add_certificate(confirmed), fake_lxd.add_certificate(sent)]
+    journal = Journal(str(journal_path))
+    journal.record("register", fps, INTENT)
+    journal.record("register", fps, SENT)
+    journal.record("register", fps[:1], CONFIRMED)
+
+    harness.update_relation_data(
+        id, "app/0", {"client_certificates": json.dumps([confirmed, sent, new])}
+    )
+    assert fake_lxd.count("POST") == 1
+    # Looked up instead, listing the trust store as it is small
+    assert fake_lxd.count("GET", "/1.0/certificates") == 1
+    assert sorted(client.state.registered) == sorted(fake_lxd.certificates)
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert nodes[0]["trusted_certs_fp"] == sorted(fake_lxd.certificates)
+    # All of them are pruned once expired, including the resumed one
+    assert sorted(fp for _, fp in client.state.expiry) == sorted(fake_lxd.certificates)
+
+
+def test_journal_compacted_to_unsettled_changes(journal_path):
+    journal = Journal(str(journal_path))
+    journal.record("register", ["a", "b", "c"], SENT)
+    journal.record("register", ["a"], CONFIRMED)
+    journal.record("unregister", ["d", "e", "f"], SENT)
+    journal.record("unregister", ["d"], CONFIRMED)
+    journal.record("unregister", ["g"], INTENT)
+
+    # The state shows a, b, d and e went through, c and f may not have
+    journal.compact({"a", "b", "f"})
+    journal = Journal(str(journal_path))
+    assert journal.with_step("register", SENT) == {"c"}
+    assert journal.with_step("unregister", SENT) == {"f"}
+    assert not journal.with_step("register", CONFIRMED)
+    assert not journal.with_step("unregister", CONFIRMED)
+    assert not journal.with_step("unregister", INTENT)
+
+
+def test_write_rate_limit_persists_across_hooks(harness: Harness, fake_lxd, certificates):
+    certs = certificates(5)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        harness.update_config({"write_rate_limit": 1.0, "write_burst": 2, "hook_time_budget": 0})
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    now = time.time()
+    with patch("interface.time.time", return_value=now):
+        harness.update_relation_data(id, "app/0", {"client_certificates": json.dumps(certs)})
+        assert fake_lxd.count("POST") == 2
+        # No token came back yet, and waiting does not fit in the budget
+        harness.charm.on.update_status.emit()
+        assert fake_lxd.count("POST") == 2
+        assert harness.model.unit.status == MaintenanceStatus(
+            "updating trust store: 4 items left (throttled)"
+        )
+    with patch("interface.time.time", return_value=now + 1.5):
+        harness.charm.on.update_status.emit()
+        assert fake_lxd.count("POST") == 3
+
+
+def test_write_rate_limit_waits_within_budget(harness: Harness, fake_lxd, certificates):
+    certs = certificates(3)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        harness.update_config({"write_rate_limit": 50.0, "write_burst": 1})
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    harness.update_relation_data(id, "app/0", {"client_certificates": json.dumps(certs)})
+    assert fake_lxd.count("POST") == 3
+    assert client.state.throttled_seconds > 0
+    assert harness.model.unit.status == ActiveStatus()
+
+
+def test_update_status_publishes_node_health(harness: Harness, fake_lxd):
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    harness.charm.on.update_status.emit()
+    node = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])[0]
+    assert node["healthy"] is True
+    assert node["latency_ms"] >= 1
+    assert fake_lxd.count("GET", "/1.0") == 2
+
+    # Relation data is left alone as long as the health does not change
+    with patch("interface.Lxd._publish", wraps=client._publish) as publish:
+        with patch("health.time.monotonic", side_effect=[0, 0.0001]):
+            harness.charm.on.update_status.emit()
+    node_before = node
+    node = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])[0]
+    assert publish.call_count == 1
+    assert node == node_before
+
+    # A single missed probe is tolerated, two in a row mark the node down
+    with patch("transport.UnixHTTPConnection.connect", side_effect=ConnectionRefusedError):
+        harness.charm.on.update_status.emit()
+        node = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])[0]
+        assert node["healthy"] is True
+        harness.charm.on.update_status.emit()
+    node = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])[0]
+    assert node["healthy"] is False
+
+
+def test_metrics_endpoint_publishes_scrape_job(harness: Harness):
+    with harness.hooks_disabled():
+        harness.set_leader(True)
+    harness.add_network("10.0.0.10")
+    with patch("metrics.subprocess.Popen") as popen:
+        popen.return_value.pid = 4242
+        id = harness.add_relation("metrics-endpoint", "prometheus")
+        harness.add_relation_unit(id, "prometheus/0")
+    jobs = json.loads(harness.get_relation_data(id, harness.model.app)["scrape_jobs"])
+    assert jobs[0]["static_configs"] == [{"targets": ["*:9120"]}]
+    unit_data = harness.get_relation_data(id, harness.model.unit)
+    assert unit_data["prometheus_scrape_unit_address"] == "10.0.0.10"
+    args = popen.call_args.args[0]
+    assert args[1].endswith("exporter.py")
+    assert args[args.index("--port") + 1] == "9120"
+    assert harness.charm.metrics_endpoint.state.exporter_pid == 4242
+
+
+def test_metrics_written_at_commit(harness: Harness, fake_lxd, certificates, metrics_paths):
+    certs = certificates(3)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    harness.update_relation_data(id, "app/0", {"client_certificates": json.dumps(certs)})
+    with patch.dict(os.environ, {"JUJU_HOOK_NAME": "api-relation-changed"}):
+        harness.framework.on.commit.emit()
+
+    text = metrics_paths.read_text()
+    assert "lxd_integrator_certificates_registered_total 3" in text
+    assert 'lxd_integrator_lxd_requests_total{code="200",method="POST"} 3' in text
+    assert 'lxd_integrator_lxd_connections_total{transport="unix"}' in text
+    assert "lxd_integrator_trust_store_certificates 3" in text
+    assert "lxd_integrator_relation_units 1" in text
+    assert 'lxd_integrator_hook_duration_seconds_count{hook="api-relation-changed"} 1' in text
+
+
+def test_profiles_next_hooks(harness: Harness, profile_dir):
+    harness.charm._on_profile_hooks_action(MagicMock(params={"count": 2}))
+
+    def hook():
+        sum(i * i for i in range(200000))
+
+    with patch("profiling.MAX_PROFILES", 1), patch.dict(
+        os.environ, {"JUJU_HOOK_NAME": "update-status"}
+    ):
+        for _ in range(3):
+            profiling.run(hook)
+    names = profiling.profiles()
+    assert len(names) == 1
+    assert "update-status" in names[0]
+    assert profiling.remaining() == 0
+    assert "hook" in (profile_dir / (names[0] + ".folded")).read_text()
+
+    event = MagicMock(params={"limit": 5})
+    harness.charm._on_get_profiles_action(event)
+    results = event.set_results.call_args.args[0]
+    assert json.loads(results["profiles"]) == names
+    assert "hook" in results["summary"]
+
+
+def test_expired_certificates_are_pruned(harness: Harness, fake_lxd, certificates):
+    day = 24 * 60 * 60
+    expiring = certificates(1, not_after=10 * day)[0]
+    lasting = certificates(1, not_after=365 * day)[0]
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    data = {"client_certificates": json.dumps([expiring, lasting])}
+    harness.update_relation_data(id, "app/0", data)
+    expiring_fp = client._cert_fingerprint(expiring)
+    warnings = json.loads(harness.get_relation_data(id, harness.model.unit)["expiring_certs_fp"])
+    assert list(warnings) == [expiring_fp]
+    assert [fp for _, fp in client.state.expiry][0] == expiring_fp
+
+    with patch("interface.time.time", return_value=time.time() + 11 * day):
+        harness.charm.on.update_status.emit()
+        assert fake_lxd.count("DELETE") == 1
+        assert expiring_fp not in fake_lxd.certificates
+        unit_data = harness.get_relation_data(id, harness.model.unit)
+        nodes = json.loads(unit_data["nodes"])
+        assert nodes[0]["trusted_certs_fp"] == [client._cert_fingerprint(lasting)]
+        assert "expiring_certs_fp" not in unit_data
+
+        # The requirer still asking for it does not get it registered again
+        harness.update_relation_data(id, "app/0", dict(data, n="1"))
+        assert fake_lxd.count("POST") == 2
+
+
+def test_cluster_registers_once_for_all_members(harness: Harness, fake_lxd, certificates):
+    fake_lxd.members = [
+        {"server_name": "lxd1", "url": "https://10.0.0.1:8443", "status": "Online"},
+        {"server_name": "lxd2", "url": "https://10.0.0.2:8443", "status": "Online"},
+        {"server_name": "lxd3", "url": "https://10.0.0.3:8443", "status": "Offline"},
+    ]
+    certs = certificates(3)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://10.0.0.1:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+
+    harness.update_relation_data(id, "app/0", {"client_certificates": json.dumps(certs)})
+    assert fake_lxd.count("POST") == len(certs)
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert [(node["endpoint"], node["name"]) for node in nodes] == [
+        ("https://10.0.0.1:8443", "lxd1"),
+        ("https://10.0.0.2:8443", "lxd2"),
+    ]
+    assert all(node["trusted_certs_fp"] == sorted(fake_lxd.certificates) for node in nodes)
+
+    # Membership is refreshed on update-status
+    fake_lxd.members[1]["status"] = "Offline"
+    with patch(
+        "interface.Lxd._node_connection",
+        side_effect=lambda endpoint: UnixHTTPConnection(fake_lxd.socket_path),
+    ):
+        harness.charm.on.update_status.emit()
+    nodes = json.loads(harness.get_relation_data(id, harness.model.unit)["nodes"])
+    assert [node["name"] for node in nodes] == ["lxd1"]
+    assert nodes[0]["healthy"] is True
+    assert fake_lxd.count("POST") == len(certs)
+
+
+def test_shared_fingerprint_table_negotiated(harness: Harness, fake_lxd, certificates):
+    fake_lxd.members = [
+        {"server_name": "lxd{}".format(i), "url": "https://10.0.0.{}:8443".format(i)}
+        for i in range(3, 0, -1)
+    ]
+    for member in fake_lxd.members:
+        member["status"] = "Online"
+    certs = certificates(2)
+    client = harness.charm.client
+    with harness.hooks_disabled():
+        client.set_api_socket(fake_lxd.endpoint)
+        client.set_credentials("https://10.0.0.1:8443", "cert", "key", "server")
+        id = harness.add_relation("api", "app")
+        harness.add_relation_unit(id, "app/0")
+        harness.add_relation_unit(id, "app/1")
+    versions = json.dumps(["1.0", "1.1"])
+    harness.update_relation_data(
+        id, "app/0", {"client_certificates": json.dumps(certs), "supported_versions": versions}
+    )
+    # A requirer unit predating the negotiation
+    harness.update_relation_data(id, "app/1", {"client_certificates": "[]"})
+
+    # Until every requirer unit speaks 1.1 each node carries the fingerprints
+    data = harness.get_relation_data(id, harness.model.unit)
+    assert data["version"] == "1.0"
+    assert "trusted_certs_fp" not in data
+    nodes = json.loads(data["nodes"])
+    assert [node["trusted_certs_fp"] for node in nodes] == [sorted(fake_lxd.certificates)] * 3
+
+    harness.update_relation_data(id, "app/1", {"supported_versions": versions})
+    data = dict(harness.get_relation_data(id, harness.model.unit))
+    assert data["version"] == "1.1"
+    assert json.loads(data["trusted_certs_fp"]) == sorted(fake_lxd.certificates)
+    nodes = json.loads(data["nodes"])
+    assert [node["name"] for node in nodes] == ["lxd1", "lxd2", "lxd3"]
+    assert all("trusted_certs_fp" not in node for node in nodes)
+
+    # Publishing again leaves the relation data untouched
+    with patch("ops.model.RelationDataContent.__setitem__") as setitem:
+        client._publish(harness.model.get_relation("api", id))
+    setitem.assert_not_called()
+    assert harness.get_relation_data(id, harness.model.unit) == data
+
+    # A unit that joins leaves the version alone until it writes its data
+    with harness.hooks_disabled():
+        harness.add_relation_unit(id, "app/2")
+    client._publish(harness.model.get_relation("api", id))
+    assert harness.get_relation_data(id, harness.model.unit) == data
+    harness.update_relation_data(id, "app/2", {"client_certificates": "[]"})
+    assert harness.get_relation_data(id, harness.model.unit)["version"] == "1.0"
+
+
+def test_credentials_kept_in_secret(
+    harness: Harness, tls_config, lxd_secret, fake_lxd, certificates
+):
+    config = {
+        "lxd_endpoint": lxd_secret["endpoint"],
+        "lxd_client_cert": tls_config[1].decode("utf-8"),
+        "lxd_client_key": tls_config[0].decode("utf-8"),
+        "lxd_server_cert": lxd_secret["credential"]["attrs"]["server-cert"],
+        "lxd_api_socket": fake_lxd.endpoint,
+    }
+    harness.update_config(config)
+    client = harness.charm.client
+    assert harness.model.unit.status == ActiveStatus("")
+    assert client.state.client_key is None
+    secret = harness.model.get_secret(label=CREDENTIALS_SECRET_LABEL)
+    assert secret.get_content()["client-key"] == config["lxd_client_key"]
+    assert client.state.credentials_revision == 1
+    assert fake_lxd.count("GET", "/1.0") == 1
+
+    # Unchanged credentials are not checked again
+    harness.update_config({"hook_time_budget": 30})
+    assert client.state.credentials_revision == 1
+    assert fake_lxd.count("GET", "/1.0") == 1
+
+    # Rotated credentials make a new revision, checked against LXD
+    harness.update_config({"lxd_client_cert": certificates(1)[0]})
+    assert client.state.credentials_revision == 2
+    assert fake_lxd.count("GET", "/1.0") == 2
+    secret = harness.model.get_secret(label=CREDENTIALS_SECRET_LABEL)
+    assert secret.get_content()["client-cert"] == harness.model.config["lxd_client_cert"]
+
+
+def test_credentials_fall_back_to_state_without_secrets(harness: Harness, fake_lxd):
+    client = harness.charm.client
+    client.set_api_socket(fake_lxd.endpoint)
+    with patch("ops.model.Unit.add_secret", side_effect=ModelError("secret-add not found")):
+        client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+    assert client.state.credentials_secret is None
+    assert client.state.client_key == "key"
+    assert client.is_ready
+    assert not client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+
+
+def _context_certificate(client):
+    """Return the client certificate the TLS context of client is built with."""
+    loaded = []
+
+    def client_context(cert, key, server_cert):
+        with open(cert) as f:
+            loaded.append(f.read())
+
+    client._ssl_context = None
+    with patch("transport.client_context", side_effect=client_context):
+        client._client_context()
+    return loaded[0]
+
+
+def test_own_identity_enrolled_with_supplied_credentials(
+    harness: Harness, tls_config, lxd_secret, fake_lxd, certificates
+):
+    supplied = tls_config[1].decode("utf-8")
+    harness.update_config(
+        {
+            "lxd_endpoint": lxd_secret["endpoint"],
+            "lxd_client_cert": supplied,
+            "lxd_client_key": tls_config[0].decode("utf-8"),
+            "lxd_server_cert": lxd_secret["credential"]["attrs"]["server-cert"],
+            "lxd_api_socket": fake_lxd.endpoint,
+            "own_client_identity": True,
+        }
+    )
+    client = harness.charm.client
+    assert harness.model.unit.status == ActiveStatus("")
+    assert list(fake_lxd.certificates) == [client.state.identity_fp]
+    identity = harness.model.get_secret(label=CREDENTIALS_SECRET_LABEL).get_content()
+    key = crypto.load_privatekey(crypto.FILETYPE_PEM, identity["identity-key"])
+    assert key.type() == crypto.TYPE_EC
+    assert _context_certificate(client) == identity["identity-cert"]
+
+    # Enrolled once
+    harness.update_config({"hook_time_budget": 30})
+    assert fake_lxd.count("POST", "/1.0/certificates") == 1
+
+    # Supplied credentials rotated: a new identity replaces the old one
+    harness.update_config({"lxd_client_cert": certificates(1)[0]})
+    assert len(fake_lxd.certificates) == 1
+    assert client.state.identity_fp in fake_lxd.certificates
+    assert client.state.identity_fp != certificate.fingerprint(
+        certificate.der(identity["identity-cert"])
+    )
+
+    harness.update_config({"own_client_identity": False})
+    assert not fake_lxd.certificates
+    assert client.state.identity_fp is None
+    assert _context_certificate(client) == harness.model.config["lxd_client_cert"]
+
+
+def test_enroll_with_trust_token(harness: Harness, lxd_secret, fake_lxd):
+    fake_lxd.trust_tokens.add("token")
+    config = {
+        "lxd_endpoint": lxd_secret["endpoint"],
+        "lxd_server_cert": lxd_secret["credential"]["attrs"]["server-cert"],
+        "lxd_api_socket": fake_lxd.endpoint,
+        "lxd_trust_token": "token",
+        "own_client_identity": True,
+    }
+    # As when cryptography is missing or unusable
+    with patch("certificate.generate_client_certificate", side_effect=TypeError):
+        harness.update_config(config)
+    assert isinstance(harness.model.unit.status, BlockedStatus)
+    assert fake_lxd.trust_tokens == {"token"}
+
+    harness.update_config(config)
+    client = harness.charm.client
+    assert harness.model.unit.status == ActiveStatus("")
+    assert client.is_ready
+    assert not fake_lxd.trust_tokens
+    credentials = harness.model.get_secret(label=CREDENTIALS_SECRET_LABEL).get_content()
+    assert list(fake_lxd.certificates) == [
+        certificate.fingerprint(certificate.der(credentials["client-cert"]))
+    ]
+    assert "identity-cert" not in credentials
+
+    # The token is not used again
+    harness.update_config({"hook_time_budget": 30})
+    assert fake_lxd.count("POST", "/1.0/certificates") == 1
+
+    # A new token replaces the identity enrolled with the previous one
+    fake_lxd.trust_tokens.add("second")
+    harness.update_config({"lxd_trust_token": "second"})
+    assert list(fake_lxd.certificates) == [client.state.identity_fp]
+    credentials = harness.model.get_secret(label=CREDENTIALS_SECRET_LABEL).get_content()
+    assert client.state.identity_fp == certificate.fingerprint(
+        certificate.der(credentials["client-cert"])
+    )
+
+    with pytest.raises(RuntimeError):
+        harness.update_config({"lxd_trust_token": "other"})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 65536])
+def test_iter_items_decodes_across_chunks(chunk_size):
+    metadata = [{"name": "\u00c5ngstr\u00f6m \U0001f600", "n": 12345.5e3}, [], None, "x", 1000000]
+    document = {"type": "sync", "status_code": 200, "metadata": metadata, "operation": ""}
+    data = json.dumps(document, indent=1, ensure_ascii=False).encode("utf-8")
+    assert list(iter_items(BytesIO(data), chunk_size=chunk_size)) == metadata
+    assert list(iter_items(BytesIO(b'{"metadata": {}, "other": [1]}'))) == []
+    assert list(iter_items(BytesIO(b"{ }"), chunk_size=chunk_size)) == []
+    with pytest.raises(ValueError):
+        list(iter_items(BytesIO(data[:-5]), chunk_size=chunk_size))
+
+
+def test_trusted_picks_cheapest_lookup(harness: Harness, fake_lxd, certificates):
+    certs = certificates(PIPELINE_DEPTH + 2)
+    trusted = {fake_lxd.add_certificate(cert) for cert in certs[2:]}
+    client = harness.charm.client
+    client.set_api_socket(fake_lxd.endpoint)
+    client.set_credentials("https://1.2.3.4:8443", "cert", "key", "server")
+    fps = [client._cert_fingerprint(cert) for cert in certs]
+
+    assert client._trusted(fps) == trusted
+    assert fake_lxd.count("GET", "/1.0/certificates") == 1
+    assert client.state.trust_store_size == len(trusted)
+    # A small delta is looked up certificate by certificate
+    assert client._trusted(fps[1:3]) == set(fps[2:3])
+    assert fake_lxd.count("GET", "/1.0/certificates") == 3
+
+    # or through a filtered list when LXD supports it
+    fake_lxd.api_extensions.append("api_filtering")
+    client.state.api_filtering = True
+    assert client._trusted(fps[1:3]) == set(fps[2:3])
+    assert fake_lxd.count("GET", "/1.0/certificates") == 4
+    assert fake_lxd.requests[-1][1].startswith("/1.0/certificates?filter=")
+
+    # Filters LXD refuses fall back on point lookups
+    fake_lxd.api_extensions.clear()
+    assert client._trusted(fps[1:3]) == set(fps[2:3])
+    assert fake_lxd.count("GET", "/1.0/certificates") == 7
+
+    entries = list(client._list("/1.0/certificates?recursion=1"))
+    assert {entry["fingerprint"] for entry in entries} == trusted
+
+    # Garbage counts against the breaker like an unreachable LXD
+    with patch("jsonstream.iter_items", side_effect=ValueError("garbage")):
+        with pytest.raises(LxdUnavailableError):
+            list(client._list("/1.0/certificates"))
+    assert client.state.breaker_failures == 1
+
+
+def test_lookup_strategy_follows_change_set():
+    assert lookup_strategy(5, 10000, filtering=False) == "point"
+    assert lookup_strategy(5, 10000, filtering=True) == "filter"
+    assert lookup_strategy(5000, 10000, filtering=False) == "list"
+    # A small trust store is listed in a single round trip
+    assert lookup_strategy(5, 20, filtering=False) == "list"
@@ -0,0 +1,158 @@
+import json
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from charms.lxd_integrator.v0 import lxd
+from charms.lxd_integrator.v0.lxd import LxdRequirer, certificate_fingerprint
+from ops import CharmBase
+from ops.testing import Harness
+
+METADATA = """
+name: requirer
+requires:
+  lxd:
+    interface: lxd
+"""
+
+
+class RequirerCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lxd = LxdRequirer(self, "lxd")
+        self.trusted = []
+        self.framework.observe(self.lxd.on.trusted, self._on_trusted)
+
+    def _on_trusted(self, event):
+        self.trusted.append(event.endpoints)
+
+
+@pytest.fixture
+def harness(request):
+    harness = Harness(RequirerCharm, meta=METADATA)
+    request.addfinalizer(harness.cleanup)
+    harness.begin()
+    yield harness
+
+
+def _nodes(*nodes):
+    return {"version": "1.0", "nodes": json.dumps(list(nodes))}
+
+
+def test_publishes_client_certificates(harness, certificates):
+    cert = certificates(1)[0]
+    rel_id = harness.add_relation("lxd", "lxd-integrator")
+    harness.charm.lxd.set_client_certificates([cert])
+
+    data = harness.get_relation_data(rel_id, harness.charm.unit.name)
+    assert json.loads(data["client_certificates"]) == [cert]
+
+
+def test_trusted_event_once_all_units_agree(harness, certificates):
+    cert = certificates(1)[0]
+    fp = certificate_fingerprint(cert)
+    harness.charm.lxd.set_client_certificates([cert])
+    rel_id = harness.add_relation("lxd", "lxd-integrator")
+    harness.add_relation_unit(rel_id, "lxd-integrator/0")
+    harness.add_relation_unit(rel_id, "lxd-integrator/1")
+
+    node = {"endpoint": "https://10.0.0.1:8443", "name": "node-1", "trusted_certs_fp": []}
+    harness.update_relation_data(rel_id, "lxd-integrator/0", _nodes(node))
+    harness.update_relation_data(rel_id, "lxd-integrator/1", _nodes(node))
+    assert harness.charm.trusted == []
+    assert [n.endpoint for n in harness.charm.lxd.nodes] == ["https://10.0.0.1:8443"]
+
+    # Registered by the integrator unit owning this requirer unit
+    harness.update_relation_data(
+        rel_id, "lxd-integrator/1", _nodes(dict(node, trusted_certs_fp=[fp]))
+    )
+    assert harness.charm.trusted == [["https://10.0.0.1:8443"]]
+
+    harness.update_relation_data(
+        rel_id, "lxd-integrator/0", _nodes(dict(node, trusted_certs_fp=[fp]))
+    )
+    assert harness.charm.trusted == [["https://10.0.0.1:8443"]]
+
+
+def test_select_node_prefers_healthy_and_fast(harness, certificates):
+    cert = certificates(1)[0]
+    fp = certificate_fingerprint(cert)
+    harness.charm.lxd.set_client_certificates([cert])
+    rel_id = harness.add_relation("lxd", "lxd-integrator")
+    harness.add_relation_unit(rel_id, "lxd-integrator/0")
+    nodes = [
+        {"endpoint": "https://a:8443", "name": "a", "trusted_certs_fp": [fp], "latency_ms": 1},
+        {
+            "endpoint": "https://b:8443",
+            "name": "b",
+            "trusted_certs_fp": [fp],
+            "latency_ms": 5,
+            "healthy": True,
+        },
+        {"endpoint": "https://c:8443", "name": "c", "trusted_certs_fp": []},
+        {"endpoint": "https://d:8443", "name": "d", "trusted_certs_fp": [fp]},
+    ]
+    harness.update_relation_data(rel_id, "lxd-integrator/0", _nodes(*nodes))
+    assert harness.charm.lxd.select_node().name == "a"
+
+    nodes[0]["healthy"] = False
+    harness.update_relation_data(rel_id, "lxd-integrator/0", _nodes(*nodes))
+    assert harness.charm.lxd.select_node().name == "b"
+    assert harness.charm.lxd.select_node(trusted=False).name == "b"
+
+
+def test_get_client_reuses_pooled_client(harness, certificates, monkeypatch):
+    cert = certificates(1)[0]
+    fp = certificate_fingerprint(cert)
+    harness.charm.lxd.set_client_certificates([cert])
+    rel_id = harness.add_relation("lxd", "lxd-integrator")
+    harness.add_relation_unit(rel_id, "lxd-integrator/0")
+    node = {"endpoint": "https://a:8443", "name": "a", "trusted_certs_fp": [fp]}
+    harness.update_relation_data(rel_id, "lxd-integrator/0", _nodes(node))
+
+    client_class = MagicMock()
+    monkeypatch.setitem(sys.modules, "pylxd", SimpleNamespace(Client=client_class))
+    monkeypatch.setattr(lxd, "_CLIENTS", {})
+
+    first = harness.charm.lxd.get_client("cert.pem", "key.pem")
+    second = harness.charm.lxd.get_client("cert.pem", "key.pem")
+    assert first is second
+    client_class.assert_called_once_with(
+        endpoint="https://a:8443", cert=("cert.pem", "key.pem"), verify=True
+    )
+
+
+def test_expiring_certificates(harness, certificates):
+    cert = certificates(1)[0]
+    fp = certificate_fingerprint(cert)
+    harness.charm.lxd.set_client_certificates([cert])
+    rel_id = harness.add_relation("lxd", "lxd-integrator")
+    harness.add_relation_unit(rel_id, "lxd-integrator/0")
+    expiring = {fp: "2030-01-01T00:00:00Z", "0" * 64: "2030-01-01T00:00:00Z"}
+    harness.update_relation_data(
+        rel_id, "lxd-integrator/0", {"expiring_certs_fp": json.dumps(expiring)}
+    )
+    assert harness.charm.lxd.expiring == {fp: "2030-01-01T00:00:00Z"}
+
+
+def test_shared_fingerprint_table(harness, certificates):
+    cert = certificates(1)[0]
+    fp = certificate_fingerprint(cert)
+    rel_id = harness.add_relation("lxd", "lxd-integrator")
+    harness.add_relation_unit(rel_id, "lxd-integrator/0")
+    harness.charm.lxd.set_client_certificates([cert])
+    data = harness.get_relation_data(rel_id, harness.charm.unit.name)
+    assert "1.1" in json.loads(data["supported_versions"])
+
+    nodes = [
+        {"endpoint": "https://a:8443", "name": "a"},
+        {"endpoint": "https://b:8443", "name": "b"},
+    ]
+    harness.update_relation_data(
+        rel_id,
+        "lxd-integrator/0",
+        {"version": "1.1", "nodes": json.dumps(nodes), "trusted_certs_fp": json.dumps([fp])},
+    )
+    assert [node.name for node in harness.charm.lxd.trusted_nodes] == ["a", "b"]
+    assert harness.charm.trusted == [["https://a:8443", "https://b:8443"]]